@@ -0,0 +1,32 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable
+
+from app.config import KommoAccount, settings
+
+logger = logging.getLogger(__name__)
+
+
+def run_for_accounts(target: Callable[[KommoAccount], object], accounts: list[KommoAccount]):
+    if len(accounts) == 1:
+        target(accounts[0])
+        return
+
+    # spawn: каждый воркер создаёт свой engine и HTTP-клиент, ничего не наследуя от родителя
+    context = multiprocessing.get_context("spawn")
+    max_workers = min(settings.ACCOUNT_WORKERS, len(accounts))
+    failed = []
+
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        futures = {executor.submit(target, account): account for account in accounts}
+        for future in as_completed(futures):
+            account = futures[future]
+            try:
+                future.result()
+            except Exception:
+                logger.exception(f"Sync of account {account.name} failed")
+                failed.append(account.name)
+
+    if failed:
+        raise RuntimeError(f"Sync failed for accounts: {', '.join(failed)}")
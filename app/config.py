@@ -1,26 +1,220 @@
+import os
+from functools import lru_cache
+from typing import Literal
+
+from pydantic import BaseModel, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
+class KommoAccount(BaseModel):
+    name: str
+    url_base: str
+    integration_id: str
+    secret_key: str
+    redirect_url: str
+    data_dir: str | None = None
+
+    @model_validator(mode="after")
+    def set_data_dir(self):
+        # У каждого аккаунта свой токен и своё состояние синхронизации
+        if self.data_dir is None:
+            self.data_dir = os.path.join("data", self.name)
+        return self
+
+    @property
+    def base_url(self) -> str:
+        return f"https://{self.url_base}.kommo.com/"
+
+    @property
+    def token_path(self) -> str:
+        return os.path.join(self.data_dir, "token.json")
+
+    @property
+    def sync_state_path(self) -> str:
+        return os.path.join(self.data_dir, "sync_state.json")
+
+    @property
+    def modified_since_path(self) -> str:
+        return os.path.join(self.data_dir, "modified_since.json")
+
+    @property
+    def reference_fingerprints_path(self) -> str:
+        return os.path.join(self.data_dir, "reference_fingerprints.json")
+
+    @property
+    def deferred_leads_path(self) -> str:
+        return os.path.join(self.data_dir, "deferred_leads.json")
+
+
 class Settings(BaseSettings):
-    DB_HOST: str
-    DB_PORT: int
-    DB_USER: str
-    DB_PASSWORD: str
+    # Бэкенд хранения: mariadb, postgresql или sqlite (DB_NAME - путь к файлу)
+    DB_DRIVER: Literal["mariadb", "postgresql", "sqlite"] = "mariadb"
+    DB_HOST: str = "localhost"
+    DB_PORT: int | None = None
+    DB_USER: str = ""
+    DB_PASSWORD: str = ""
     DB_NAME: str
+    # Часовой пояс сессии БД: в нём FROM_UNIXTIME/UNIX_TIMESTAMP переводят время Kommo в DATETIME.
+    # По умолчанию используется пояс сервера БД
+    DB_TIME_ZONE: str | None = None
+    # Повторы батча при deadlock/lock wait timeout: число попыток и начальная пауза в секундах
+    # (удваивается с каждой попыткой); после исчерпания попыток батч делится пополам
+    DB_WRITE_RETRIES: int = 5
+    DB_RETRY_BACKOFF: float = 0.1
+    # Параллельные потоки записи батчей, каждый со своим соединением; строки делятся по id % N
+    DB_WRITERS: int = 1
+
+    # Один аккаунт задаётся старыми переменными, несколько - через KOMMO_ACCOUNTS (JSON)
+    KOMMO_SECRET_KEY: str | None = None
+    KOMMO_INTEGRATION_ID: str | None = None
+    KOMMO_REDIRECT_URL: str | None = None
+    KOMMO_URL_BASE: str | None = None
+    KOMMO_ACCOUNTS: list[KommoAccount] = []
+    ACCOUNT_WORKERS: int = 4
+
+    # Daemon mode: интервалы инкрементальной синхронизации в секундах
+    SYNC_INTERVALS: dict[str, int] = {
+        "users": 3600,
+        "pipelines": 86400,
+        "companies": 600,
+        "contacts": 300,
+        "leads": 60,
+        "tasks": 300,
+        "events": 300,
+    }
+    SYNC_JITTER: float = 0.1
+    SYNC_OVERLAP_SECONDS: int = 60
+    DAEMON_WORKERS: int = 2
+    # В инкрементальном режиме подтягивать контакты и компании из _embedded сделок по id
+    HARVEST_EMBEDDED: bool = True
+
+    # If-Modified-Since для справочных данных (users, pipelines, companies)
+    CONDITIONAL_REQUESTS: bool = True
+    # Запрашивать следующую страницу списка, пока обрабатывается текущая
+    KOMMO_PREFETCH_PAGES: bool = True
+
+    # HTTP-клиент Kommo: HTTP/2 (нужен пакет h2), пул keep-alive соединений и таймауты в секундах
+    KOMMO_HTTP2: bool = True
+    KOMMO_MAX_CONNECTIONS: int = 10
+    KOMMO_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    KOMMO_KEEPALIVE_EXPIRY: float = 60.0
+    KOMMO_TIMEOUT: float = 60.0
+    KOMMO_CONNECT_TIMEOUT: float = 10.0
+    # Запросов в секунду на аккаунт (0 - без ограничения)
+    KOMMO_RATE_LIMIT: float = 7.0
+
+    # Полная выгрузка окнами по created_at, которые качаются параллельно: "leads", "events"
+    SHARDED_FETCH: list[str] = []
+    SHARD_WORKERS: int = 4
+    # Целевой размер окна в страницах; окно, в котором страниц больше, делится пополам
+    SHARD_PAGES_PER_WINDOW: int = 20
 
-    KOMMO_SECRET_KEY: str
-    KOMMO_INTEGRATION_ID: str
-    KOMMO_REDIRECT_URL: str
-    KOMMO_URL_BASE: str
+    # Фильтры событий на стороне Kommo: filter[type][] и filter[entity][]; пустой список - все.
+    # Например, ["lead_status_changed", "custom_field_123_value_changed"] и ["lead"]
+    EVENT_TYPES: list[str] = []
+    EVENT_ENTITIES: list[str] = []
+    # Параллельные потоки выгрузки по типам событий (1 - все типы одним обходом)
+    EVENT_TYPE_STREAMS: int = 1
+
+    # Сколько месячных партиций events создавать заранее
+    EVENT_PARTITIONS_AHEAD: int = 2
+    # Архивация партиций events старше горизонта: "file" (ndjson.gz) или "table" (events_archive_*)
+    EVENTS_RETENTION_MONTHS: int = 12
+    EVENTS_ARCHIVE_MODE: Literal["file", "table"] = "file"
+    EVENTS_ARCHIVE_DIR: str = "data/archive"
+
+    # Что делать со ссылками сделки на отсутствующих родителей: null, defer или fetch
+    LEAD_FK_POLICIES: dict[str, str] = {
+        "responsible_user_id": "fetch",
+        "status_id": "fetch",
+        "pipeline_id": "fetch",
+        "loss_reason_id": "null",
+        "company_id": "fetch",
+        "contact_id": "fetch",
+    }
+
+    # Копия синхронизируемых данных в Parquet для аналитики (нужен pyarrow, extra parquet); None - выключено.
+    # Удалённые из БД строки (значения доп. полей) пишутся надгробиями с _deleted = true
+    PARQUET_DIR: str | None = None
+    PARQUET_MAX_BUFFERED_ROWS: int = 50000
+    PARQUET_FLUSH_SECONDS: int = 300
+
+    # Параллельная выгрузка сделок по воронкам (1 - все воронки одним обходом)
+    LEAD_PIPELINE_WORKERS: int = 1
+    # Воронки, сделки которых выгружаются первыми
+    LEAD_PIPELINE_PRIORITY: list[int] = []
+    # Daemon mode: свои интервалы для отдельных воронок ({pipeline_id: секунды}); остальные
+    # воронки синхронизирует задача leads с интервалом из SYNC_INTERVALS
+    LEAD_PIPELINE_INTERVALS: dict[int, int] = {}
+
+    # Спул между выгрузкой и БД: страницы Kommo пишутся в сжатые NDJSON-сегменты, а загрузчик
+    # переносит их в базу; None - выгрузка пишет в БД напрямую
+    SPOOL_DIR: str | None = None
+    SPOOL_SEGMENT_ROWS: int = 50000
+    # Сколько дней хранить уже загруженные сегменты для повторной загрузки (--spool-replay)
+    SPOOL_RETENTION_DAYS: int = 7
+
+    # Значения всех доп. полей сделок, контактов и компаний в custom_field_values
+    STORE_CUSTOM_FIELD_VALUES: bool = True
+
+    # Сверка с Kommo (--verify): размер диапазона id, по которому считается общий хеш
+    RECONCILE_RANGE_SIZE: int = 1000
+
+    # Количество процессов для конвертации страниц сделок (0 - в текущем процессе)
+    CONVERT_WORKERS: int = 0
+
+    @model_validator(mode="after")
+    def check_accounts(self):
+        legacy_fields = (
+            self.KOMMO_SECRET_KEY,
+            self.KOMMO_INTEGRATION_ID,
+            self.KOMMO_REDIRECT_URL,
+            self.KOMMO_URL_BASE,
+        )
+        if not self.KOMMO_ACCOUNTS and not all(legacy_fields):
+            raise ValueError("Either KOMMO_ACCOUNTS or all KOMMO_* account settings must be set")
+        return self
 
     @property
     def DATABASE_URL(self):
-        return (
-            f"mysql://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:"
-            f"{self.DB_PORT}/{self.DB_NAME}?charset=utf8mb4"
-        )
+        from app.db.backends import get_backend
+
+        return get_backend(self.DB_DRIVER).build_url(self)
+
+    @property
+    def accounts(self) -> list[KommoAccount]:
+        if self.KOMMO_ACCOUNTS:
+            return self.KOMMO_ACCOUNTS
+
+        return [
+            KommoAccount(
+                name=self.KOMMO_URL_BASE,
+                url_base=self.KOMMO_URL_BASE,
+                integration_id=self.KOMMO_INTEGRATION_ID,
+                secret_key=self.KOMMO_SECRET_KEY,
+                redirect_url=self.KOMMO_REDIRECT_URL,
+                data_dir="data",
+            )
+        ]
+
+    def get_account(self, name: str) -> KommoAccount:
+        for account in self.accounts:
+            if account.name == name:
+                return account
+        raise KeyError(f"Unknown Kommo account: {name}")
 
     model_config = SettingsConfigDict(env_file=".env")
 
 
-settings = Settings()
+@lru_cache
+def get_settings() -> Settings:
+    return Settings()
+
+
+class LazySettings:
+    # Settings() читает .env и валидирует поля при первом обращении, а не при импорте модуля
+    def __getattr__(self, name):
+        return getattr(get_settings(), name)
+
+
+settings: Settings = LazySettings()
@@ -0,0 +1,251 @@
+import logging
+import random
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from datetime import datetime
+from typing import Callable
+
+from httpx import Client
+
+from app.config import KommoAccount, settings
+from app.db.base import session_maker
+from app.db.parquet_sink import open_parquet_sink
+from app.db.repositories import ContactRepository, LeadRepository
+from app.export_filter import ExportFilter
+from app.kommo.account import AccountManager
+from app.kommo.auth import TokenManager
+from app.kommo.companies import CompanyManager
+from app.kommo.contacts import ContactManager
+from app.kommo.leads import LeadManager
+from app.kommo.pipelines import PipelineManager
+from app.kommo.tasks import TaskManager
+from app.kommo.transport import create_http_client
+from app.kommo.users import UserManager
+from app.reference_cache import ReferenceCache
+from app.stages.common import get_modified_since_state, load_known_ids
+from app.stages.companies import export_companies
+from app.stages.contacts import export_contacts
+from app.stages.events import build_event_manager, export_events
+from app.stages.leads import (
+    build_lead_fk_resolver,
+    export_deferred_leads,
+    export_lead_neighbours,
+    export_leads,
+    export_leads_by_pipeline,
+    get_lead_pipeline_ids,
+)
+from app.stages.pipelines import export_pipelines
+from app.stages.tasks import export_tasks
+from app.stages.users import export_users
+from app.sync_state import SyncState
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SyncJob:
+    name: str
+    interval: int
+    sync: Callable[[int | None], object]
+    state: SyncState
+    next_run_at: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def schedule_next(self, jitter: float) -> None:
+        delay = self.interval * (1 + random.uniform(-jitter, jitter))
+        self.next_run_at = time.monotonic() + delay
+
+    def run(self) -> None:
+        # Не запускаем задачу, пока предыдущий запуск этой же сущности не завершился
+        if not self._lock.acquire(blocking=False):
+            logger.warning(f"Sync of {self.name} is still running, skipping this run")
+            return
+
+        try:
+            started_at = int(datetime.now().timestamp())
+            last_sync = self.state.get_last_sync(self.name)
+            updated_from = last_sync - settings.SYNC_OVERLAP_SECONDS if last_sync else None
+
+            logger.info(f"Syncing {self.name} (updated_from={updated_from})")
+            self.sync(updated_from)
+            self.state.set_last_sync(self.name, started_at)
+        except Exception:
+            logger.exception(f"Sync of {self.name} failed")
+        finally:
+            self._lock.release()
+
+
+def build_jobs(
+    token_manager: TokenManager,
+    http_client: Client,
+    state: SyncState,
+    account_id: int,
+    modified_since_state: SyncState | None = None,
+    reference_cache: ReferenceCache | None = None,
+    deferred_leads_path: str | None = None,
+) -> list[SyncJob]:
+    user_manager = UserManager(token_manager, http_client, modified_since_state)
+    pipeline_manager = PipelineManager(token_manager, http_client, modified_since_state)
+    company_manager = CompanyManager(token_manager, http_client, modified_since_state)
+    contact_manager = ContactManager(token_manager, http_client)
+    lead_manager = LeadManager(token_manager, http_client)
+    task_manager = TaskManager(token_manager, http_client)
+    event_manager = build_event_manager(token_manager, http_client)
+    # Один резолвер на всё время работы: отложенные сделки дозаписываются следующими запусками,
+    # а индексы известных id перечитываются в начале каждого запуска: справочники меняют другие задачи
+    fk_resolver = build_lead_fk_resolver(
+        user_manager,
+        pipeline_manager,
+        contact_manager,
+        company_manager,
+        account_id,
+        reference_cache,
+    )
+
+    def harvest_refs(refs):
+        if settings.HARVEST_EMBEDDED:
+            export_lead_neighbours(contact_manager, company_manager, refs, fk_resolver)
+
+    def retry_deferred_leads():
+        if deferred_leads_path:
+            export_deferred_leads(lead_manager, deferred_leads_path, reference_cache, fk_resolver)
+
+    def sync_leads(updated_from, export_filter=None):
+        fk_resolver.reload()
+        leads = export_leads(
+            lead_manager,
+            updated_from,
+            on_refs=harvest_refs if updated_from else None,
+            reference_cache=reference_cache,
+            fk_resolver=fk_resolver,
+            export_filter=export_filter,
+        )
+        retry_deferred_leads()
+        return leads
+
+    def sync_other_pipelines(updated_from):
+        # Воронки со своим интервалом синхронизируют отдельные задачи, общая задача их не трогает
+        fk_resolver.reload()
+        pipeline_ids = get_lead_pipeline_ids(account_id, pipeline_manager, reference_cache)
+        if pipeline_ids:
+            pipeline_ids = [
+                pipeline_id for pipeline_id in pipeline_ids if pipeline_id not in settings.LEAD_PIPELINE_INTERVALS
+            ]
+            if not pipeline_ids:
+                return 0
+        exported = export_leads_by_pipeline(
+            lead_manager,
+            pipeline_ids,
+            updated_from,
+            on_refs=harvest_refs if updated_from else None,
+            reference_cache=reference_cache,
+            fk_resolver=fk_resolver,
+            account_id=account_id,
+        )
+        retry_deferred_leads()
+        return exported
+
+    split_by_pipeline = settings.LEAD_PIPELINE_WORKERS > 1 or settings.LEAD_PIPELINE_INTERVALS
+
+    # Порядок важен: первый проход выполняется последовательно, чтобы не нарушать FK
+    syncs = {
+        "users": lambda updated_from: export_users(user_manager, account_id, reference_cache, fk_resolver),
+        "pipelines": lambda updated_from: export_pipelines(pipeline_manager, reference_cache, fk_resolver),
+        "companies": lambda updated_from: export_companies(company_manager, updated_from, fk_resolver=fk_resolver),
+        "contacts": lambda updated_from: export_contacts(contact_manager, updated_from, fk_resolver=fk_resolver),
+        "leads": sync_other_pipelines if split_by_pipeline else sync_leads,
+        "tasks": lambda updated_from: export_tasks(
+            task_manager,
+            load_known_ids(LeadRepository, account_id),
+            load_known_ids(ContactRepository, account_id),
+            updated_from,
+        ),
+        "events": lambda updated_from: export_events(
+            event_manager,
+            load_known_ids(LeadRepository, account_id),
+            load_known_ids(ContactRepository, account_id),
+            created_from=updated_from,
+        ),
+    }
+
+    # Задачи воронок со своим интервалом идут сразу после общей задачи сделок
+    jobs = []
+    for name, sync in syncs.items():
+        if name in settings.SYNC_INTERVALS:
+            jobs.append(SyncJob(name=name, interval=settings.SYNC_INTERVALS[name], sync=sync, state=state))
+        if name != "leads":
+            continue
+        for pipeline_id, interval in settings.LEAD_PIPELINE_INTERVALS.items():
+            jobs.append(
+                SyncJob(
+                    name=f"leads:{pipeline_id}",
+                    interval=interval,
+                    sync=partial(sync_leads, export_filter=ExportFilter(pipeline_ids=(pipeline_id,))),
+                    state=state,
+                )
+            )
+
+    if not jobs:
+        # Без задач демону нечего планировать: это ошибка конфигурации, а не пустой цикл
+        raise ValueError(
+            "Daemon has no sync jobs: SYNC_INTERVALS and LEAD_PIPELINE_INTERVALS "
+            f"must name at least one of {', '.join(syncs)}"
+        )
+    return jobs
+
+
+def run_daemon(account: KommoAccount):
+    logger.info(f"Starting sync daemon for {account.name}")
+
+    # HTTP-клиент, токен и пул соединений к БД живут всё время работы демона
+    http_client = create_http_client(account.base_url)
+    token_manager = TokenManager(http_client, account)
+    state = SyncState(account.sync_state_path)
+    parquet_sink = None
+    stop_event = threading.Event()
+
+    def handle_stop(signum, frame):
+        logger.info(f"Received signal {signum}, stopping after running syncs finish")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, handle_stop)
+    signal.signal(signal.SIGTERM, handle_stop)
+
+    try:
+        account_id = AccountManager(token_manager, http_client).get_account_id()
+        jobs = build_jobs(
+            token_manager,
+            http_client,
+            state,
+            account_id,
+            get_modified_since_state(account),
+            ReferenceCache(account.reference_fingerprints_path),
+            account.deferred_leads_path,
+        )
+        parquet_sink = open_parquet_sink(session_maker)
+
+        for job in jobs:
+            if stop_event.is_set():
+                break
+            job.run()
+            job.schedule_next(settings.SYNC_JITTER)
+
+        with ThreadPoolExecutor(max_workers=settings.DAEMON_WORKERS) as executor:
+            while not stop_event.is_set():
+                now = time.monotonic()
+                for job in jobs:
+                    if job.next_run_at <= now:
+                        executor.submit(job.run)
+                        job.schedule_next(settings.SYNC_JITTER)
+
+                next_run_at = min(job.next_run_at for job in jobs)
+                stop_event.wait(max(0.0, next_run_at - time.monotonic()))
+    finally:
+        http_client.close()
+        if parquet_sink:
+            parquet_sink.close()
+        logger.info(f"Sync daemon for {account.name} stopped")
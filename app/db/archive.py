@@ -0,0 +1,118 @@
+import gzip
+import json
+import logging
+import os
+from datetime import date, datetime
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from app.config import settings
+from app.db.base import get_engine
+from app.db.partitions import (
+    add_months,
+    get_partition_names,
+    is_partitioning_supported,
+    month_start,
+    parse_month_partition_name,
+)
+from app.db.types import decode_event_id
+
+logger = logging.getLogger(__name__)
+
+
+def get_expired_partitions(
+    connection: Connection,
+    table_name: str,
+    retention_months: int,
+    today: date | None = None,
+) -> list[str]:
+    horizon = add_months(month_start(today or date.today()), -retention_months)
+    return [
+        name
+        for name in get_partition_names(connection, table_name)
+        if name != "pmax" and parse_month_partition_name(name) < horizon
+    ]
+
+
+def _serialize_event_row(row: dict) -> dict:
+    row["id"] = decode_event_id(row["id"])
+    for key, value in row.items():
+        if isinstance(value, datetime):
+            row[key] = value.isoformat()
+    return row
+
+
+def archive_partition_to_file(connection: Connection, table_name: str, partition: str, archive_dir: str) -> str:
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{table_name}_{partition}.ndjson.gz")
+    tmp_path = path + ".tmp"
+
+    # Пишем во временный файл и переименовываем, чтобы не удалить партицию при неполном архиве
+    rows = connection.execution_options(stream_results=True).execute(
+        text(f"SELECT * FROM {table_name} PARTITION ({partition})")
+    )
+    count = 0
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as archive_file:
+        for row in rows.mappings():
+            archive_file.write(json.dumps(_serialize_event_row(dict(row)), ensure_ascii=False))
+            archive_file.write("\n")
+            count += 1
+    os.replace(tmp_path, path)
+
+    connection.execute(text(f"ALTER TABLE {table_name} DROP PARTITION {partition}"))
+    logger.info(f"Archived {count} rows of {table_name} partition {partition} to {path}")
+    return path
+
+
+def archive_partition_to_table(connection: Connection, table_name: str, partition: str) -> str:
+    archive_table = f"{table_name}_archive_{partition}"
+
+    # EXCHANGE PARTITION переносит данные без построчного копирования
+    connection.execute(text(f"CREATE TABLE {archive_table} LIKE {table_name}"))
+    connection.execute(text(f"ALTER TABLE {archive_table} REMOVE PARTITIONING"))
+    connection.execute(
+        text(f"ALTER TABLE {table_name} EXCHANGE PARTITION {partition} WITH TABLE {archive_table}")
+    )
+    connection.execute(text(f"ALTER TABLE {table_name} DROP PARTITION {partition}"))
+    connection.execute(text(f"ALTER TABLE {archive_table} ROW_FORMAT=COMPRESSED"))
+
+    logger.info(f"Moved {table_name} partition {partition} to {archive_table}")
+    return archive_table
+
+
+def archive_expired_partitions(
+    connection: Connection,
+    table_name: str,
+    retention_months: int,
+    mode: str,
+    archive_dir: str,
+) -> list[str]:
+    if not is_partitioning_supported(connection):
+        logger.warning(f"Partition archival is not supported by {connection.dialect.name}")
+        return []
+
+    archived = []
+    for partition in get_expired_partitions(connection, table_name, retention_months):
+        if mode == "file":
+            archived.append(archive_partition_to_file(connection, table_name, partition, archive_dir))
+        elif mode == "table":
+            archived.append(archive_partition_to_table(connection, table_name, partition))
+        else:
+            raise ValueError(f"Unknown archive mode: {mode}")
+
+    if not archived:
+        logger.info(f"No {table_name} partitions older than {retention_months} months")
+    return archived
+
+
+def archive_events() -> list[str]:
+    # DDL в MariaDB коммитится неявно, поэтому каждая партиция архивируется независимо
+    with get_engine().connect() as connection:
+        return archive_expired_partitions(
+            connection,
+            "events",
+            settings.EVENTS_RETENTION_MONTHS,
+            settings.EVENTS_ARCHIVE_MODE,
+            settings.EVENTS_ARCHIVE_DIR,
+        )
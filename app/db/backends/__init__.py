@@ -0,0 +1,34 @@
+import importlib
+
+from app.db.backends.base import StorageBackend
+
+BACKEND_CLASSES = {
+    "mariadb": ("app.db.backends.mariadb", "MariaDBBackend"),
+    "postgresql": ("app.db.backends.postgresql", "PostgreSQLBackend"),
+    "sqlite": ("app.db.backends.sqlite", "SQLiteBackend"),
+}
+# Диалекты SQLAlchemy, которыми представляются соединения каждого бэкенда
+DIALECT_BACKENDS = {
+    "mysql": "mariadb",
+    "mariadb": "mariadb",
+    "postgresql": "postgresql",
+    "sqlite": "sqlite",
+}
+
+_backends: dict[str, StorageBackend] = {}
+
+
+def get_backend(name: str) -> StorageBackend:
+    # Модули бэкендов импортируются по требованию
+    if name not in _backends:
+        if name not in BACKEND_CLASSES:
+            raise ValueError(f"Unknown storage backend: {name}")
+        module_name, class_name = BACKEND_CLASSES[name]
+        _backends[name] = getattr(importlib.import_module(module_name), class_name)()
+    return _backends[name]
+
+
+def get_backend_for_dialect(dialect_name: str) -> StorageBackend:
+    if dialect_name not in DIALECT_BACKENDS:
+        raise ValueError(f"No storage backend for dialect: {dialect_name}")
+    return get_backend(DIALECT_BACKENDS[dialect_name])
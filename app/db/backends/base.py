@@ -0,0 +1,28 @@
+from sqlalchemy import Table
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+
+
+class StorageBackend:
+    # Имя в DB_DRIVER и имя диалекта SQLAlchemy, по которому бэкенд находится для соединения
+    name: str
+    dialect: str
+    default_port: int | None = None
+
+    def build_url(self, settings) -> str:
+        raise NotImplementedError
+
+    def connect_args(self, settings) -> dict:
+        return {}
+
+    def upsert(self, connection: Connection, table: Table, rows: list[dict]) -> None:
+        # Вставка или полное обновление строк по первичному ключу одним массовым запросом
+        raise NotImplementedError
+
+    def is_retryable_error(self, error: DBAPIError) -> bool:
+        # Ошибки блокировок (deadlock, lock wait timeout): тот же батч можно отправить повторно
+        return False
+
+    @staticmethod
+    def updatable_columns(table: Table) -> list[str]:
+        return [column.key for column in table.columns if not column.primary_key]
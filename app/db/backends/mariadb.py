@@ -0,0 +1,42 @@
+from sqlalchemy import Table
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+
+from app.db.backends.base import StorageBackend
+
+# ER_LOCK_DEADLOCK и ER_LOCK_WAIT_TIMEOUT: транзакция откачена целиком, повтор безопасен
+RETRYABLE_ERROR_CODES = {1205, 1213}
+
+
+class MariaDBBackend(StorageBackend):
+    name = "mariadb"
+    dialect = "mysql"
+    default_port = 3306
+
+    def build_url(self, settings) -> str:
+        return (
+            f"mysql://{settings.DB_USER}:{settings.DB_PASSWORD}@{settings.DB_HOST}:"
+            f"{settings.DB_PORT or self.default_port}/{settings.DB_NAME}?charset=utf8mb4"
+        )
+
+    def connect_args(self, settings) -> dict:
+        if settings.DB_TIME_ZONE:
+            return {"init_command": f"SET time_zone = '{settings.DB_TIME_ZONE}'"}
+        return {}
+
+    def is_retryable_error(self, error: DBAPIError) -> bool:
+        args = getattr(error.orig, "args", ())
+        return bool(args) and args[0] in RETRYABLE_ERROR_CODES
+
+    def upsert(self, connection: Connection, table: Table, rows: list[dict]) -> None:
+        if not rows:
+            return
+
+        # Один многострочный INSERT ... ON DUPLICATE KEY UPDATE на батч: executemany драйвера
+        # не склеивает строки, когда в VALUES есть FROM_UNIXTIME(...)
+        statement = insert(table).values(rows)
+        statement = statement.on_duplicate_key_update(
+            {column: statement.inserted[column] for column in self.updatable_columns(table)}
+        )
+        connection.execute(statement)
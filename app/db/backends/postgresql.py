@@ -0,0 +1,88 @@
+from sqlalchemy import BigInteger, Column, MetaData, Table, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateTable
+
+from app.db.backends.base import StorageBackend
+from app.db.types import UnixTimestamp, from_unixtime
+
+# deadlock_detected, serialization_failure, lock_not_available
+RETRYABLE_SQLSTATES = {"40P01", "40001", "55P03"}
+
+
+class PostgreSQLBackend(StorageBackend):
+    name = "postgresql"
+    dialect = "postgresql"
+    default_port = 5432
+
+    def __init__(self):
+        self._staging_tables: dict[str, Table] = {}
+
+    def build_url(self, settings) -> str:
+        return (
+            f"postgresql+psycopg://{settings.DB_USER}:{settings.DB_PASSWORD}@{settings.DB_HOST}:"
+            f"{settings.DB_PORT or self.default_port}/{settings.DB_NAME}"
+        )
+
+    def connect_args(self, settings) -> dict:
+        if settings.DB_TIME_ZONE:
+            return {"options": f"-c timezone={settings.DB_TIME_ZONE}"}
+        return {}
+
+    def is_retryable_error(self, error: DBAPIError) -> bool:
+        return getattr(error.orig, "sqlstate", None) in RETRYABLE_SQLSTATES
+
+    def _staging_table(self, table: Table) -> Table:
+        # Во временной таблице время лежит числом, в TIMESTAMP его переводит INSERT ... SELECT
+        if table.name not in self._staging_tables:
+            columns = [
+                Column(column.key, BigInteger() if isinstance(column.type, UnixTimestamp) else column.type)
+                for column in table.columns
+            ]
+            self._staging_tables[table.name] = Table(
+                f"{table.name}_staging",
+                MetaData(),
+                *columns,
+                prefixes=["TEMPORARY"],
+            )
+        return self._staging_tables[table.name]
+
+    def upsert(self, connection: Connection, table: Table, rows: list[dict]) -> None:
+        if not rows:
+            return
+
+        # ON CONFLICT не может обновить одну строку дважды за запрос, поэтому дубли схлопываем
+        primary_key = [column.key for column in table.primary_key.columns]
+        rows = list({tuple(row[key] for key in primary_key): row for row in rows}.values())
+
+        staging = self._staging_table(table)
+        connection.execute(CreateTable(staging, if_not_exists=True))
+        connection.execute(text(f"TRUNCATE {staging.name}"))
+
+        # COPY - самый быстрый путь загрузки в PostgreSQL; значения готовим теми же
+        # bind-процессорами, что и обычный INSERT (EventId -> bytes, datetime -> unix-время)
+        keys = [column.key for column in table.columns]
+        processors = [column.type.bind_processor(connection.dialect) for column in table.columns]
+        quote = connection.dialect.identifier_preparer.quote
+        copy_sql = f"COPY {staging.name} ({', '.join(quote(key) for key in keys)}) FROM STDIN"
+        with connection.connection.driver_connection.cursor() as cursor:
+            with cursor.copy(copy_sql) as copy:
+                for row in rows:
+                    copy.write_row(
+                        [
+                            process(row[key]) if process else row[key]
+                            for key, process in zip(keys, processors)
+                        ]
+                    )
+
+        selected = [
+            from_unixtime(staging.c[key]) if isinstance(table.c[key].type, UnixTimestamp) else staging.c[key]
+            for key in keys
+        ]
+        statement = insert(table).from_select(keys, select(*selected))
+        statement = statement.on_conflict_do_update(
+            index_elements=primary_key,
+            set_={column: statement.excluded[column] for column in self.updatable_columns(table)},
+        )
+        connection.execute(statement)
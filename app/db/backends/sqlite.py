@@ -0,0 +1,36 @@
+from sqlalchemy import Table
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+from app.db.backends.base import StorageBackend
+
+# Лимит SQLite на число параметров в одном запросе (SQLITE_MAX_VARIABLE_NUMBER)
+MAX_VARIABLES = 32766
+
+
+class SQLiteBackend(StorageBackend):
+    name = "sqlite"
+    dialect = "sqlite"
+
+    def build_url(self, settings) -> str:
+        # DB_NAME - путь к файлу базы, ":memory:" - база в памяти
+        return f"sqlite:///{settings.DB_NAME}"
+
+    def is_retryable_error(self, error: DBAPIError) -> bool:
+        # Файл занят другим писателем дольше busy timeout
+        return isinstance(error, OperationalError) and "locked" in str(error.orig)
+
+    def upsert(self, connection: Connection, table: Table, rows: list[dict]) -> None:
+        if not rows:
+            return
+
+        primary_key = [column.key for column in table.primary_key.columns]
+        chunk_size = max(MAX_VARIABLES // len(table.columns), 1)
+        for start in range(0, len(rows), chunk_size):
+            statement = insert(table).values(rows[start : start + chunk_size])
+            statement = statement.on_conflict_do_update(
+                index_elements=primary_key,
+                set_={column: statement.excluded[column] for column in self.updatable_columns(table)},
+            )
+            connection.execute(statement)
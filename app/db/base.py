@@ -1,21 +1,36 @@
 from contextlib import contextmanager
+from functools import lru_cache
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 
 from app.config import settings
+from app.db.backends import get_backend
 
-engine = create_engine(
-    settings.DATABASE_URL, pool_pre_ping=True, echo=False, echo_pool=False
-)
+# Engine создаётся при первой сессии: импорт модуля не требует настроек и драйвера БД
+session_maker = sessionmaker(expire_on_commit=False, autoflush=False, autocommit=False)
 
-session_maker = sessionmaker(
-    bind=engine, expire_on_commit=False, autoflush=False, autocommit=False
-)
+
+@lru_cache
+def get_engine() -> Engine:
+    backend = get_backend(settings.DB_DRIVER)
+    engine = create_engine(
+        settings.DATABASE_URL,
+        pool_pre_ping=True,
+        # Каждый поток записи каждой воронки держит своё соединение, плюс одно на чтение
+        pool_size=max(5, settings.LEAD_PIPELINE_WORKERS * settings.DB_WRITERS + 1),
+        echo=False,
+        echo_pool=False,
+        connect_args=backend.connect_args(settings),
+    )
+    session_maker.configure(bind=engine)
+    return engine
 
 
 @contextmanager
 def get_session():
+    get_engine()
     session = session_maker()
     try:
         yield session
@@ -1,9 +1,10 @@
-from datetime import datetime
 from typing import List, Optional
 
-from sqlalchemy import Boolean, DateTime, Float, ForeignKey, Integer, String, Text, and_
+from sqlalchemy import Boolean, Double, Float, ForeignKey, Index, Integer, String, Text, and_
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
+from app.db.types import EventId, UnixTimestamp
+
 
 class Base(DeclarativeBase):
     pass
@@ -22,13 +23,13 @@ class Lead(Base):
     loss_reason_id: Mapped[int | None] = mapped_column(ForeignKey("loss_reasons.id"), nullable=True)
     created_by: Mapped[int] = mapped_column(Integer)
     updated_by: Mapped[int] = mapped_column(Integer)
-    created_at: Mapped[datetime] = mapped_column(DateTime)
-    updated_at: Mapped[datetime] = mapped_column(DateTime)
-    closed_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
-    closest_task_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    created_at: Mapped[int] = mapped_column(UnixTimestamp)
+    updated_at: Mapped[int] = mapped_column(UnixTimestamp)
+    closed_at: Mapped[int | None] = mapped_column(UnixTimestamp, nullable=True)
+    closest_task_at: Mapped[int | None] = mapped_column(UnixTimestamp, nullable=True)
     is_deleted: Mapped[bool] = mapped_column(Boolean)
     score: Mapped[float | None] = mapped_column(Float, nullable=True)
-    account_id: Mapped[int] = mapped_column(Integer)
+    account_id: Mapped[int] = mapped_column(Integer, index=True)
     labor_cost: Mapped[float | None] = mapped_column(Float, nullable=True)
     source: Mapped[str | None] = mapped_column(String(255), nullable=True)
     payment_type: Mapped[str | None] = mapped_column(String(255), nullable=True)
@@ -36,11 +37,11 @@ class Lead(Base):
     object_type: Mapped[str | None] = mapped_column(String(255), nullable=True)
     purchase_purpose: Mapped[str | None] = mapped_column(String(255), nullable=True)
     meeting_format: Mapped[str | None] = mapped_column(String(255), nullable=True)
-    meeting_scheduled_datetime: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    meeting_scheduled_datetime: Mapped[int | None] = mapped_column(UnixTimestamp, nullable=True)
     zoom_link: Mapped[str | None] = mapped_column(String(255), nullable=True)
-    deposit_date: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
-    meeting_conducted_date: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
-    deal_date: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    deposit_date: Mapped[int | None] = mapped_column(UnixTimestamp, nullable=True)
+    meeting_conducted_date: Mapped[int | None] = mapped_column(UnixTimestamp, nullable=True)
+    deal_date: Mapped[int | None] = mapped_column(UnixTimestamp, nullable=True)
     payment_method: Mapped[str | None] = mapped_column(String(255), nullable=True)
     down_payment_percent: Mapped[float | None] = mapped_column(Float, nullable=True)
     apartment_number: Mapped[str | None] = mapped_column(String(255), nullable=True)
@@ -84,12 +85,12 @@ class Contact(Base):
     group_id: Mapped[int] = mapped_column(Integer)
     created_by: Mapped[int] = mapped_column(Integer)
     updated_by: Mapped[int] = mapped_column(Integer)
-    created_at: Mapped[datetime] = mapped_column(DateTime)
-    updated_at: Mapped[datetime] = mapped_column(DateTime)
-    closest_task_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    created_at: Mapped[int] = mapped_column(UnixTimestamp)
+    updated_at: Mapped[int] = mapped_column(UnixTimestamp)
+    closest_task_at: Mapped[int | None] = mapped_column(UnixTimestamp, nullable=True)
     is_deleted: Mapped[bool] = mapped_column(Boolean)
     is_unsorted: Mapped[bool] = mapped_column(Boolean)
-    account_id: Mapped[int] = mapped_column(Integer)
+    account_id: Mapped[int] = mapped_column(Integer, index=True)
     phone: Mapped[str | None] = mapped_column(String(255), nullable=True)
     email: Mapped[str | None] = mapped_column(String(255), nullable=True)
     position: Mapped[str | None] = mapped_column(String(255), nullable=True)
@@ -129,10 +130,10 @@ class Company(Base):
     group_id: Mapped[int] = mapped_column(Integer)
     created_by: Mapped[int] = mapped_column(Integer)
     updated_by: Mapped[int] = mapped_column(Integer)
-    created_at: Mapped[datetime] = mapped_column(DateTime)
-    updated_at: Mapped[datetime] = mapped_column(DateTime)
-    account_id: Mapped[int] = mapped_column(Integer)
-    closest_task_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    created_at: Mapped[int] = mapped_column(UnixTimestamp)
+    updated_at: Mapped[int] = mapped_column(UnixTimestamp)
+    account_id: Mapped[int] = mapped_column(Integer, index=True)
+    closest_task_at: Mapped[int | None] = mapped_column(UnixTimestamp, nullable=True)
     is_deleted: Mapped[bool] = mapped_column(Boolean)
     tag_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
     tag_name: Mapped[str | None] = mapped_column(String(255), nullable=True)
@@ -151,8 +152,8 @@ class Task(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     created_by: Mapped[int] = mapped_column(Integer)
     updated_by: Mapped[int] = mapped_column(Integer)
-    created_at: Mapped[datetime] = mapped_column(DateTime)
-    updated_at: Mapped[datetime] = mapped_column(DateTime)
+    created_at: Mapped[int] = mapped_column(UnixTimestamp)
+    updated_at: Mapped[int] = mapped_column(UnixTimestamp)
     responsible_user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     group_id: Mapped[int] = mapped_column(Integer)
     entity_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
@@ -162,8 +163,8 @@ class Task(Base):
     task_type_id: Mapped[int] = mapped_column(Integer)
     text: Mapped[str] = mapped_column(Text)
     result: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
-    complete_till: Mapped[datetime] = mapped_column(DateTime)
-    account_id: Mapped[int] = mapped_column(Integer)
+    complete_till: Mapped[int] = mapped_column(UnixTimestamp)
+    account_id: Mapped[int] = mapped_column(Integer, index=True)
 
     # Relationships
     responsible_user: Mapped["User"] = relationship(back_populates="tasks")
@@ -181,14 +182,19 @@ class Task(Base):
 
 class Event(Base):
     __tablename__ = "events"
+    # Таблица партиционирована по месяцам created_at (см. миграцию compact_events),
+    # поэтому created_at входит в первичный ключ
+    __table_args__ = (
+        Index("ix_events_entity_type_entity_id_created_at", "entity_type", "entity_id", "created_at"),
+    )
 
-    id: Mapped[str] = mapped_column(String(255), primary_key=True)
+    id: Mapped[str] = mapped_column(EventId, primary_key=True)
     type: Mapped[str] = mapped_column(String(255))
     entity_id: Mapped[int] = mapped_column(Integer, nullable=True)
     entity_type: Mapped[str] = mapped_column(String(50))
     created_by: Mapped[int] = mapped_column(Integer)
-    created_at: Mapped[datetime] = mapped_column(DateTime)
-    account_id: Mapped[int] = mapped_column(Integer)
+    created_at: Mapped[int] = mapped_column(UnixTimestamp, primary_key=True)
+    account_id: Mapped[int] = mapped_column(Integer, index=True)
     value_after_field_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     value_after_field_type: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     value_after_enum_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
@@ -219,6 +225,7 @@ class User(Base):
     name: Mapped[str] = mapped_column(String(255))
     email: Mapped[str] = mapped_column(String(255))
     lang: Mapped[str] = mapped_column(String(10))
+    account_id: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True)
 
     # Relationships
     contacts: Mapped[List["Contact"]] = relationship(back_populates="responsible_user")
@@ -236,7 +243,7 @@ class Pipeline(Base):
     is_main: Mapped[bool] = mapped_column(Boolean)
     is_unsorted_on: Mapped[bool] = mapped_column(Boolean)
     is_archive: Mapped[bool] = mapped_column(Boolean)
-    account_id: Mapped[int] = mapped_column(Integer)
+    account_id: Mapped[int] = mapped_column(Integer, index=True)
 
     # Relationships
     statuses: Mapped[List["Status"]] = relationship(
@@ -255,7 +262,7 @@ class Status(Base):
     pipeline_id: Mapped[int] = mapped_column(ForeignKey("pipelines.id"))
     color: Mapped[str] = mapped_column(String(50))
     type: Mapped[int] = mapped_column(Integer)
-    account_id: Mapped[int] = mapped_column(Integer)
+    account_id: Mapped[int] = mapped_column(Integer, index=True)
 
     # Relationships
     pipeline: Mapped["Pipeline"] = relationship(back_populates="statuses")
@@ -268,9 +275,28 @@ class LossReason(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String(255))
     sort: Mapped[int] = mapped_column(Integer)
-    created_at: Mapped[datetime] = mapped_column(DateTime)
-    updated_at: Mapped[datetime] = mapped_column(DateTime)
-    account_id: Mapped[int] = mapped_column(Integer)
+    created_at: Mapped[int] = mapped_column(UnixTimestamp)
+    updated_at: Mapped[int] = mapped_column(UnixTimestamp)
+    account_id: Mapped[int] = mapped_column(Integer, index=True)
 
     # Relationships
-    leads: Mapped[List["Lead"]] = relationship(back_populates="loss_reason")
\ No newline at end of file
+    leads: Mapped[List["Lead"]] = relationship(back_populates="loss_reason")
+
+
+class CustomFieldValue(Base):
+    __tablename__ = "custom_field_values"
+    # Значения всех дополнительных полей сделок, контактов и компаний: новое поле в Kommo
+    # появляется здесь без изменения схемы. Связь с сущностью полиморфная, без FK
+    __table_args__ = (Index("ix_custom_field_values_field_id", "field_id", "entity_type"),)
+
+    entity_type: Mapped[str] = mapped_column(String(50), primary_key=True)
+    entity_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    field_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    position: Mapped[int] = mapped_column(Integer, primary_key=True)
+    field_type: Mapped[str | None] = mapped_column(String(50), nullable=True)
+    enum_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    value_text: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # Double, а не Float: числовые поля и даты (unix-время) не должны терять точность
+    value_number: Mapped[float | None] = mapped_column(Double, nullable=True)
+    value_bool: Mapped[bool | None] = mapped_column(Boolean, nullable=True)
+    account_id: Mapped[int] = mapped_column(Integer, index=True)
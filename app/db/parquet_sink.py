@@ -0,0 +1,211 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy import Boolean, Column, Float, Integer, event
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.config import settings
+from app.db.models import Base
+from app.db.types import UnixTimestamp
+
+# pyarrow импортируется только при включённом Parquet sink
+pa = pq = None
+
+
+def _import_pyarrow() -> None:
+    global pa, pq
+    if pa is not None:
+        return
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow: install the parquet extra (pip install pyarrow)") from None
+    pa, pq = pyarrow, pyarrow.parquet
+
+logger = logging.getLogger(__name__)
+
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+PARTITION_DATE_COLUMN = "created_at"
+# Время записи батча: файлы только дописываются, актуальная версия строки - с максимальным _synced_at
+SYNCED_AT_COLUMN = "_synced_at"
+# Надгробие: строка удалена из БД (значения доп. полей, исчезнувшие в Kommo). Читатель берёт
+# последнюю версию по первичному ключу и отбрасывает её, если _deleted истинно
+DELETED_COLUMN = "_deleted"
+SERVICE_COLUMNS = (SYNCED_AT_COLUMN, DELETED_COLUMN)
+
+
+def _arrow_type(column: Column):
+    if isinstance(column.type, UnixTimestamp):
+        return pa.timestamp("s")
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    return pa.string()
+
+
+def build_arrow_schema(table_name: str):
+    columns = Base.metadata.tables[table_name].columns
+    fields = [pa.field(column.key, _arrow_type(column)) for column in columns]
+    fields.append(pa.field(SYNCED_AT_COLUMN, pa.timestamp("s")))
+    fields.append(pa.field(DELETED_COLUMN, pa.bool_()))
+    return pa.schema(fields)
+
+
+def _partition_date(timestamp: int | None) -> str:
+    if not timestamp:
+        return NULL_PARTITION
+    return datetime.fromtimestamp(timestamp, timezone.utc).date().isoformat()
+
+
+# Строки копятся по колонкам в буферах партиций account_id=/date=. Буферы сбрасываются в новые
+# файлы, когда в них набирается max_buffered_rows строк или самой старой строке больше flush_seconds
+class ParquetSink:
+    def __init__(self, root_dir: str, max_buffered_rows: int = 50000, flush_seconds: int = 300):
+        _import_pyarrow()
+
+        self.root_dir = root_dir
+        self.max_buffered_rows = max_buffered_rows
+        self.flush_seconds = flush_seconds
+        self._schemas = {}
+        self._buffers: dict[tuple[str, str, str], dict[str, list]] = {}
+        self._buffered_rows = 0
+        self._buffered_since = None
+        self._lock = threading.Lock()
+        self._session_factory = None
+
+    def _schema(self, table_name: str):
+        if table_name not in self._schemas:
+            self._schemas[table_name] = build_arrow_schema(table_name)
+        return self._schemas[table_name]
+
+    def write(
+        self,
+        table_name: str,
+        items: list,
+        columns: tuple[str, ...] | None = None,
+        deleted: bool = False,
+    ) -> None:
+        # items - словари колонок, сущности с атрибутами-колонками или кортежи строк в порядке columns
+        schema = self._schema(table_name)
+        names = [name for name in schema.names if name not in SERVICE_COLUMNS]
+        positions = {column: index for index, column in enumerate(columns)} if columns else None
+        timestamp_names = {field.name for field in schema if pa.types.is_timestamp(field.type)}
+        string_names = {field.name for field in schema if pa.types.is_string(field.type)}
+        synced_at = int(time.time())
+
+        with self._lock:
+            for item in items:
+                if positions is not None:
+                    values = {name: item[positions[name]] for name in names}
+                elif isinstance(item, dict):
+                    values = {name: item.get(name) for name in names}
+                else:
+                    values = {name: getattr(item, name, None) for name in names}
+
+                for name in timestamp_names & values.keys():
+                    values[name] = values[name] or None
+                for name in string_names:
+                    if values[name] is not None and not isinstance(values[name], str):
+                        values[name] = str(values[name])
+                values[SYNCED_AT_COLUMN] = synced_at
+                values[DELETED_COLUMN] = deleted
+
+                account_id = values.get("account_id")
+                key = (
+                    table_name,
+                    NULL_PARTITION if account_id is None else str(account_id),
+                    _partition_date(values.get(PARTITION_DATE_COLUMN)),
+                )
+                buffer = self._buffers.get(key)
+                if buffer is None:
+                    buffer = self._buffers[key] = {name: [] for name in schema.names}
+                for name, value in values.items():
+                    buffer[name].append(value)
+                self._buffered_rows += 1
+
+            if self._buffered_since is None:
+                self._buffered_since = time.monotonic()
+            if (
+                self._buffered_rows >= self.max_buffered_rows
+                or time.monotonic() - self._buffered_since >= self.flush_seconds
+            ):
+                self._flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        for (table_name, account_id, partition_date), buffer in self._buffers.items():
+            table = pa.Table.from_pydict(buffer, schema=self._schema(table_name))
+            directory = os.path.join(self.root_dir, table_name, f"account_id={account_id}")
+            if PARTITION_DATE_COLUMN in table.column_names:
+                directory = os.path.join(directory, f"date={partition_date}")
+            os.makedirs(directory, exist_ok=True)
+
+            # Пишем во временный файл, чтобы читатели не увидели недописанный Parquet
+            path = os.path.join(directory, f"part-{int(time.time())}-{uuid.uuid4().hex[:8]}.parquet")
+            pq.write_table(table, path + ".tmp", compression="zstd")
+            os.replace(path + ".tmp", path)
+
+        if self._buffers:
+            logger.info(f"Flushed {self._buffered_rows} rows to Parquet in {len(self._buffers)} files")
+        self._buffers = {}
+        self._buffered_rows = 0
+        self._buffered_since = None
+
+    def _begin(self, session: Session, transaction, connection) -> None:
+        session.info["record_upserted_rows"] = True
+
+    def _commit(self, session: Session) -> None:
+        # Репозитории складывают записанные батчи в session.info, в Parquet они уходят только после коммита
+        for table_name, rows in session.info.pop("upserted_rows", []):
+            self.write(table_name, rows)
+        for table_name, rows in session.info.pop("deleted_rows", []):
+            self.write(table_name, rows, deleted=True)
+
+    def _rollback(self, session: Session) -> None:
+        session.info.pop("upserted_rows", None)
+        session.info.pop("deleted_rows", None)
+
+    def attach(self, session_factory: sessionmaker) -> None:
+        # Зеркалим всё, что репозитории коммитят в БД, без изменений в стадиях экспорта
+        self._session_factory = session_factory
+        event.listen(session_factory, "after_begin", self._begin)
+        event.listen(session_factory, "after_commit", self._commit)
+        event.listen(session_factory, "after_soft_rollback", self._rollback)
+
+    def close(self) -> None:
+        if self._session_factory is not None:
+            event.remove(self._session_factory, "after_begin", self._begin)
+            event.remove(self._session_factory, "after_commit", self._commit)
+            event.remove(self._session_factory, "after_soft_rollback", self._rollback)
+            self._session_factory = None
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_parquet_sink(session_factory: sessionmaker) -> ParquetSink | None:
+    if not settings.PARQUET_DIR:
+        return None
+
+    sink = ParquetSink(
+        settings.PARQUET_DIR,
+        settings.PARQUET_MAX_BUFFERED_ROWS,
+        settings.PARQUET_FLUSH_SECONDS,
+    )
+    sink.attach(session_factory)
+    return sink
@@ -0,0 +1,103 @@
+import logging
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(__name__)
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    month_index = value.year * 12 + value.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def month_partition_name(value: date) -> str:
+    return f"p{value.year}{value.month:02d}"
+
+
+def parse_month_partition_name(name: str) -> date:
+    return date(int(name[1:5]), int(name[5:7]), 1)
+
+
+def month_partition_definition(value: date) -> str:
+    upper_bound = add_months(month_start(value), 1)
+    return (
+        f"PARTITION {month_partition_name(value)} "
+        f"VALUES LESS THAN (TO_DAYS('{upper_bound.isoformat()}'))"
+    )
+
+
+def build_month_partitions(first_month: date, last_month: date) -> list[str]:
+    partitions = []
+    month = month_start(first_month)
+    while month <= last_month:
+        partitions.append(month_partition_definition(month))
+        month = add_months(month, 1)
+    partitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+    return partitions
+
+
+def is_partitioning_supported(connection: Connection) -> bool:
+    return connection.dialect.name in ("mysql", "mariadb")
+
+
+def get_partition_names(connection: Connection, table_name: str) -> list[str]:
+    rows = connection.execute(
+        text(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name "
+            "AND PARTITION_NAME IS NOT NULL "
+            "ORDER BY PARTITION_ORDINAL_POSITION"
+        ),
+        {"table_name": table_name},
+    )
+    return [row[0] for row in rows]
+
+
+def ensure_month_partitions(
+    connection: Connection,
+    table_name: str,
+    months_ahead: int = 2,
+    today: date | None = None,
+) -> list[str]:
+    # Выделяем будущие месячные партиции из pmax, пока в ней ещё нет (или мало) данных
+    if not is_partitioning_supported(connection):
+        return []
+
+    existing = set(get_partition_names(connection, table_name))
+    if "pmax" not in existing:
+        return []
+
+    # Заполняем все месяцы после последней партиции, чтобы не было "дыр" между ними
+    last_month = add_months(month_start(today or date.today()), months_ahead)
+    month_partitions = sorted(name for name in existing if name != "pmax")
+    if month_partitions:
+        month = add_months(parse_month_partition_name(month_partitions[-1]), 1)
+    else:
+        month = month_start(today or date.today())
+
+    missing = []
+    while month <= last_month:
+        missing.append(month)
+        month = add_months(month, 1)
+
+    if not missing:
+        return []
+
+    definitions = [month_partition_definition(month) for month in missing]
+    definitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+    connection.execute(
+        text(
+            f"ALTER TABLE {table_name} REORGANIZE PARTITION pmax INTO "
+            f"({', '.join(definitions)})"
+        )
+    )
+
+    created = [month_partition_name(month) for month in missing]
+    logger.info(f"Created partitions {', '.join(created)} for {table_name}")
+    return created
@@ -1,9 +1,15 @@
-from datetime import datetime
-from typing import List, TypeVar, Generic, Type
+import logging
+import random
+import time
+from typing import Callable, Iterable, List, TypeVar, Generic, Type
 
+from sqlalchemy import delete, func, select, tuple_
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError
 from sqlalchemy.orm import Session
 
-from app.db.models import User, Pipeline, Status, Lead, Contact, Company, Task, Event, LossReason
+from app.config import settings
+from app.db.backends import get_backend_for_dialect
+from app.db.models import User, Pipeline, Status, Lead, Contact, Company, Task, Event, LossReason, CustomFieldValue
 from app.entities import User as UserEntity
 from app.entities import Pipeline as PipelineEntity
 from app.entities import Status as StatusEntity
@@ -13,10 +19,34 @@ from app.entities import Company as CompanyEntity
 from app.entities import Task as TaskEntity
 from app.entities import Event as EventEntity
 from app.entities import LossReason as LossReasonEntity
+from app.entities import CustomFieldValue as CustomFieldValueEntity
 
 T = TypeVar("T")
 E = TypeVar("E")
 
+logger = logging.getLogger(__name__)
+
+# Потолок паузы между повторами батча, секунды
+MAX_RETRY_BACKOFF = 5.0
+
+
+class _BatchWriteError(Exception):
+    # Батч не записался после всех повторов, и его стоит поделить
+    def __init__(self, error: DBAPIError):
+        super().__init__(str(error))
+        self.error = error
+
+
+def _normalize_value(value):
+    # FLOAT в MariaDB хранит ~7 значащих цифр, поэтому float сравниваем с той же точностью
+    if isinstance(value, float):
+        return float(f"{value:.6g}")
+    return value
+
+
+def hash_row(values) -> int:
+    return hash(tuple(_normalize_value(value) for value in values))
+
 
 class BaseRepository(Generic[T, E]):
     def __init__(self, session: Session, model: Type[T]):
@@ -24,19 +54,118 @@ class BaseRepository(Generic[T, E]):
         self._model = model
 
     def save_or_update(self, entity: E) -> T:
-        db_entity = self._convert_to_db_model(entity)
-        merged = self._session.merge(db_entity)
-        self._session.commit()
-        return merged
+        return self.save_or_update_all([entity])[0]
 
     def save_or_update_all(self, entities: List[E]) -> List[T]:
         db_entities = [self._convert_to_db_model(entity) for entity in entities]
-        merged = [self._session.merge(entity) for entity in db_entities]
+        columns = self._model.__table__.columns
+        self._upsert(
+            [{column.key: getattr(db_entity, column.key) for column in columns} for db_entity in db_entities]
+        )
+        return db_entities
+
+    def _upsert(self, rows: List[dict]) -> None:
+        # Upsert идемпотентен: батч, упавший на блокировке, можно отправить заново целиком.
+        # Если он падает и после повторов, делим пополам, пока не останется одна проблемная строка:
+        # её пропускаем, чтобы одна битая запись не останавливала выгрузку остальных
+        try:
+            self._upsert_with_retry(rows)
+        except _BatchWriteError as e:
+            if len(rows) <= 1:
+                if rows:
+                    logger.error(
+                        f"Skipping {self._model.__tablename__} row id={rows[0].get('id')} "
+                        f"that cannot be written: {e.error.orig}"
+                    )
+                return
+            middle = len(rows) // 2
+            logger.warning(
+                f"Batch of {len(rows)} {self._model.__tablename__} rows keeps failing, splitting in halves"
+            )
+            self._upsert(rows[:middle])
+            self._upsert(rows[middle:])
+
+    def _upsert_with_retry(self, rows: List[dict]) -> None:
+        self._with_retry(lambda: self._write(rows), len(rows))
+
+    def _with_retry(self, write: Callable[[], None], row_count: int) -> None:
+        attempt = 0
+        while True:
+            try:
+                write()
+                return
+            except DBAPIError as e:
+                # Откат освобождает соединение: следующая попытка начнёт новую транзакцию
+                self._session.rollback()
+                backend = get_backend_for_dialect(self._session.get_bind().dialect.name)
+                is_retryable = backend.is_retryable_error(e)
+                if attempt >= settings.DB_WRITE_RETRIES or not is_retryable:
+                    # Делить есть смысл только ошибки из-за данных или блокировок, а не схемы или соединения
+                    if is_retryable or isinstance(e, (IntegrityError, DataError)):
+                        raise _BatchWriteError(e) from e
+                    raise
+                attempt += 1
+                # Экспоненциальная пауза со случайной добавкой, чтобы конкурирующие писатели разошлись
+                delay = min(settings.DB_RETRY_BACKOFF * 2 ** (attempt - 1), MAX_RETRY_BACKOFF)
+                delay *= 1 + random.random()
+                logger.warning(
+                    f"Retryable error writing {row_count} {self._model.__tablename__} rows "
+                    f"(attempt {attempt}/{settings.DB_WRITE_RETRIES}), retrying in {delay:.2f}s: {e.orig}"
+                )
+                time.sleep(delay)
+
+    def _write(self, rows: List[dict]) -> None:
+        # Массовая запись через бэкенд диалекта вместо построчного merge()
+        connection = self._session.connection()
+        backend = get_backend_for_dialect(connection.dialect.name)
+        backend.upsert(connection, self._model.__table__, rows)
+        # Записанные строки нужны только подписчикам коммита (Parquet sink)
+        if self._session.info.get("record_upserted_rows"):
+            self._session.info.setdefault("upserted_rows", []).append((self._model.__tablename__, rows))
         self._session.commit()
-        return merged
 
-    def get_by_id(self, id: int) -> T | None:
-        return self._session.get(self._model, id)
+    def diff_all(self, entities: List[E]) -> tuple[int, int, int]:
+        # Ничего не пишет: один SELECT по id на батч и сравнение строк по хешу значений.
+        # Возвращает (inserts, updates, unchanged)
+        columns = self._model.__table__.columns
+        db_entities = [self._convert_to_db_model(entity) for entity in entities]
+        incoming = {
+            db_entity.id: hash_row(getattr(db_entity, column.key) for column in columns)
+            for db_entity in db_entities
+        }
+        existing = {
+            row.id: hash_row(row)
+            for row in self._session.execute(select(*columns).where(self._model.id.in_(incoming)))
+        }
+
+        inserts = updates = 0
+        for id, row_hash in incoming.items():
+            if id not in existing:
+                inserts += 1
+            elif existing[id] != row_hash:
+                updates += 1
+        return inserts, updates, len(incoming) - inserts - updates
+
+    def count(self, account_id: int | None = None, *criteria) -> int:
+        query = select(func.count()).select_from(self._model).where(*criteria)
+        if account_id is not None:
+            query = query.where(self._model.account_id == account_id)
+        return self._session.scalar(query)
+
+    def count_existing(self, ids, account_id: int | None = None, *criteria) -> int:
+        return self.count(account_id, self._model.id.in_(ids), *criteria)
+
+    def get_existing_ids(self, ids, account_id: int | None = None) -> set:
+        query = select(self._model.id).where(self._model.id.in_(ids))
+        if account_id is not None:
+            query = query.where(self._model.account_id == account_id)
+        return set(self._session.scalars(query))
+
+    def get_all_ids(self, account_id: int | None = None) -> set:
+        query = select(self._model.id)
+        if account_id is not None:
+            query = query.where(self._model.account_id == account_id)
+        return set(self._session.scalars(query))
 
     def _convert_to_db_model(self, entity: E) -> T:
         raise NotImplementedError
@@ -48,7 +177,11 @@ class UserRepository(BaseRepository[User, UserEntity]):
 
     def _convert_to_db_model(self, entity: UserEntity) -> User:
         return User(
-            id=entity.id, name=entity.name, email=entity.email, lang=entity.lang
+            id=entity.id,
+            name=entity.name,
+            email=entity.email,
+            lang=entity.lang,
+            account_id=entity.account_id,
         )
 
 
@@ -85,73 +218,69 @@ class StatusRepository(BaseRepository[Status, StatusEntity]):
         )
 
 
+def convert_lead_entity_to_values(entity: LeadEntity) -> dict:
+    return dict(
+        id=entity.id,
+        name=entity.name,
+        price=entity.price,
+        responsible_user_id=entity.responsible_user_id,
+        group_id=entity.group_id,
+        status_id=entity.status_id,
+        pipeline_id=entity.pipeline_id,
+        loss_reason_id=entity.loss_reason_id,
+        created_by=entity.created_by,
+        updated_by=entity.updated_by,
+        created_at=entity.created_at,
+        updated_at=entity.updated_at,
+        closed_at=entity.closed_at or None,
+        closest_task_at=entity.closest_task_at or None,
+        is_deleted=entity.is_deleted,
+        score=entity.score,
+        account_id=entity.account_id,
+        labor_cost=entity.labor_cost,
+        source=entity.source,
+        payment_type=entity.payment_type,
+        readiness_to_buy=entity.readiness_to_buy,
+        object_type=entity.object_type,
+        purchase_purpose=entity.purchase_purpose,
+        meeting_format=entity.meeting_format,
+        meeting_scheduled_datetime=entity.meeting_scheduled_datetime or None,
+        zoom_link=entity.zoom_link,
+        deposit_date=entity.deposit_date or None,
+        meeting_conducted_date=entity.meeting_conducted_date or None,
+        deal_date=entity.deal_date or None,
+        payment_method=entity.payment_method,
+        down_payment_percent=entity.down_payment_percent,
+        apartment_number=entity.apartment_number,
+        apartment_cost=entity.apartment_cost,
+        apartment_status=entity.apartment_status,
+        comment=entity.comment,
+        referrer=entity.referrer,
+        tag_name=entity.tag_name,
+        tag_id=entity.tag_id,
+        company_id=entity.company_id,
+        contact_id=entity.contact_id,
+    )
+
+
+LEAD_COLUMNS = tuple(column.key for column in Lead.__table__.columns)
+
+
+def convert_lead_entity_to_row(entity: LeadEntity) -> tuple:
+    # Компактное представление строки для передачи между процессами
+    values = convert_lead_entity_to_values(entity)
+    return tuple(values[column] for column in LEAD_COLUMNS)
+
+
 class LeadRepository(BaseRepository[Lead, LeadEntity]):
     def __init__(self, session: Session):
         super().__init__(session, Lead)
 
+    def save_or_update_rows(self, rows: List[tuple]) -> None:
+        self._upsert([dict(zip(LEAD_COLUMNS, row)) for row in rows])
+
     def _convert_to_db_model(self, entity: LeadEntity) -> Lead:
-        return Lead(
-            id=entity.id,
-            name=entity.name,
-            price=entity.price,
-            responsible_user_id=entity.responsible_user_id,
-            group_id=entity.group_id,
-            status_id=entity.status_id,
-            pipeline_id=entity.pipeline_id,
-            loss_reason_id=entity.loss_reason_id,
-            created_by=entity.created_by,
-            updated_by=entity.updated_by,
-            created_at=datetime.fromtimestamp(entity.created_at),
-            updated_at=datetime.fromtimestamp(entity.updated_at),
-            closed_at=(
-                datetime.fromtimestamp(entity.closed_at) if entity.closed_at else None
-            ),
-            closest_task_at=(
-                datetime.fromtimestamp(entity.closest_task_at)
-                if entity.closest_task_at
-                else None
-            ),
-            is_deleted=entity.is_deleted,
-            score=entity.score,
-            account_id=entity.account_id,
-            labor_cost=entity.labor_cost,
-            source=entity.source,
-            payment_type=entity.payment_type,
-            readiness_to_buy=entity.readiness_to_buy,
-            object_type=entity.object_type,
-            purchase_purpose=entity.purchase_purpose,
-            meeting_format=entity.meeting_format,
-            meeting_scheduled_datetime=(
-                datetime.fromtimestamp(entity.meeting_scheduled_datetime)
-                if entity.meeting_scheduled_datetime
-                else None
-            ),
-            zoom_link=entity.zoom_link,
-            deposit_date=(
-                datetime.fromtimestamp(entity.deposit_date)
-                if entity.deposit_date
-                else None
-            ),
-            meeting_conducted_date=(
-                datetime.fromtimestamp(entity.meeting_conducted_date)
-                if entity.meeting_conducted_date
-                else None
-            ),
-            deal_date=(
-                datetime.fromtimestamp(entity.deal_date) if entity.deal_date else None
-            ),
-            payment_method=entity.payment_method,
-            down_payment_percent=entity.down_payment_percent,
-            apartment_number=entity.apartment_number,
-            apartment_cost=entity.apartment_cost,
-            apartment_status=entity.apartment_status,
-            comment=entity.comment,
-            referrer=entity.referrer,
-            tag_name=entity.tag_name,
-            tag_id=entity.tag_id,
-            company_id=entity.company_id,
-            contact_id=entity.contact_id,
-        )
+        return Lead(**convert_lead_entity_to_values(entity))
 
 
 class ContactRepository(BaseRepository[Contact, ContactEntity]):
@@ -168,13 +297,9 @@ class ContactRepository(BaseRepository[Contact, ContactEntity]):
             group_id=entity.group_id,
             created_by=entity.created_by,
             updated_by=entity.updated_by,
-            created_at=datetime.fromtimestamp(entity.created_at),
-            updated_at=datetime.fromtimestamp(entity.updated_at),
-            closest_task_at=(
-                datetime.fromtimestamp(entity.closest_task_at)
-                if entity.closest_task_at
-                else None
-            ),
+            created_at=entity.created_at,
+            updated_at=entity.updated_at,
+            closest_task_at=entity.closest_task_at or None,
             is_deleted=entity.is_deleted,
             is_unsorted=entity.is_unsorted,
             account_id=entity.account_id,
@@ -204,14 +329,10 @@ class CompanyRepository(BaseRepository[Company, CompanyEntity]):
             group_id=entity.group_id,
             created_by=entity.created_by,
             updated_by=entity.updated_by,
-            created_at=datetime.fromtimestamp(entity.created_at),
-            updated_at=datetime.fromtimestamp(entity.updated_at),
+            created_at=entity.created_at,
+            updated_at=entity.updated_at,
             account_id=entity.account_id,
-            closest_task_at=(
-                datetime.fromtimestamp(entity.closest_task_at)
-                if entity.closest_task_at
-                else None
-            ),
+            closest_task_at=entity.closest_task_at or None,
             is_deleted=entity.is_deleted,
             tag_id=entity.tag_id,
             tag_name=entity.tag_name,
@@ -240,8 +361,8 @@ class TaskRepository(BaseRepository[Task, TaskEntity]):
             id=entity.id,
             created_by=entity.created_by,
             updated_by=entity.updated_by,
-            created_at=datetime.fromtimestamp(entity.created_at),
-            updated_at=datetime.fromtimestamp(entity.updated_at),
+            created_at=entity.created_at,
+            updated_at=entity.updated_at,
             responsible_user_id=entity.responsible_user_id,
             group_id=entity.group_id,
             entity_id=entity_id,  # Используем проверенный entity_id
@@ -251,7 +372,7 @@ class TaskRepository(BaseRepository[Task, TaskEntity]):
             task_type_id=entity.task_type_id,
             text=entity.text,
             result=str(entity.result) if entity.result else None,
-            complete_till=datetime.fromtimestamp(entity.complete_till),
+            complete_till=entity.complete_till,
             account_id=entity.account_id,
         )
 
@@ -267,7 +388,7 @@ class EventRepository(BaseRepository[Event, EventEntity]):
             entity_id=entity.entity_id,
             entity_type=entity.entity_type,
             created_by=entity.created_by,
-            created_at=datetime.fromtimestamp(entity.created_at),
+            created_at=entity.created_at,
             account_id=entity.account_id,
             value_after_field_id=entity.value_after_field_id,
             value_after_field_type=entity.value_after_field_type,
@@ -288,7 +409,94 @@ class LossReasonRepository(BaseRepository[LossReason, LossReasonEntity]):
             id=entity.id,
             name=entity.name,
             sort=entity.sort,
-            created_at=datetime.fromtimestamp(entity.created_at),
-            updated_at=datetime.fromtimestamp(entity.updated_at),
+            created_at=entity.created_at,
+            updated_at=entity.updated_at,
             account_id=entity.account_id
-        )
\ No newline at end of file
+        )
+
+
+CUSTOM_FIELD_VALUE_KEY = ("entity_type", "entity_id", "field_id", "position")
+CUSTOM_FIELD_VALUE_COLUMNS = tuple(column.key for column in CustomFieldValue.__table__.columns)
+# Ключи удаляемых строк идут в IN по кортежам, по 4 параметра на строку
+DELETE_CHUNK_SIZE = 500
+
+
+def convert_custom_field_value_to_row(value: CustomFieldValueEntity) -> tuple:
+    # Как и строки сделок, значения из пула конвертации передаются кортежами
+    return tuple(getattr(value, column) for column in CUSTOM_FIELD_VALUE_COLUMNS)
+
+
+class CustomFieldValueRepository(BaseRepository[CustomFieldValue, CustomFieldValueEntity]):
+    def __init__(self, session: Session):
+        super().__init__(session, CustomFieldValue)
+
+    def replace_for_entities(
+        self,
+        entity_type: str,
+        entity_ids: Iterable[int],
+        values: List[CustomFieldValueEntity | tuple],
+    ) -> tuple[int, int]:
+        # Набор значений каждой сущности заменяется целиком, но пишется только разница с БД:
+        # новые и изменённые строки - upsert, исчезнувшие - DELETE. Возвращает (записано, удалено)
+        entity_ids = set(entity_ids)
+        if not entity_ids:
+            return 0, 0
+
+        columns = self._model.__table__.columns
+        incoming = {}
+        for value in values:
+            # Кортежи - в порядке CUSTOM_FIELD_VALUE_COLUMNS, остальное - сущности
+            if isinstance(value, tuple):
+                row = dict(zip(CUSTOM_FIELD_VALUE_COLUMNS, value))
+            else:
+                row = {column: getattr(value, column) for column in CUSTOM_FIELD_VALUE_COLUMNS}
+            incoming[tuple(row[key] for key in CUSTOM_FIELD_VALUE_KEY)] = row
+
+        existing = {
+            tuple(getattr(row, key) for key in CUSTOM_FIELD_VALUE_KEY): tuple(row)
+            for row in self._session.execute(
+                select(*columns).where(
+                    self._model.entity_type == entity_type,
+                    self._model.entity_id.in_(entity_ids),
+                )
+            )
+        }
+        # Чтение открыло транзакцию; запись идёт в своих транзакциях с повторами
+        self._session.commit()
+
+        stale = [key for key in existing if key not in incoming]
+        changed = [row for key, row in incoming.items() if existing.get(key) != tuple(row.values())]
+
+        for start in range(0, len(stale), DELETE_CHUNK_SIZE):
+            chunk = stale[start : start + DELETE_CHUNK_SIZE]
+            rows = [dict(zip(CUSTOM_FIELD_VALUE_COLUMNS, existing[key])) for key in chunk]
+            try:
+                self._with_retry(lambda: self._delete(chunk, rows), len(chunk))
+            except _BatchWriteError as e:
+                raise e.error
+        if changed:
+            self._upsert(changed)
+        return len(changed), len(stale)
+
+    def _delete(self, keys: List[tuple], rows: List[dict]) -> None:
+        table = self._model.__table__
+        key_columns = tuple_(*(table.c[key] for key in CUSTOM_FIELD_VALUE_KEY))
+        self._session.execute(delete(table).where(key_columns.in_(keys)))
+        # Удалённые строки подписчики коммита получают как надгробия (Parquet sink)
+        if self._session.info.get("record_upserted_rows"):
+            self._session.info.setdefault("deleted_rows", []).append((table.name, rows))
+        self._session.commit()
+
+    def _convert_to_db_model(self, entity: CustomFieldValueEntity) -> CustomFieldValue:
+        return CustomFieldValue(
+            entity_type=entity.entity_type,
+            entity_id=entity.entity_id,
+            field_id=entity.field_id,
+            position=entity.position,
+            field_type=entity.field_type,
+            enum_id=entity.enum_id,
+            value_text=entity.value_text,
+            value_number=entity.value_number,
+            value_bool=entity.value_bool,
+            account_id=entity.account_id,
+        )
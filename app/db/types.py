@@ -0,0 +1,134 @@
+from datetime import datetime
+
+from sqlalchemy import type_coerce
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import BINARY, BigInteger, DateTime, LargeBinary, TypeDecorator
+
+# Kommo отдаёт id событий в виде ULID (26 символов Crockford base32 в нижнем регистре), что помещается
+# в 16 байт. Другие форматы не принимаются: из 16 байт их нельзя было бы восстановить без потерь
+_ULID_ALPHABET = "0123456789abcdefghjkmnpqrstvwxyz"
+_ULID_DECODE = {char: index for index, char in enumerate(_ULID_ALPHABET)}
+
+
+def encode_event_id(event_id: str) -> bytes:
+    if len(event_id) != 26:
+        raise ValueError(f"Invalid event id: {event_id!r}")
+
+    value = 0
+    for char in event_id:
+        try:
+            value = (value << 5) | _ULID_DECODE[char]
+        except KeyError:
+            raise ValueError(f"Invalid event id: {event_id!r}") from None
+    if value >> 128:
+        raise ValueError(f"Invalid event id: {event_id!r}")
+    return value.to_bytes(16, "big")
+
+
+def is_valid_event_id(event_id: str) -> bool:
+    try:
+        encode_event_id(event_id)
+    except ValueError:
+        return False
+    return True
+
+
+def decode_event_id(value: bytes) -> str:
+    number = int.from_bytes(value, "big")
+    chars = []
+    for _ in range(26):
+        chars.append(_ULID_ALPHABET[number & 0x1F])
+        number >>= 5
+    return "".join(reversed(chars))
+
+
+class EventId(TypeDecorator):
+    impl = BINARY(16)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        # В PostgreSQL нет BINARY(n), байты хранятся в BYTEA
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(LargeBinary())
+        return dialect.type_descriptor(self.impl)
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, bytes):
+            return value
+        return encode_event_id(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decode_event_id(value)
+
+
+class from_unixtime(FunctionElement):
+    type = DateTime()
+    inherit_cache = True
+
+
+class unix_timestamp(FunctionElement):
+    type = BigInteger()
+    inherit_cache = True
+
+
+@compiles(from_unixtime)
+def _compile_from_unixtime(element, compiler, **kw):
+    return f"FROM_UNIXTIME({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(from_unixtime, "postgresql")
+def _compile_from_unixtime_postgresql(element, compiler, **kw):
+    return f"CAST(TO_TIMESTAMP({compiler.process(element.clauses, **kw)}) AS TIMESTAMP)"
+
+
+@compiles(from_unixtime, "sqlite")
+def _compile_from_unixtime_sqlite(element, compiler, **kw):
+    return f"DATETIME({compiler.process(element.clauses, **kw)}, 'unixepoch')"
+
+
+@compiles(unix_timestamp)
+def _compile_unix_timestamp(element, compiler, **kw):
+    return f"UNIX_TIMESTAMP({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(unix_timestamp, "postgresql")
+def _compile_unix_timestamp_postgresql(element, compiler, **kw):
+    return f"CAST(EXTRACT(EPOCH FROM CAST({compiler.process(element.clauses, **kw)} AS TIMESTAMPTZ)) AS BIGINT)"
+
+
+@compiles(unix_timestamp, "sqlite")
+def _compile_unix_timestamp_sqlite(element, compiler, **kw):
+    return f"CAST(STRFTIME('%s', {compiler.process(element.clauses, **kw)}) AS INTEGER)"
+
+
+class UnixTimestamp(TypeDecorator):
+    # В Python значение остаётся unix-временем из Kommo, в DATETIME и обратно его переводит БД:
+    # FROM_UNIXTIME/UNIX_TIMESTAMP считаются прямо в INSERT/SELECT, без datetime на каждое поле
+    impl = DateTime
+    cache_ok = True
+
+    def bind_expression(self, bindvalue):
+        return from_unixtime(type_coerce(bindvalue, BigInteger()))
+
+    def column_expression(self, column):
+        return unix_timestamp(column)
+
+    # Обработчики DATETIME драйвера не используются: по проводу ходит число секунд
+    def bind_processor(self, dialect):
+        def process(value):
+            if isinstance(value, datetime):
+                return int(value.timestamp())
+            return value
+
+        return process
+
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            if value is None:
+                return None
+            return int(value)
+
+        return process
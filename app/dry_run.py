@@ -0,0 +1,185 @@
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Iterable
+
+from app.config import KommoAccount, settings
+from app.db.base import get_session
+from app.db.models import Event
+from app.db.repositories import (
+    CompanyRepository,
+    ContactRepository,
+    EventRepository,
+    LeadRepository,
+    LossReasonRepository,
+    PipelineRepository,
+    StatusRepository,
+    TaskRepository,
+    UserRepository,
+)
+from app.db.types import is_valid_event_id
+from app.kommo.account import AccountManager
+from app.kommo.auth import TokenManager
+from app.kommo.companies import CompanyManager
+from app.kommo.contacts import ContactManager
+from app.kommo.converters import convert_lead_json_to_entity, convert_loss_reason_json_to_entity
+from app.kommo.leads import LeadManager
+from app.kommo.pipelines import PipelineManager
+from app.kommo.tasks import TaskManager
+from app.kommo.transport import create_http_client
+from app.kommo.users import UserManager
+from app.stages.common import iter_in_batches, load_known_ids
+from app.stages.events import build_event_manager, clear_missing_event_refs
+from app.stages.tasks import clear_missing_task_refs
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TableDiff:
+    table: str
+    inserts: int = 0
+    updates: int = 0
+    unchanged: int = 0
+    # Строки аккаунта, которых нет в выгрузке; None, если таблица выгружается не целиком
+    stale: int | None = None
+    seconds: float = 0.0
+
+    @property
+    def fetched(self) -> int:
+        return self.inserts + self.updates + self.unchanged
+
+    def add(self, inserts: int, updates: int, unchanged: int) -> None:
+        self.inserts += inserts
+        self.updates += updates
+        self.unchanged += unchanged
+
+
+@dataclass
+class DryRunReport:
+    account: str
+    tables: dict[str, TableDiff] = field(default_factory=dict)
+
+    def table(self, name: str) -> TableDiff:
+        if name not in self.tables:
+            self.tables[name] = TableDiff(name)
+        return self.tables[name]
+
+    def format(self) -> str:
+        lines = [
+            f"Dry run of {self.account}:",
+            f"{'table':<14}{'fetched':>10}{'insert':>10}{'update':>10}"
+            f"{'same':>10}{'stale':>10}{'rows/s':>10}",
+        ]
+        for diff in self.tables.values():
+            stale = "-" if diff.stale is None else diff.stale
+            rate = int(diff.fetched / diff.seconds) if diff.seconds else 0
+            lines.append(
+                f"{diff.table:<14}{diff.fetched:>10}{diff.inserts:>10}{diff.updates:>10}"
+                f"{diff.unchanged:>10}{stale:>10}{rate:>10}"
+            )
+        total = sum(diff.seconds for diff in self.tables.values())
+        lines.append(f"Fetch and compare took {total:.1f}s; a real sync adds the write time on top")
+        return "\n".join(lines)
+
+
+def diff_entities(
+    report: DryRunReport,
+    table: str,
+    repository_class,
+    entities: Iterable,
+    account_id: int | None = None,
+    batch_size: int = 100,
+    scope: tuple = (),
+) -> TableDiff:
+    # Поток сущностей сравнивается батчами, в памяти держится только текущий батч.
+    # stale считается в рамках аккаунта и условий scope (фильтр выгрузки): и строки БД, и совпавшие
+    # с выгрузкой id берутся в одних рамках, чужие строки с теми же id его не уменьшают
+    diff = report.table(table)
+    started_at = time.monotonic()
+    matched = 0
+    for batch in iter_in_batches(entities, batch_size):
+        with get_session() as session:
+            repository = repository_class(session)
+            diff.add(*repository.diff_all(batch))
+            if account_id is not None:
+                matched += repository.count_existing([entity.id for entity in batch], account_id, *scope)
+            # Сравнение только читает, но на всякий случай не оставляем ничего к коммиту
+            session.rollback()
+
+    if account_id is not None:
+        with get_session() as session:
+            diff.stale = max(repository_class(session).count(account_id, *scope) - matched, 0)
+
+    diff.seconds += time.monotonic() - started_at
+    logger.info(f"Compared {diff.fetched} {table}")
+    return diff
+
+
+def _iter_users(user_manager: UserManager, account_id: int):
+    for user in user_manager.get_all_users():
+        user.account_id = account_id
+        yield user
+
+
+def _iter_leads(lead_manager: LeadManager, loss_reasons: dict):
+    for lead_json in lead_manager.get_all_leads():
+        if lead_json.get("_embedded", {}).get("loss_reason"):
+            loss_reason_data = lead_json["_embedded"]["loss_reason"][0]
+            loss_reason_data["account_id"] = lead_json["account_id"]
+            loss_reason = convert_loss_reason_json_to_entity(loss_reason_data)
+            loss_reasons[loss_reason.id] = loss_reason
+        yield convert_lead_json_to_entity(lead_json)
+
+
+def dry_run(account: KommoAccount) -> DryRunReport:
+    logger.info(f"Starting dry run of {account.name}")
+
+    # Без modified_since и кэша справочников: dry run всегда сравнивает полную выгрузку
+    http_client = create_http_client(account.base_url)
+    token_manager = TokenManager(http_client, account)
+    report = DryRunReport(account.name)
+
+    try:
+        account_id = AccountManager(token_manager, http_client).get_account_id()
+        users = _iter_users(UserManager(token_manager, http_client), account_id)
+        diff_entities(report, "users", UserRepository, users, account_id)
+
+        pipelines = list(PipelineManager(token_manager, http_client).get_all_pipelines())
+        diff_entities(report, "pipelines", PipelineRepository, pipelines, account_id)
+        statuses = [status for pipeline in pipelines for status in pipeline.statuses]
+        diff_entities(report, "statuses", StatusRepository, statuses, account_id)
+
+        companies = CompanyManager(token_manager, http_client).get_all_companies()
+        diff_entities(report, "companies", CompanyRepository, companies, account_id)
+        contacts = ContactManager(token_manager, http_client).get_all_contacts()
+        diff_entities(report, "contacts", ContactRepository, contacts, account_id)
+
+        # Причины отказа приходят только внутри сделок, поэтому stale для них не считается
+        loss_reasons = {}
+        leads = _iter_leads(LeadManager(token_manager, http_client), loss_reasons)
+        diff_entities(report, "leads", LeadRepository, leads, account_id)
+        diff_entities(report, "loss_reasons", LossReasonRepository, loss_reasons.values())
+
+        lead_ids = load_known_ids(LeadRepository, account_id)
+        contact_ids = load_known_ids(ContactRepository, account_id)
+        tasks = (
+            clear_missing_task_refs(task, lead_ids, contact_ids)
+            for task in TaskManager(token_manager, http_client).get_all_tasks()
+        )
+        diff_entities(report, "tasks", TaskRepository, tasks, account_id)
+        events = (
+            clear_missing_event_refs(event, lead_ids, contact_ids)
+            for event in build_event_manager(token_manager, http_client).get_all_lead_events()
+            if is_valid_event_id(event.id)
+        )
+        # Выгрузка событий ограничена EVENT_TYPES, и stale считается среди тех же типов.
+        # Значения EVENT_ENTITIES (lead, contact) не совпадают с entity_type в БД, с ними stale не считается
+        event_scope = (Event.type.in_(settings.EVENT_TYPES),) if settings.EVENT_TYPES else ()
+        events_account_id = None if settings.EVENT_ENTITIES else account_id
+        diff_entities(report, "events", EventRepository, events, events_account_id, batch_size=50, scope=event_scope)
+    finally:
+        http_client.close()
+
+    logger.info(report.format())
+    return report
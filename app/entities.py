@@ -1,7 +1,23 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Any, List, Optional
 
 
+@dataclass
+class CustomFieldValue:
+    # Одно значение поля из custom_fields_values; у мультиполей (телефоны, мультисписки)
+    # значения различаются позицией
+    entity_type: str
+    entity_id: int
+    field_id: int
+    position: int
+    field_type: Optional[str]
+    enum_id: Optional[int]
+    value_text: Optional[str]
+    value_number: Optional[float]
+    value_bool: Optional[bool]
+    account_id: int
+
+
 @dataclass
 class Lead:
     id: int
@@ -44,6 +60,7 @@ class Lead:
     tag_id: Optional[int]
     company_id: Optional[int]
     contact_id: Optional[int]
+    custom_field_values: List[CustomFieldValue] = field(default_factory=list)
 
 
 @dataclass
@@ -73,6 +90,7 @@ class Contact:
     was_in_bali: Optional[str]
     geography: Optional[str]
     language: Optional[str]
+    custom_field_values: List[CustomFieldValue] = field(default_factory=list)
 
 
 @dataclass
@@ -92,6 +110,7 @@ class Company:
     tag_name: Optional[str]
     phone: Optional[str]
     broker: Optional[str]
+    custom_field_values: List[CustomFieldValue] = field(default_factory=list)
 
 
 @dataclass
@@ -120,6 +139,7 @@ class User:
     name: str
     email: str
     lang: str
+    account_id: Optional[int] = None
 
 
 @dataclass
@@ -172,4 +192,16 @@ class LossReason:
     sort: int
     created_at: int
     updated_at: int
-    account_id: int = None 
\ No newline at end of file
+    account_id: int = None 
+
+
+@dataclass
+class EmbeddedRefs:
+    contact_ids: set[int] = field(default_factory=set)
+    company_ids: set[int] = field(default_factory=set)
+    tags: dict[int, str] = field(default_factory=dict)
+
+    def update(self, other: "EmbeddedRefs") -> None:
+        self.contact_ids |= other.contact_ids
+        self.company_ids |= other.company_ids
+        self.tags.update(other.tags)
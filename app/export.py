@@ -0,0 +1,133 @@
+import logging
+from datetime import datetime
+
+from app.config import KommoAccount, settings
+from app.db.base import session_maker
+from app.db.repositories import ContactRepository, LeadRepository
+from app.export_filter import ExportFilter
+from app.kommo.account import AccountManager
+from app.kommo.auth import TokenManager
+from app.kommo.transport import create_http_client
+from app.reference_cache import ReferenceCache
+from app.stages.common import get_modified_since_state, load_known_ids
+from app.stages.companies import export_companies
+from app.stages.contacts import export_contacts
+from app.stages.events import build_event_manager, export_events
+from app.stages.leads import (
+    build_lead_fk_resolver,
+    export_deferred_leads,
+    export_leads,
+    export_leads_by_pipeline,
+    get_lead_pipeline_ids,
+)
+from app.stages.pipelines import export_pipelines
+from app.stages.tasks import export_tasks
+from app.stages.users import export_users
+
+logger = logging.getLogger(__name__)
+
+
+def export_data(account: KommoAccount, export_filter: ExportFilter | None = None):
+    if settings.SPOOL_DIR:
+        from app.spool import fetch_to_spool, load_spool
+
+        # Выгрузка не зависит от доступности БД: всё полученное остаётся в спуле до загрузки
+        fetch_to_spool(account, export_filter)
+        load_spool(account)
+        return
+
+    from app.db.parquet_sink import open_parquet_sink
+    from app.kommo.companies import CompanyManager
+    from app.kommo.contacts import ContactManager
+    from app.kommo.leads import LeadManager
+    from app.kommo.pipelines import PipelineManager
+    from app.kommo.tasks import TaskManager
+    from app.kommo.users import UserManager
+
+    # Без фильтра выгружается всё; с фильтром - только выбранные стадии и окно/id из него
+    export_filter = export_filter or ExportFilter()
+    since = export_filter.since
+
+    start_time = datetime.now()
+    logger.info(f"Starting data export of {account.name} at {start_time}: {export_filter}")
+
+    http_client = create_http_client(account.base_url)
+    token_manager = TokenManager(http_client, account)
+    modified_since_state = get_modified_since_state(account)
+    reference_cache = ReferenceCache(account.reference_fingerprints_path)
+    parquet_sink = open_parquet_sink(session_maker)
+
+    try:
+        account_id = AccountManager(token_manager, http_client).get_account_id()
+        if export_filter.includes("users"):
+            export_users(
+                UserManager(token_manager, http_client, modified_since_state),
+                account_id,
+                reference_cache,
+            )
+        if export_filter.includes("pipelines"):
+            export_pipelines(
+                PipelineManager(token_manager, http_client, modified_since_state),
+                reference_cache,
+            )
+        if export_filter.includes("companies"):
+            export_companies(
+                CompanyManager(token_manager, http_client, modified_since_state),
+                since,
+                export_filter,
+            )
+        if export_filter.includes("contacts"):
+            export_contacts(ContactManager(token_manager, http_client), since, export_filter)
+        if export_filter.includes("leads"):
+            # Пропущенные стадии родителей закрывает резолвер FK: недостающие догружаются по id
+            pipeline_manager = PipelineManager(token_manager, http_client)
+            fk_resolver = build_lead_fk_resolver(
+                UserManager(token_manager, http_client),
+                pipeline_manager,
+                ContactManager(token_manager, http_client),
+                CompanyManager(token_manager, http_client),
+                account_id,
+                reference_cache,
+            )
+            lead_manager = LeadManager(token_manager, http_client)
+            if settings.LEAD_PIPELINE_WORKERS > 1 and not export_filter.ids:
+                export_leads_by_pipeline(
+                    lead_manager,
+                    export_filter.pipeline_ids or get_lead_pipeline_ids(account_id, pipeline_manager, reference_cache),
+                    since,
+                    reference_cache=reference_cache,
+                    fk_resolver=fk_resolver,
+                    export_filter=export_filter,
+                    account_id=account_id,
+                )
+            else:
+                export_leads(  # Теперь здесь также обрабатываются loss_reasons
+                    lead_manager,
+                    since,
+                    reference_cache=reference_cache,
+                    fk_resolver=fk_resolver,
+                    export_filter=export_filter,
+                )
+            export_deferred_leads(lead_manager, account.deferred_leads_path, reference_cache, fk_resolver)
+
+        if export_filter.includes("tasks") or export_filter.includes("events"):
+            # Create sets of existing lead and contact IDs for faster lookup
+            lead_ids = load_known_ids(LeadRepository, account_id)
+            contact_ids = load_known_ids(ContactRepository, account_id)
+
+        if export_filter.includes("tasks"):
+            export_tasks(TaskManager(token_manager, http_client), lead_ids, contact_ids, since, export_filter)
+        if export_filter.includes("events"):
+            export_events(build_event_manager(token_manager, http_client), lead_ids, contact_ids, since, export_filter)
+
+        end_time = datetime.now()
+        duration = end_time - start_time
+        logger.info(f"Export of {account.name} completed at {end_time}. Duration: {duration}")
+
+    except Exception as e:
+        logger.error(f"Error during export of {account.name}: {str(e)}")
+        raise
+    finally:
+        http_client.close()
+        if parquet_sink:
+            parquet_sink.close()
@@ -0,0 +1,50 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+EXPORT_STAGES = ("users", "pipelines", "companies", "contacts", "leads", "tasks", "events")
+# Стадии, которые выбираются по id сделок
+LEAD_ID_STAGES = ("leads", "tasks", "events")
+
+
+# Фильтры выборочной выгрузки: передаются в query-параметры Kommo, а не отбрасываются после загрузки
+@dataclass(frozen=True)
+class ExportFilter:
+    stages: tuple[str, ...] = EXPORT_STAGES
+    # unix time; для событий - по created_at, для остальных сущностей - по updated_at
+    since: int | None = None
+    until: int | None = None
+    # id сделок, контактов или компаний - только одной из них (check_ids_stages); задачи и события - по id сделок
+    ids: tuple[int, ...] = ()
+    # Только для сделок
+    pipeline_ids: tuple[int, ...] = ()
+
+    def includes(self, stage: str) -> bool:
+        return stage in self.stages
+
+
+def parse_time(value: str) -> int:
+    # unix time или ISO-дата (2025-01-01, 2025-01-01T12:00); дата без зоны - локальное время
+    if value.isdigit():
+        return int(value)
+    return int(datetime.fromisoformat(value).timestamp())
+
+
+def parse_ids(value: str) -> tuple[int, ...]:
+    return tuple(int(item) for item in value.split(",") if item.strip())
+
+
+def check_ids_stages(stages: tuple[str, ...]) -> None:
+    # У сделок, контактов и компаний свои последовательности id: один список id относится
+    # только к одной из них (задачи и события выбираются по id сделок)
+    if set(stages) <= set(LEAD_ID_STAGES) or stages in (("companies",), ("contacts",)):
+        return
+    raise ValueError("--ids needs --only with exactly one of leads (optionally with tasks,events), contacts, companies")
+
+
+def parse_stages(value: str) -> tuple[str, ...]:
+    stages = tuple(item.strip() for item in value.split(",") if item.strip())
+    unknown = [stage for stage in stages if stage not in EXPORT_STAGES]
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(unknown)}; expected {', '.join(EXPORT_STAGES)}")
+    # Порядок стадий фиксирован (FK), а не тот, что указан в командной строке
+    return tuple(stage for stage in EXPORT_STAGES if stage in stages)
@@ -0,0 +1,177 @@
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Literal
+
+logger = logging.getLogger(__name__)
+
+FkPolicy = Literal["null", "defer", "fetch"]
+
+# Колонка сделки -> родительская таблица
+LEAD_FOREIGN_KEYS = {
+    "responsible_user_id": "users",
+    "status_id": "statuses",
+    "pipeline_id": "pipelines",
+    "loss_reason_id": "loss_reasons",
+    "company_id": "companies",
+    "contact_id": "contacts",
+}
+LEAD_NULLABLE_FOREIGN_KEYS = {"loss_reason_id", "company_id", "contact_id"}
+
+
+@dataclass
+class ForeignKeyResolver:
+    foreign_keys: dict[str, str]
+    nullable: set[str]
+    policies: dict[str, FkPolicy]
+    # Загружает множество известных id родительской таблицы
+    load_ids: Callable[[str], set[int]]
+    # Догружает недостающих родителей по id, возвращает {таблица: id, которые теперь есть в БД}
+    fetchers: dict[str, Callable[[set[int]], dict[str, set[int]]]] = field(default_factory=dict)
+    # Колонки строк-кортежей. Кортежи и dataclass-сущности различаются по каждой строке:
+    # один резолвер обслуживает и пул конвертации, и выгрузку окнами, где сделки - сущности
+    columns: tuple[str, ...] | None = None
+    deferred: list = field(default_factory=list)
+    _indexes: dict[str, set[int]] = field(default_factory=dict, init=False, repr=False)
+    _positions: dict[str, int] = field(default_factory=dict, init=False, repr=False)
+    # Резолвер общий для параллельных выгрузок сделок по воронкам
+    _lock: threading.RLock = field(default_factory=threading.RLock, init=False, repr=False)
+    # id, которые сейчас догружает какой-то поток: HTTP и запись идут без замка
+    _fetching: dict[str, set[int]] = field(default_factory=dict, init=False, repr=False)
+    _fetched: threading.Condition = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self._fetched = threading.Condition(self._lock)
+        if self.columns is not None:
+            self._positions = {column: index for index, column in enumerate(self.columns)}
+
+    def _index(self, table: str) -> set[int]:
+        if table not in self._indexes:
+            self._indexes[table] = set(self.load_ids(table))
+        return self._indexes[table]
+
+    def add_known(self, table: str, ids) -> None:
+        with self._lock:
+            self._index(table).update(ids)
+
+    def reload(self) -> None:
+        with self._lock:
+            self._indexes.clear()
+
+    def _get(self, item, column: str):
+        if isinstance(item, tuple):
+            return item[self._positions[column]]
+        return getattr(item, column)
+
+    def _set_null(self, item, column: str):
+        if isinstance(item, tuple):
+            item = list(item)
+            item[self._positions[column]] = None
+            return tuple(item)
+        setattr(item, column, None)
+        return item
+
+    def _find_missing(self, items: list) -> dict[str, set[int]]:
+        missing = {}
+        for column, table in self.foreign_keys.items():
+            values = {self._get(item, column) for item in items}
+            values.discard(None)
+            absent = values - self._index(table)
+            if absent:
+                missing[column] = absent
+        return missing
+
+    def _reserve_fetches(self, missing: dict[str, set[int]]) -> dict[str, set[int]]:
+        # Под замком: забираем id, которые ещё никто не догружает; чужие догрузки дождёмся
+        reserved = {}
+        for column, ids in missing.items():
+            table = self.foreign_keys[column]
+            if self.policies.get(column) != "fetch" or table not in self.fetchers:
+                continue
+            fetching = self._fetching.setdefault(table, set())
+            own = ids - fetching
+            if own:
+                fetching.update(own)
+                reserved.setdefault(table, set()).update(own)
+        return reserved
+
+    def _fetch_missing(self, reserved: dict[str, set[int]]) -> None:
+        # Без замка: HTTP и запись в БД не блокируют резолв других воронок
+        fetched = {}
+        try:
+            for table, ids in reserved.items():
+                for fetched_table, fetched_ids in self.fetchers[table](ids).items():
+                    fetched.setdefault(fetched_table, set()).update(fetched_ids)
+        finally:
+            with self._fetched:
+                for fetched_table, fetched_ids in fetched.items():
+                    self._index(fetched_table).update(fetched_ids)
+                for table, ids in reserved.items():
+                    self._fetching[table] -= ids
+                self._fetched.notify_all()
+
+    def _is_fetching(self, missing: dict[str, set[int]]) -> bool:
+        return any(ids & self._fetching.get(self.foreign_keys[column], set()) for column, ids in missing.items())
+
+    def resolve(self, items: list, final: bool = False) -> list:
+        # Один проход по батчу на колонку: проверяем id по индексам, а не строку за строкой в БД
+        with self._lock:
+            missing = self._find_missing(items)
+            if not missing:
+                return items
+            reserved = self._reserve_fetches(missing)
+
+        if reserved:
+            self._fetch_missing(reserved)
+
+        with self._fetched:
+            self._fetched.wait_for(lambda: not self._is_fetching(missing))
+            return self._split(items, self._find_missing(items), final)
+
+    def _split(self, items: list, missing: dict[str, set[int]], final: bool) -> list:
+        if not missing:
+            return items
+
+        ready = []
+        nulled = 0
+        for item in items:
+            is_deferred = False
+            for column, ids in missing.items():
+                if self._get(item, column) not in ids:
+                    continue
+                if column in self.nullable and (final or self.policies.get(column) != "defer"):
+                    item = self._set_null(item, column)
+                    nulled += 1
+                else:
+                    is_deferred = True
+            if is_deferred:
+                self.deferred.append(item)
+            else:
+                ready.append(item)
+
+        if nulled or len(ready) < len(items):
+            summary = ", ".join(f"{column}={len(ids)}" for column, ids in missing.items())
+            logger.warning(
+                f"Missing parents ({summary}): nulled {nulled} references, "
+                f"deferred {len(items) - len(ready)} rows"
+            )
+        return ready
+
+    def flush_deferred(self) -> list:
+        # Повторная попытка после стадий родителей; то, что так и не нашлось, остаётся в очереди
+        with self._lock:
+            if not self.deferred:
+                return []
+
+            deferred, self.deferred = self.deferred, []
+            self.reload()
+
+        ready = self.resolve(deferred, final=True)
+        with self._lock:
+            if self.deferred:
+                logger.warning(f"{len(self.deferred)} rows still reference missing parents and stay deferred")
+        return ready
+
+    def deferred_ids(self) -> list[int]:
+        with self._lock:
+            return sorted({self._get(item, "id") for item in self.deferred})
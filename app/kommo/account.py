@@ -0,0 +1,11 @@
+from dataclasses import dataclass
+
+from app.kommo.base import BaseManager
+
+
+@dataclass
+class AccountManager(BaseManager):
+    def get_account_id(self) -> int:
+        response = self.http_client.get("api/v4/account", headers=self._headers)
+        response.raise_for_status()
+        return response.json()["id"]
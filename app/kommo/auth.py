@@ -1,35 +1,45 @@
 import json
-from dataclasses import dataclass
+import os
+import threading
+from dataclasses import dataclass, field
 from datetime import datetime
 
 from httpx import Client
 
-from app.config import settings
+from app.config import KommoAccount
 
 
 @dataclass
 class TokenManager:
     http_client: Client
+    account: KommoAccount
+    _token_file: dict | None = field(default=None, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
 
     def get_token(self) -> str:
-        try:
-            with open("data/token.json", "r") as token:
-                token_file = json.load(token)
-
-            if token_file["expires_in"] < int(datetime.now().timestamp()):
+        # Токен кешируется в памяти, чтобы долгоживущий процесс не читал файл на каждый запрос
+        with self._lock:
+            token_file = self._token_file
+            try:
+                if token_file is None:
+                    with open(self.account.token_path, "r") as token:
+                        token_file = json.load(token)
+
+                if token_file["expires_in"] < int(datetime.now().timestamp()):
+                    token_file = self.load_new_token(token_file["refresh_token"])
+            except FileNotFoundError:
                 token_file = self.load_new_token(token_file["refresh_token"])
-        except FileNotFoundError:
-            token_file = self.load_new_token(token_file["refresh_token"])
 
-        return token_file["access_token"]
+            self._token_file = token_file
+            return token_file["access_token"]
 
     def load_new_token(self, refresh_token) -> dict:
         json_data = {
-            "client_id": settings.KOMMO_INTEGRATION_ID,
-            "client_secret": settings.KOMMO_SECRET_KEY,
+            "client_id": self.account.integration_id,
+            "client_secret": self.account.secret_key,
             "grant_type": "refresh_token",
             "refresh_token": refresh_token,
-            "redirect_uri": settings.KOMMO_REDIRECT_URL,
+            "redirect_uri": self.account.redirect_url,
         }
 
         response = self.http_client.post(
@@ -43,7 +53,8 @@ class TokenManager:
 
         access_token_data = response.json()
         access_token_data["expires_in"] += datetime.now().timestamp()
-        with open("data/token.json", "w") as token:
+        os.makedirs(os.path.dirname(self.account.token_path), exist_ok=True)
+        with open(self.account.token_path, "w") as token:
             json.dump(access_token_data, token)
 
         return access_token_data
@@ -0,0 +1,142 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable, Hashable, Iterable, Iterator, TypeVar
+
+from httpx import Client
+
+from app.config import settings
+from app.kommo.auth import TokenManager
+from app.kommo.sharding import WindowPageGetter, iter_sharded
+
+# Максимальный размер страницы в API v4
+PAGE_LIMIT = 250
+
+T = TypeVar("T")
+
+
+def _request_page(executor: ThreadPoolExecutor | None, get_page: Callable[[int], T], page: int) -> Callable[[], T]:
+    if executor is None:
+        return partial(get_page, page)
+    return executor.submit(get_page, page).result
+
+
+@dataclass
+class BaseManager:
+    token_manager: TokenManager
+    http_client: Client
+
+    @property
+    def _headers(self) -> dict[str, str]:
+        oauth_token = self.token_manager.get_token()
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {oauth_token}",
+        }
+
+    def _get_content(self, path: str, params: dict, headers: dict[str, str] | None = None) -> bytes:
+        response = self.http_client.get(path, params=params, headers=headers or self._headers)
+
+        # 204 - пустая страница или нет изменений с If-Modified-Since; 304 считаем тем же
+        if response.status_code in (204, 304):
+            return b""
+
+        response.raise_for_status()
+        return response.content
+
+    def _get_embedded(
+        self,
+        path: str,
+        key: str,
+        params: dict,
+        headers: dict[str, str] | None = None,
+    ) -> list[dict]:
+        content = self._get_content(path, params, headers)
+        if not content:
+            return []
+        return json.loads(content)["_embedded"][key]
+
+    def _iter_pages(
+        self,
+        get_page: Callable[[int], T],
+        is_last_page: Callable[[T], bool] = lambda result: False,
+    ) -> Iterator[T]:
+        # Двойная буферизация: страница N+1 запрашивается в фоне, пока вызывающий обрабатывает страницу N.
+        # Обход заканчивается на пустой странице или на той, что is_last_page признал последней
+        executor = ThreadPoolExecutor(max_workers=1) if settings.KOMMO_PREFETCH_PAGES else None
+        page = 1
+        fetch = _request_page(executor, get_page, page)
+        try:
+            while True:
+                result = fetch()
+                if not result:
+                    return
+
+                is_last = is_last_page(result)
+                if not is_last:
+                    fetch = _request_page(executor, get_page, page + 1)
+
+                yield result
+
+                if is_last:
+                    return
+                page += 1
+        finally:
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def _iter_items(self, get_page: Callable[[int], list[T]], limit: int = PAGE_LIMIT) -> Iterator[T]:
+        for items in self._iter_pages(get_page, lambda items: len(items) < limit):
+            yield from items
+
+    def _iter_versions(self, path: str, key: str) -> Iterator[tuple[int, int]]:
+        # Облегчённый список для сверки: без with=..., от каждой сущности остаются только id и updated_at
+        return self._iter_items(
+            lambda page: [
+                (item["id"], item["updated_at"])
+                for item in self._get_embedded(path, key, {"limit": PAGE_LIMIT, "page": page})
+            ]
+        )
+
+    def _iter_parallel(self, streams: list[Callable[[], Iterable[T]]], workers: int) -> Iterator[T]:
+        # Независимые выборки (например, по типам событий) читаются параллельно и отдаются
+        # целиком по мере готовности; все запросы по-прежнему идут через общий лимит клиента
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(lambda stream=stream: list(stream())) for stream in streams]
+            try:
+                for future in as_completed(futures):
+                    yield from future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def _iter_sharded_items(
+        self,
+        get_page: WindowPageGetter,
+        get_id: Callable[[T], Hashable],
+        get_created_at: Callable[[T], int],
+        created_from: int | None = None,
+        created_to: int | None = None,
+    ) -> Iterator[T]:
+        # Без нижней границы окна нарезаются от даты создания аккаунта. Всё, что раньше
+        # (импортированные сущности), идёт одним окном, которое делится, только если оно большое
+        planned_from = created_from
+        if created_from is None:
+            created_from = 0
+            planned_from = json.loads(self._get_content("api/v4/account", {}))["created_at"]
+        if created_to is None:
+            created_to = int(time.time())
+
+        return iter_sharded(
+            get_page,
+            created_from,
+            created_to,
+            get_id,
+            get_created_at,
+            planned_from=planned_from,
+            limit=PAGE_LIMIT,
+            pages_per_window=settings.SHARD_PAGES_PER_WINDOW,
+            workers=settings.SHARD_WORKERS,
+        )
@@ -1,54 +1,76 @@
 from dataclasses import dataclass
-from typing import Iterator
-
-from httpx import Client
+from datetime import datetime
+from functools import partial
+from typing import Callable, Iterable, Iterator
 
 from app.entities import Company
-from app.kommo.auth import TokenManager
+from app.kommo.base import PAGE_LIMIT, BaseManager
+from app.kommo.conditional import build_modified_since_key, format_if_modified_since
 from app.kommo.converters import convert_company_json_to_entity
+from app.sync_state import SyncState
 
 
 @dataclass
-class CompanyManager:
-    token_manager: TokenManager
-    http_client: Client
-
-    @property
-    def _headers(self) -> dict[str, str]:
-        oauth_token = self.token_manager.get_token()
-        return {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {oauth_token}",
-        }
-
-    def get_companies(self, page: int, limit: int = 250) -> list[Company]:
+class CompanyManager(BaseManager):
+    modified_since_state: SyncState | None = None
+
+    def get_companies(
+        self,
+        page: int,
+        limit: int = PAGE_LIMIT,
+        updated_from: int | None = None,
+        modified_since: int | None = None,
+        ids: list[int] | None = None,
+        updated_to: int | None = None,
+    ) -> list[Company]:
         params = {"limit": limit, "page": page}
+        if updated_from:
+            params["filter[updated_at][from]"] = updated_from
+        if updated_to:
+            params["filter[updated_at][to]"] = updated_to
+        if ids:
+            params["filter[id][]"] = ids
 
-        response = self.http_client.get(
-            "api/v4/companies",
-            params=params,
-            headers=self._headers,
-        )
-        response.raise_for_status()
-        
-        if response.status_code == 204:
-            return []
-            
-        if not response.content:
-            return []
-
-        companies = response.json()["_embedded"]["companies"]
+        headers = self._headers
+        if modified_since:
+            headers["If-Modified-Since"] = format_if_modified_since(modified_since)
+
+        companies = self._get_embedded("api/v4/companies", "companies", params, headers)
         return [convert_company_json_to_entity(company) for company in companies]
 
-    def get_all_companies(self) -> Iterator[Company]:
-        page = 1
-        is_has_next_page = True
+    def get_all_companies(
+        self,
+        updated_from: int | None = None,
+        updated_to: int | None = None,
+        ids: list[int] | None = None,
+        sync_marks: list[Callable[[], None]] | None = None,
+    ) -> Iterator[Company]:
+        state_key = build_modified_since_key("api/v4/companies", {})
+        started_at = int(datetime.now().timestamp())
+        # Выборка по id или с верхней границей не покрывает все изменения, её время не запоминаем
+        modified_since_state = None if updated_to or ids else self.modified_since_state
+        modified_since = None
+        if modified_since_state:
+            modified_since = modified_since_state.get_last_sync(state_key)
+
+        yield from self._iter_items(
+            lambda page: self.get_companies(
+                page=page,
+                updated_from=updated_from,
+                modified_since=modified_since,
+                ids=ids,
+                updated_to=updated_to,
+            )
+        )
+
+        # Время запроса запоминает стадия после записи в БД (см. UserManager.get_all_users)
+        if modified_since_state and sync_marks is not None:
+            sync_marks.append(partial(modified_since_state.set_last_sync, state_key, started_at))
 
-        while is_has_next_page:
-            companies = self.get_companies(page=page)
-            
-            if len(companies) < 250:
-                is_has_next_page = False
+    def get_company_versions(self) -> Iterator[tuple[int, int]]:
+        return self._iter_versions("api/v4/companies", "companies")
 
-            yield from companies
-            page += 1
+    def get_companies_by_ids(self, ids: Iterable[int], chunk_size: int = 100) -> Iterator[Company]:
+        ids = sorted(ids)
+        for i in range(0, len(ids), chunk_size):
+            yield from self.get_companies(page=1, limit=chunk_size, ids=ids[i : i + chunk_size])
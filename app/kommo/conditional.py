@@ -0,0 +1,17 @@
+from email.utils import formatdate
+
+
+def format_if_modified_since(timestamp: int) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+
+def build_modified_since_key(path: str, params: dict) -> str:
+    # Номер страницы, лимит и временные фильтры не входят в ключ: они меняются от запуска к запуску
+    static_params = sorted(
+        (key, str(value))
+        for key, value in params.items()
+        if key not in ("page", "limit") and not key.startswith("filter[updated_at]")
+    )
+    if not static_params:
+        return path
+    return path + "?" + "&".join(f"{key}={value}" for key, value in static_params)
@@ -1,56 +1,46 @@
 from dataclasses import dataclass
-from typing import Iterator
-
-from httpx import Client
+from typing import Iterable, Iterator
 
 from app.entities import Contact
-from app.kommo.auth import TokenManager
+from app.kommo.base import PAGE_LIMIT, BaseManager
 from app.kommo.converters import convert_contact_json_to_entity
 
 
 @dataclass
-class ContactManager:
-    token_manager: TokenManager
-    http_client: Client
-
-    @property
-    def _headers(self) -> dict[str, str]:
-        oauth_token = self.token_manager.get_token()
-        return {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {oauth_token}",
-        }
-
-    def get_contacts(self, page: int, limit: int = 250) -> list[Contact]:
+class ContactManager(BaseManager):
+    def get_contacts(
+        self,
+        page: int,
+        limit: int = PAGE_LIMIT,
+        updated_from: int | None = None,
+        ids: list[int] | None = None,
+        updated_to: int | None = None,
+    ) -> list[Contact]:
         params = {"limit": limit, "page": page}
-
-        response = self.http_client.get(
-            "api/v4/contacts",
-            params=params,
-            headers=self._headers,
-        )
-        response.raise_for_status()
-        
-        response.raise_for_status()
-        
-        if response.status_code == 204:
-            return []
-            
-        if not response.content:
-            return []
-
-        contacts = response.json()["_embedded"]["contacts"]
+        if updated_from:
+            params["filter[updated_at][from]"] = updated_from
+        if updated_to:
+            params["filter[updated_at][to]"] = updated_to
+        if ids:
+            params["filter[id][]"] = ids
+
+        contacts = self._get_embedded("api/v4/contacts", "contacts", params)
         return [convert_contact_json_to_entity(contact) for contact in contacts]
 
-    def get_all_contacts(self) -> Iterator[Contact]:
-        page = 1
-        is_has_next_page = True
+    def get_all_contacts(
+        self,
+        updated_from: int | None = None,
+        updated_to: int | None = None,
+        ids: list[int] | None = None,
+    ) -> Iterator[Contact]:
+        return self._iter_items(
+            lambda page: self.get_contacts(page=page, updated_from=updated_from, ids=ids, updated_to=updated_to)
+        )
 
-        while is_has_next_page:
-            contacts = self.get_contacts(page=page)
-            
-            if len(contacts) < 250:
-                is_has_next_page = False
+    def get_contact_versions(self) -> Iterator[tuple[int, int]]:
+        return self._iter_versions("api/v4/contacts", "contacts")
 
-            yield from contacts
-            page += 1
+    def get_contacts_by_ids(self, ids: Iterable[int], chunk_size: int = 100) -> Iterator[Contact]:
+        ids = sorted(ids)
+        for i in range(0, len(ids), chunk_size):
+            yield from self.get_contacts(page=1, limit=chunk_size, ids=ids[i : i + chunk_size])
@@ -1,4 +1,52 @@
-from app.entities import Company, Contact, Event, Lead, LossReason, Pipeline, Status, Task, User
+import json
+
+from app.entities import (
+    Company,
+    Contact,
+    CustomFieldValue,
+    EmbeddedRefs,
+    Event,
+    Lead,
+    LossReason,
+    Pipeline,
+    Status,
+    Task,
+    User,
+)
+
+
+def convert_custom_field_values(json_data: dict, entity_type: str) -> list[CustomFieldValue]:
+    # Все поля без разбора по именам: значение раскладывается по колонке своего типа,
+    # составные значения (юрлица, адреса) хранятся JSON-строкой
+    values = []
+    for field in json_data.get("custom_fields_values") or []:
+        for position, item in enumerate(field.get("values") or []):
+            value = item.get("value")
+            value_text = value_number = value_bool = None
+            if isinstance(value, bool):
+                value_bool = value
+            elif isinstance(value, (int, float)):
+                value_number = value
+            elif isinstance(value, (dict, list)):
+                value_text = json.dumps(value, ensure_ascii=False)
+            elif value is not None:
+                value_text = str(value)
+
+            values.append(
+                CustomFieldValue(
+                    entity_type=entity_type,
+                    entity_id=json_data["id"],
+                    field_id=field["field_id"],
+                    position=position,
+                    field_type=field.get("field_type"),
+                    enum_id=item.get("enum_id"),
+                    value_text=value_text,
+                    value_number=value_number,
+                    value_bool=value_bool,
+                    account_id=json_data["account_id"],
+                )
+            )
+    return values
 
 
 def convert_lead_json_to_entity(json_data: dict) -> Lead:
@@ -83,7 +131,8 @@ def convert_lead_json_to_entity(json_data: dict) -> Lead:
         tag_name=tag,
         tag_id=tag_id,
         company_id=company_id,
-        contact_id=contact_id
+        contact_id=contact_id,
+        custom_field_values=convert_custom_field_values(json_data, "leads"),
     )
 
 
@@ -142,6 +191,7 @@ def convert_contact_json_to_entity(json_data: dict) -> Contact:
         was_in_bali=custom_fields.get("Был на Бали"),
         geography=custom_fields.get("География"),
         language=custom_fields.get("Язык"),
+        custom_field_values=convert_custom_field_values(json_data, "contacts"),
     )
 
 
@@ -183,6 +233,7 @@ def convert_company_json_to_entity(json_data: dict) -> Company:
         tag_name=tag.get("name") if tag else None,
         phone=custom_fields.get("phone"),
         broker=custom_fields.get("Брокер"),
+        custom_field_values=convert_custom_field_values(json_data, "companies"),
     )
 
 
@@ -290,4 +341,15 @@ def convert_loss_reason_json_to_entity(json_data: dict) -> LossReason:
         created_at=json_data["created_at"],
         updated_at=json_data["updated_at"],
         account_id=json_data.get("account_id")  # Используем get() для безопасного получения
-    )
\ No newline at end of file
+    )
+
+
+def collect_embedded_refs(json_data: dict, refs: EmbeddedRefs) -> None:
+    # Сделки уже приходят с with=contacts, поэтому ссылки на соседей достаются бесплатно
+    embedded = json_data.get("_embedded", {})
+    for contact in embedded.get("contacts") or []:
+        refs.contact_ids.add(contact["id"])
+    for company in embedded.get("companies") or []:
+        refs.company_ids.add(company["id"])
+    for tag in embedded.get("tags") or []:
+        refs.tags[tag["id"]] = tag.get("name")
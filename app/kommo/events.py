@@ -1,64 +1,131 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import partial
 from typing import Iterator
 
-from httpx import Client
-
 from app.entities import Event
-from app.kommo.auth import TokenManager
+from app.kommo.base import PAGE_LIMIT, BaseManager
 from app.kommo.converters import convert_event_json_to_entity
 
+# Kommo принимает не больше 10 значений filter[entity_id][] и filter[type][] в одном запросе
+MAX_ENTITY_IDS_PER_REQUEST = 10
+MAX_TYPES_PER_REQUEST = 10
 
-@dataclass
-class EventManager:
-    token_manager: TokenManager
-    http_client: Client
 
-    @property
-    def _headers(self) -> dict[str, str]:
-        oauth_token = self.token_manager.get_token()
-        return {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {oauth_token}",
-        }
+def _chunks(values: list, size: int) -> list[list]:
+    return [values[i : i + size] for i in range(0, len(values), size)]
+
+
+@dataclass
+class EventManager(BaseManager):
+    # Фильтры на стороне Kommo: типы событий (lead_status_changed, custom_field_123_value_changed, ...)
+    # и сущности (lead, contact, company, ...). Пустой список - без фильтра
+    types: list[str] = field(default_factory=list)
+    entities: list[str] = field(default_factory=list)
+    # Сколько типов событий выгружать параллельными потоками (1 - все типы одним обходом)
+    type_streams: int = 1
 
     def get_lead_events(
         self,
         page: int = 1,
-        limit: int = 250,
+        limit: int = PAGE_LIMIT,
+        created_from: int | None = None,
+        created_to: int | None = None,
+        lead_ids: list[int] | None = None,
+        types: list[str] | None = None,
     ) -> list[Event]:
         params = {
             "limit": limit,
             "page": page,
         }
+        if created_from:
+            params["filter[created_at][from]"] = created_from
+        if created_to:
+            params["filter[created_at][to]"] = created_to
+        if types:
+            params["filter[type][]"] = types
+        if lead_ids:
+            params["filter[entity][]"] = "lead"
+            params["filter[entity_id][]"] = lead_ids
+        elif self.entities:
+            params["filter[entity][]"] = self.entities
 
-        response = self.http_client.get(
-            "api/v4/events",
-            params=params,
-            headers=self._headers,
-        )
-        response.raise_for_status()
-
-        if response.status_code == 204:
-            return []
-            
-        if not response.content:
-            return []
-        
-        events = response.json()["_embedded"]["events"]
+        events = self._get_embedded("api/v4/events", "events", params)
         return [convert_event_json_to_entity(event) for event in events]
 
-    def get_all_lead_events(
+    def _type_groups(self) -> list[list[str] | None]:
+        # Один тип на поток при параллельной выгрузке, иначе пачки по лимиту Kommo
+        if not self.types:
+            return [None]
+        if self.type_streams > 1:
+            return [[event_type] for event_type in self.types]
+        return _chunks(self.types, MAX_TYPES_PER_REQUEST)
+
+    def _iter_by_type(self, iter_events, **kwargs) -> Iterator[Event]:
+        # У события ровно один тип, так что потоки по типам не пересекаются и дедупликация не нужна
+        streams = [partial(iter_events, types=types, **kwargs) for types in self._type_groups()]
+        if len(streams) == 1 or self.type_streams <= 1:
+            for stream in streams:
+                yield from stream()
+            return
+        yield from self._iter_parallel(streams, self.type_streams)
+
+    def _iter_events(
         self,
+        created_from: int | None = None,
+        created_to: int | None = None,
+        lead_ids: list[int] | None = None,
+        types: list[str] | None = None,
     ) -> Iterator[Event]:
-        page = 1
-        is_has_next_page = True
+        if lead_ids and len(lead_ids) > MAX_ENTITY_IDS_PER_REQUEST:
+            for chunk in _chunks(sorted(lead_ids), MAX_ENTITY_IDS_PER_REQUEST):
+                yield from self._iter_events(created_from, created_to, chunk, types)
+            return
 
-        while is_has_next_page:
-            events = self.get_lead_events(page=page)
-            
-            if len(events) < 250:
-                is_has_next_page = False
+        yield from self._iter_items(
+            lambda page: self.get_lead_events(
+                page=page,
+                created_from=created_from,
+                created_to=created_to,
+                lead_ids=lead_ids,
+                types=types,
+            )
+        )
 
-            yield from events
-            page += 1
+    def _iter_events_sharded(
+        self,
+        created_from: int | None = None,
+        created_to: int | None = None,
+        types: list[str] | None = None,
+    ) -> Iterator[Event]:
+        return self._iter_sharded_items(
+            lambda page, window_from, window_to: self.get_lead_events(
+                page=page,
+                created_from=window_from,
+                created_to=window_to,
+                types=types,
+            ),
+            get_id=lambda event: event.id,
+            get_created_at=lambda event: event.created_at,
+            created_from=created_from,
+            created_to=created_to,
+        )
 
+    def get_all_lead_events(
+        self,
+        created_from: int | None = None,
+        created_to: int | None = None,
+        lead_ids: list[int] | None = None,
+    ) -> Iterator[Event]:
+        return self._iter_by_type(
+            self._iter_events,
+            created_from=created_from,
+            created_to=created_to,
+            lead_ids=lead_ids,
+        )
+
+    def get_all_lead_events_sharded(
+        self,
+        created_from: int | None = None,
+        created_to: int | None = None,
+    ) -> Iterator[Event]:
+        return self._iter_by_type(self._iter_events_sharded, created_from=created_from, created_to=created_to)
@@ -1,58 +1,129 @@
+import json
 from dataclasses import dataclass
-from typing import Iterable
+from typing import Iterable, Iterator
 
-from httpx import Client
-
-from app.entities import Lead
-from app.kommo.auth import TokenManager
-from app.kommo.converters import convert_lead_json_to_entity
+from app.entities import Lead, LossReason
+from app.kommo.base import PAGE_LIMIT, BaseManager
+from app.kommo.converters import convert_loss_reason_json_to_entity
 
 
 @dataclass
-class LeadManager:
-    token_manager: TokenManager
-    http_client: Client
-
-    @property
-    def _headers(self):
-        oauth_token = self.token_manager.get_token()
-        return {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {oauth_token}",
-        }
-
-    def get_leads(self, page, limit: int = 250) -> list[Lead]:
+class LeadManager(BaseManager):
+    def get_leads_content(
+        self,
+        page,
+        limit: int = PAGE_LIMIT,
+        updated_from: int | None = None,
+        updated_to: int | None = None,
+        ids: list[int] | None = None,
+        pipeline_ids: list[int] | None = None,
+        created_from: int | None = None,
+        created_to: int | None = None,
+        order: str | None = None,
+    ) -> bytes:
         params = {"limit": limit, "page": page, "with": "contacts,loss_reason"}
+        if updated_from:
+            params["filter[updated_at][from]"] = updated_from
+        if updated_to:
+            params["filter[updated_at][to]"] = updated_to
+        if ids:
+            params["filter[id][]"] = ids
+        if pipeline_ids:
+            params["filter[pipeline_id][]"] = pipeline_ids
+        if created_from:
+            params["filter[created_at][from]"] = created_from
+        if created_to:
+            params["filter[created_at][to]"] = created_to
+        if order:
+            params["order[created_at]"] = order
+
+        return self._get_content("api/v4/leads", params)
 
-        response = self.http_client.get(
-            "api/v4/leads",
-            params=params,
-            headers=self._headers,
+    def get_leads(
+        self,
+        page,
+        limit: int = PAGE_LIMIT,
+        updated_from: int | None = None,
+        updated_to: int | None = None,
+        ids: list[int] | None = None,
+        pipeline_ids: list[int] | None = None,
+        created_from: int | None = None,
+        created_to: int | None = None,
+        order: str | None = None,
+    ) -> list[Lead]:
+        content = self.get_leads_content(
+            page, limit, updated_from, updated_to, ids, pipeline_ids, created_from, created_to, order
         )
-        
-        response.raise_for_status()
-        
-        if response.status_code == 204:
-            return []
-            
-        if not response.content:
+
+        if not content:
             return []
 
-        leads = response.json()["_embedded"]["leads"]
+        # Сделки отдаются как JSON: конвертацию в сущности делает стадия экспорта
+        return json.loads(content)["_embedded"]["leads"]
+
+    def get_all_leads(
+        self,
+        updated_from: int | None = None,
+        updated_to: int | None = None,
+        ids: list[int] | None = None,
+        pipeline_ids: list[int] | None = None,
+    ) -> Iterable[Lead]:
+        return self._iter_items(
+            lambda page: self.get_leads(
+                page=page,
+                updated_from=updated_from,
+                updated_to=updated_to,
+                ids=ids,
+                pipeline_ids=pipeline_ids,
+            )
+        )
+
+    def get_lead_versions(self) -> Iterator[tuple[int, int]]:
+        return self._iter_versions("api/v4/leads", "leads")
 
-        # return [convert_lead_json_to_entity(lead) for lead in leads]
-        
-        return leads
-    
-    def get_all_leads(self) -> Iterable[Lead]:
-        page = 1
-        is_has_next_page = True
+    def get_loss_reasons(self, page: int, limit: int = PAGE_LIMIT) -> list[LossReason]:
+        loss_reasons = self._get_embedded("api/v4/leads/loss_reasons", "loss_reasons", {"limit": limit, "page": page})
+        return [convert_loss_reason_json_to_entity(loss_reason) for loss_reason in loss_reasons]
 
-        while is_has_next_page:
-            leads = self.get_leads(page=page)
-            
-            if len(leads) < 250:
-                is_has_next_page = False
+    def get_all_loss_reasons(self) -> Iterator[LossReason]:
+        return self._iter_items(lambda page: self.get_loss_reasons(page=page))
 
-            yield from leads
-            page += 1
+    def get_all_leads_sharded(
+        self,
+        created_from: int | None = None,
+        created_to: int | None = None,
+        pipeline_ids: list[int] | None = None,
+    ) -> Iterator[dict]:
+        # Полная выгрузка параллельными окнами по created_at вместо одного глубокого обхода страниц.
+        # Новые сделки первыми: по первой странице оценивается плотность самого загруженного периода
+        return self._iter_sharded_items(
+            lambda page, window_from, window_to: self.get_leads(
+                page=page,
+                pipeline_ids=pipeline_ids,
+                created_from=window_from,
+                created_to=window_to,
+                order="desc",
+            ),
+            get_id=lambda lead: lead["id"],
+            get_created_at=lambda lead: lead["created_at"],
+            created_from=created_from,
+            created_to=created_to,
+        )
+
+    def get_all_lead_pages(
+        self,
+        updated_from: int | None = None,
+        updated_to: int | None = None,
+        ids: list[int] | None = None,
+        pipeline_ids: list[int] | None = None,
+    ) -> Iterator[bytes]:
+        # Сырые страницы не разбираем, поэтому идём до пустого ответа (204)
+        return self._iter_pages(
+            lambda page: self.get_leads_content(
+                page=page,
+                updated_from=updated_from,
+                updated_to=updated_to,
+                ids=ids,
+                pipeline_ids=pipeline_ids,
+            )
+        )
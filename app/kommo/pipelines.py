@@ -1,54 +1,43 @@
 from dataclasses import dataclass
-from typing import Iterator
-
-from httpx import Client
+from datetime import datetime
+from functools import partial
+from typing import Callable, Iterator
 
 from app.entities import Pipeline
-from app.kommo.auth import TokenManager
+from app.kommo.base import PAGE_LIMIT, BaseManager
+from app.kommo.conditional import build_modified_since_key, format_if_modified_since
 from app.kommo.converters import convert_pipeline_json_to_entity
+from app.sync_state import SyncState
 
 
 @dataclass
-class PipelineManager:
-    token_manager: TokenManager
-    http_client: Client
-
-    @property
-    def _headers(self) -> dict[str, str]:
-        oauth_token = self.token_manager.get_token()
-        return {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {oauth_token}",
-        }
-
-    def get_pipelines(self, page: int = 1, limit: int = 250) -> list[Pipeline]:
+class PipelineManager(BaseManager):
+    modified_since_state: SyncState | None = None
+
+    def get_pipelines(
+        self,
+        page: int = 1,
+        limit: int = PAGE_LIMIT,
+        modified_since: int | None = None,
+    ) -> list[Pipeline]:
         params = {"limit": limit, "page": page}
 
-        response = self.http_client.get(
-            "api/v4/leads/pipelines",
-            params=params,
-            headers=self._headers,
-        )
-        response.raise_for_status()
-        
-        if response.status_code == 204:
-            return []
-            
-        if not response.content:
-            return []
-        
-        pipelines = response.json()["_embedded"]["pipelines"]
+        headers = self._headers
+        if modified_since:
+            headers["If-Modified-Since"] = format_if_modified_since(modified_since)
+
+        pipelines = self._get_embedded("api/v4/leads/pipelines", "pipelines", params, headers)
         return [convert_pipeline_json_to_entity(pipeline) for pipeline in pipelines]
 
-    def get_all_pipelines(self) -> Iterator[Pipeline]:
-        page = 1
-        is_has_next_page = True
+    def get_all_pipelines(self, sync_marks: list[Callable[[], None]] | None = None) -> Iterator[Pipeline]:
+        state_key = build_modified_since_key("api/v4/leads/pipelines", {})
+        started_at = int(datetime.now().timestamp())
+        modified_since = None
+        if self.modified_since_state:
+            modified_since = self.modified_since_state.get_last_sync(state_key)
 
-        while is_has_next_page:
-            pipelines = self.get_pipelines(page=page)
-            
-            if len(pipelines) < 250:
-                is_has_next_page = False
+        yield from self._iter_items(lambda page: self.get_pipelines(page=page, modified_since=modified_since))
 
-            yield from pipelines
-            page += 1
+        # Время запроса запоминает стадия после записи в БД (см. UserManager.get_all_users)
+        if self.modified_since_state and sync_marks is not None:
+            sync_marks.append(partial(self.modified_since_state.set_last_sync, state_key, started_at))
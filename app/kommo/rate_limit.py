@@ -0,0 +1,28 @@
+import threading
+import time
+
+
+# Token bucket на все запросы одного HTTP-клиента: стадии, шарды и предзагрузка страниц
+# делят один лимит Kommo (7 запросов в секунду на интеграцию)
+class RateLimiter:
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            # Токен берётся сразу, даже в долг: ожидание идёт вне блокировки, очередь честная
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if wait:
+            time.sleep(wait)
@@ -0,0 +1,119 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Hashable, Iterator, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Окно по created_at: границы включительно, как в filter[created_at][from|to]
+Window = tuple[int, int]
+# (страница, created_from, created_to) -> элементы страницы
+WindowPageGetter = Callable[[int, int, int], list[T]]
+
+
+def plan_windows(created_from: int, created_to: int, probe_timestamps: list[int], target_items: int) -> list[Window]:
+    # Плотность оцениваем по первой странице пробы: сколько секунд created_at занимают её элементы.
+    # Проба - самые новые сущности, обычно это самый плотный период, так что окна скорее меньше нужного
+    span = max(probe_timestamps) - min(probe_timestamps) if probe_timestamps else 0
+    density = len(probe_timestamps) / max(span, 1)
+    window_seconds = max(int(target_items / density), 1)
+
+    windows = []
+    start = created_from
+    while start <= created_to:
+        end = min(start + window_seconds - 1, created_to)
+        windows.append((start, end))
+        start = end + 1
+    return windows
+
+
+def split_window(window: Window) -> list[Window]:
+    start, end = window
+    if start >= end:
+        return []
+    middle = (start + end) // 2
+    return [(start, middle), (middle + 1, end)]
+
+
+def fetch_window(
+    get_page: WindowPageGetter,
+    window: Window,
+    limit: int,
+    max_pages: int,
+) -> tuple[list[T], list[Window]]:
+    # Глубокие страницы у Kommo медленные: окно, не уложившееся в max_pages, делится пополам.
+    # Уже полученные элементы не выбрасываются, повторы после деления убирает дедупликация по id
+    items = []
+    for page in range(1, max_pages + 1):
+        page_items = get_page(page, *window)
+        items.extend(page_items)
+        if len(page_items) < limit:
+            return items, []
+
+    halves = split_window(window)
+    if not halves:
+        # Секунду не поделить: дочитываем окно до конца
+        page = max_pages
+        while True:
+            page += 1
+            page_items = get_page(page, *window)
+            items.extend(page_items)
+            if len(page_items) < limit:
+                return items, []
+    return items, halves
+
+
+def iter_sharded(
+    get_page: WindowPageGetter,
+    created_from: int,
+    created_to: int,
+    get_id: Callable[[T], Hashable],
+    get_created_at: Callable[[T], int],
+    limit: int,
+    pages_per_window: int,
+    workers: int,
+    planned_from: int | None = None,
+) -> Iterator[T]:
+    # Проба - первая страница всего диапазона: если она неполная, делить нечего
+    probe = get_page(1, created_from, created_to)
+    seen = set()
+    for item in probe:
+        seen.add(get_id(item))
+        yield item
+    if len(probe) < limit:
+        return
+
+    planned_from = max(planned_from or created_from, created_from)
+    # Окна планируются на половину лимита страниц, чтобы ошибка оценки плотности не приводила к делению
+    windows = plan_windows(
+        planned_from,
+        created_to,
+        [get_created_at(item) for item in probe],
+        limit * pages_per_window // 2,
+    )
+    if planned_from > created_from:
+        windows.insert(0, (created_from, planned_from - 1))
+    logger.info(f"Fetching {created_from}..{created_to} in {len(windows)} created_at windows with {workers} workers")
+
+    splits = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(fetch_window, get_page, window, limit, pages_per_window) for window in windows}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    items, halves = future.result()
+                    splits += bool(halves)
+                    for window in halves:
+                        pending.add(executor.submit(fetch_window, get_page, window, limit, pages_per_window))
+                    for item in items:
+                        item_id = get_id(item)
+                        if item_id not in seen:
+                            seen.add(item_id)
+                            yield item
+        finally:
+            for future in pending:
+                future.cancel()
+
+    logger.info(f"Sharded fetch got {len(seen)} unique items, {splits} windows were split")
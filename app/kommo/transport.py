@@ -0,0 +1,104 @@
+import importlib.util
+import logging
+import threading
+from dataclasses import dataclass, field
+
+from httpx import Client, Limits, Response, Timeout
+
+from app.config import settings
+from app.kommo.rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class EndpointTransfer:
+    requests: int = 0
+    # Байты тела ответа до и после распаковки Content-Encoding
+    wire_bytes: int = 0
+    decoded_bytes: int = 0
+
+
+@dataclass
+class TransferStats:
+    endpoints: dict[str, EndpointTransfer] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def record(self, endpoint: str, wire_bytes: int, decoded_bytes: int) -> None:
+        with self._lock:
+            transfer = self.endpoints.setdefault(endpoint, EndpointTransfer())
+            transfer.requests += 1
+            transfer.wire_bytes += wire_bytes
+            transfer.decoded_bytes += decoded_bytes
+
+    def format(self) -> str:
+        lines = [f"{'endpoint':<28}{'requests':>10}{'wire MB':>10}{'decoded MB':>12}{'ratio':>8}"]
+        for endpoint, transfer in sorted(self.endpoints.items()):
+            ratio = transfer.decoded_bytes / transfer.wire_bytes if transfer.wire_bytes else 0
+            lines.append(
+                f"{endpoint:<28}{transfer.requests:>10}{transfer.wire_bytes / 1e6:>10.2f}"
+                f"{transfer.decoded_bytes / 1e6:>12.2f}{ratio:>8.1f}"
+            )
+        return "\n".join(lines)
+
+
+def _accept_encoding() -> str:
+    # httpx распаковывает br и zstd только при установленных brotli/brotlicffi и zstandard
+    encodings = ["gzip", "deflate"]
+    if importlib.util.find_spec("brotli") or importlib.util.find_spec("brotlicffi"):
+        encodings.insert(0, "br")
+    if importlib.util.find_spec("zstandard"):
+        encodings.insert(0, "zstd")
+    return ", ".join(encodings)
+
+
+def _http2_enabled() -> bool:
+    if not settings.KOMMO_HTTP2:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("KOMMO_HTTP2 is on but h2 is not installed (pip install 'httpx[http2]'), using HTTP/1.1")
+        return False
+    return True
+
+
+class KommoHttpClient(Client):
+    # Клиент Kommo с общим лимитом запросов и статистикой трафика по эндпоинтам;
+    # сводка пишется в лог при закрытии
+    def __init__(self, rate_limiter: RateLimiter | None = None, **kwargs):
+        self.rate_limiter = rate_limiter
+        self.transfer_stats = TransferStats()
+        super().__init__(
+            event_hooks={"request": [self._wait_for_rate_limit], "response": [self._record_transfer]},
+            **kwargs,
+        )
+
+    def _wait_for_rate_limit(self, request) -> None:
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+
+    def _record_transfer(self, response: Response) -> None:
+        # Хук вызывается до чтения тела; клиент не потоковый, так что тело всё равно читается сразу
+        response.read()
+        endpoint = response.request.url.path.removeprefix("/api/v4/")
+        self.transfer_stats.record(endpoint, response.num_bytes_downloaded, len(response.content))
+
+    def close(self) -> None:
+        if not self.is_closed and self.transfer_stats.endpoints:
+            logger.info(f"Kommo traffic ({self.base_url.host}):\n{self.transfer_stats.format()}")
+        super().close()
+
+
+def create_http_client(base_url: str) -> KommoHttpClient:
+    # Пул соединений рассчитан на параллельные стадии демона и предзагрузку страниц
+    return KommoHttpClient(
+        rate_limiter=RateLimiter(settings.KOMMO_RATE_LIMIT),
+        base_url=base_url,
+        http2=_http2_enabled(),
+        limits=Limits(
+            max_connections=settings.KOMMO_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.KOMMO_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.KOMMO_KEEPALIVE_EXPIRY,
+        ),
+        timeout=Timeout(settings.KOMMO_TIMEOUT, connect=settings.KOMMO_CONNECT_TIMEOUT),
+        headers={"Accept-Encoding": _accept_encoding()},
+    )
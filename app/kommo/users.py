@@ -1,54 +1,44 @@
 from dataclasses import dataclass
-from typing import Iterator
-
-from httpx import Client
+from datetime import datetime
+from functools import partial
+from typing import Callable, Iterator
 
 from app.entities import User
-from app.kommo.auth import TokenManager
+from app.kommo.base import PAGE_LIMIT, BaseManager
+from app.kommo.conditional import build_modified_since_key, format_if_modified_since
 from app.kommo.converters import convert_user_json_to_entity
+from app.sync_state import SyncState
 
 
 @dataclass
-class UserManager:
-    token_manager: TokenManager
-    http_client: Client
-
-    @property
-    def _headers(self) -> dict[str, str]:
-        oauth_token = self.token_manager.get_token()
-        return {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {oauth_token}",
-        }
-
-    def get_users(self, page: int, limit: int = 250) -> list[User]:
+class UserManager(BaseManager):
+    modified_since_state: SyncState | None = None
+
+    def get_users(
+        self,
+        page: int,
+        limit: int = PAGE_LIMIT,
+        modified_since: int | None = None,
+    ) -> list[User]:
         params = {"limit": limit, "page": page, "with": "roles,groups"}
 
-        response = self.http_client.get(
-            "api/v4/users",
-            params=params,
-            headers=self._headers,
-        )
-        response.raise_for_status()
-        
-        if response.status_code == 204:
-            return []
-            
-        if not response.content:
-            return []
-        
-        users = response.json()["_embedded"]["users"]
+        headers = self._headers
+        if modified_since:
+            headers["If-Modified-Since"] = format_if_modified_since(modified_since)
+
+        users = self._get_embedded("api/v4/users", "users", params, headers)
         return [convert_user_json_to_entity(user) for user in users]
 
-    def get_all_users(self) -> Iterator[User]:
-        page = 1
-        is_has_next_page = True
+    def get_all_users(self, sync_marks: list[Callable[[], None]] | None = None) -> Iterator[User]:
+        state_key = build_modified_since_key("api/v4/users", {"with": "roles,groups"})
+        started_at = int(datetime.now().timestamp())
+        modified_since = None
+        if self.modified_since_state:
+            modified_since = self.modified_since_state.get_last_sync(state_key)
 
-        while is_has_next_page:
-            users = self.get_users(page=page)
-            
-            if len(users) < 250:
-                is_has_next_page = False
+        yield from self._iter_items(lambda page: self.get_users(page=page, modified_since=modified_since))
 
-            yield from users
-            page += 1
+        # Время запроса запоминает стадия, вызвав отметку после записи в БД: если запись упадёт,
+        # следующий запуск с If-Modified-Since получит 204 и изменения будут потеряны
+        if self.modified_since_state and sync_marks is not None:
+            sync_marks.append(partial(self.modified_since_state.set_last_sync, state_key, started_at))
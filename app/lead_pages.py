@@ -0,0 +1,34 @@
+import json
+from dataclasses import astuple
+
+from app.db.repositories import convert_custom_field_value_to_row, convert_lead_entity_to_row
+from app.entities import EmbeddedRefs
+from app.kommo.converters import (
+    collect_embedded_refs,
+    convert_lead_json_to_entity,
+    convert_loss_reason_json_to_entity,
+)
+
+
+def convert_lead_page(content: bytes) -> tuple[list[tuple], list[tuple], EmbeddedRefs, list[tuple]]:
+    # Выполняется в дочернем процессе: на вход сырые байты ответа, на выход кортежи строк.
+    # Значения доп. полей - кортежи в порядке CUSTOM_FIELD_VALUE_COLUMNS, как их принимает replace_for_entities
+    leads_json = json.loads(content)["_embedded"]["leads"]
+
+    loss_reasons = {}
+    lead_rows = []
+    custom_field_values = []
+    refs = EmbeddedRefs()
+    for lead_json in leads_json:
+        collect_embedded_refs(lead_json, refs)
+        if lead_json.get("_embedded", {}).get("loss_reason"):
+            loss_reason_data = lead_json["_embedded"]["loss_reason"][0]
+            loss_reason_data["account_id"] = lead_json["account_id"]
+            loss_reason = convert_loss_reason_json_to_entity(loss_reason_data)
+            loss_reasons[loss_reason.id] = astuple(loss_reason)
+
+        lead = convert_lead_json_to_entity(lead_json)
+        lead_rows.append(convert_lead_entity_to_row(lead))
+        custom_field_values.extend(convert_custom_field_value_to_row(value) for value in lead.custom_field_values)
+
+    return lead_rows, list(loss_reasons.values()), refs, custom_field_values
@@ -0,0 +1,212 @@
+import hashlib
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Iterable
+
+from sqlalchemy import select
+
+from app.config import KommoAccount, settings
+from app.db.base import get_session
+from app.db.models import Company, Contact, Lead
+from app.export_filter import ExportFilter
+from app.kommo.account import AccountManager
+from app.kommo.auth import TokenManager
+from app.kommo.base import PAGE_LIMIT
+from app.kommo.companies import CompanyManager
+from app.kommo.contacts import ContactManager
+from app.kommo.leads import LeadManager
+from app.kommo.pipelines import PipelineManager
+from app.kommo.transport import create_http_client
+from app.kommo.users import UserManager
+from app.reference_cache import ReferenceCache
+from app.stages.common import process_in_batches
+from app.stages.companies import export_companies_by_ids
+from app.stages.contacts import export_contacts_by_ids
+from app.stages.leads import build_lead_fk_resolver, export_leads
+
+logger = logging.getLogger(__name__)
+
+# Сущности, которые Kommo отдаёт с updated_at и умеет выбирать по filter[id][]
+RECONCILE_STAGES = ("companies", "contacts", "leads")
+MODELS = {"companies": Company, "contacts": Contact, "leads": Lead}
+
+DIGEST_MODULUS = 2**64
+
+
+def row_digest(entity_id: int, updated_at: int | None) -> int:
+    digest = hashlib.blake2b(f"{entity_id}:{updated_at}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+@dataclass
+class RangeDigest:
+    # Сумма хешей строк по модулю 2^64 не зависит от порядка, в котором строки пришли
+    count: int = 0
+    digest: int = 0
+
+    def add(self, entity_id: int, updated_at: int | None) -> None:
+        self.count += 1
+        self.digest = (self.digest + row_digest(entity_id, updated_at)) % DIGEST_MODULUS
+
+
+def build_range_digests(versions: Iterable[tuple[int, int]], range_size: int) -> dict[int, RangeDigest]:
+    digests = {}
+    for entity_id, updated_at in versions:
+        digests.setdefault(entity_id // range_size, RangeDigest()).add(entity_id, updated_at)
+    return digests
+
+
+def load_db_range_digests(model, account_id: int, range_size: int) -> dict[int, RangeDigest]:
+    # Из БД читаются только id и updated_at потоком, сами строки в памяти не держатся
+    with get_session() as session:
+        rows = session.execute(
+            select(model.id, model.updated_at)
+            .where(model.account_id == account_id)
+            .execution_options(yield_per=10000)
+        )
+        return build_range_digests(rows, range_size)
+
+
+def load_db_versions(model, account_id: int, range_id: int, range_size: int) -> dict[int, int]:
+    with get_session() as session:
+        rows = session.execute(
+            select(model.id, model.updated_at).where(
+                model.account_id == account_id,
+                model.id.between(range_id * range_size, (range_id + 1) * range_size - 1),
+            )
+        )
+        return dict(rows.all())
+
+
+@dataclass
+class TableReconciliation:
+    table: str
+    ranges: int = 0
+    differing_ranges: int = 0
+    # Есть в Kommo, но в БД нет или там другой updated_at
+    changed_ids: list[int] = field(default_factory=list)
+    # Есть в БД, но нет в списке Kommo (удалённые или перенесённые)
+    stale: int = 0
+    repaired: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class ReconcileReport:
+    account: str
+    tables: dict[str, TableReconciliation] = field(default_factory=dict)
+
+    def format(self) -> str:
+        lines = [
+            f"Reconciliation of {self.account}:",
+            f"{'table':<14}{'ranges':>10}{'differ':>10}{'changed':>10}{'stale':>10}{'repaired':>10}",
+        ]
+        for result in self.tables.values():
+            lines.append(
+                f"{result.table:<14}{result.ranges:>10}{result.differing_ranges:>10}"
+                f"{len(result.changed_ids):>10}{result.stale:>10}{result.repaired:>10}"
+            )
+        total = sum(result.seconds for result in self.tables.values())
+        lines.append(f"Reconciliation took {total:.1f}s")
+        return "\n".join(lines)
+
+
+def reconcile_table(
+    table: str,
+    kommo_versions: Iterable[tuple[int, int]],
+    account_id: int,
+    range_size: int,
+) -> TableReconciliation:
+    # Сначала сравниваются хеши диапазонов id, и только в несовпавших диапазонах - строки.
+    # Цена сверки в БД пропорциональна расхождению, а не размеру таблицы
+    result = TableReconciliation(table)
+    started_at = time.monotonic()
+    model = MODELS[table]
+
+    # Сторона Kommo держится в памяти целиком (id и updated_at): диапазон id в API не отфильтровать
+    kommo_ranges: dict[int, dict[int, int]] = {}
+    kommo_digests: dict[int, RangeDigest] = {}
+    for entity_id, updated_at in kommo_versions:
+        range_id = entity_id // range_size
+        kommo_ranges.setdefault(range_id, {})[entity_id] = updated_at
+        kommo_digests.setdefault(range_id, RangeDigest()).add(entity_id, updated_at)
+    db_digests = load_db_range_digests(model, account_id, range_size)
+
+    range_ids = kommo_digests.keys() | db_digests.keys()
+    result.ranges = len(range_ids)
+    for range_id in sorted(range_ids):
+        if kommo_digests.get(range_id) == db_digests.get(range_id):
+            continue
+        result.differing_ranges += 1
+        kommo_range = kommo_ranges.get(range_id, {})
+        db_range = load_db_versions(model, account_id, range_id, range_size) if range_id in db_digests else {}
+        result.changed_ids.extend(
+            entity_id for entity_id, updated_at in kommo_range.items() if db_range.get(entity_id) != updated_at
+        )
+        result.stale += len(db_range.keys() - kommo_range.keys())
+
+    result.seconds += time.monotonic() - started_at
+    logger.info(
+        f"Reconciled {table}: {result.differing_ranges} of {result.ranges} id ranges differ, "
+        f"{len(result.changed_ids)} rows to refetch, {result.stale} stale"
+    )
+    return result
+
+
+def reconcile(account: KommoAccount, stages=RECONCILE_STAGES, repair: bool = False) -> ReconcileReport:
+    logger.info(f"Starting reconciliation of {account.name}")
+
+    http_client = create_http_client(account.base_url)
+    token_manager = TokenManager(http_client, account)
+    report = ReconcileReport(account.name)
+    range_size = settings.RECONCILE_RANGE_SIZE
+
+    company_manager = CompanyManager(token_manager, http_client)
+    contact_manager = ContactManager(token_manager, http_client)
+    lead_manager = LeadManager(token_manager, http_client)
+    versions = {
+        "companies": company_manager.get_company_versions,
+        "contacts": contact_manager.get_contact_versions,
+        "leads": lead_manager.get_lead_versions,
+    }
+
+    try:
+        account_id = AccountManager(token_manager, http_client).get_account_id()
+        for stage in RECONCILE_STAGES:
+            if stage not in stages:
+                continue
+            result = report.tables[stage] = reconcile_table(stage, versions[stage](), account_id, range_size)
+            if not repair or not result.changed_ids:
+                continue
+
+            # Перевыгружаются только расходящиеся строки, по id
+            started_at = time.monotonic()
+            if stage == "companies":
+                result.repaired = len(export_companies_by_ids(company_manager, set(result.changed_ids)))
+            elif stage == "contacts":
+                result.repaired = len(export_contacts_by_ids(contact_manager, set(result.changed_ids)))
+            else:
+                reference_cache = ReferenceCache(account.reference_fingerprints_path)
+                fk_resolver = build_lead_fk_resolver(
+                    UserManager(token_manager, http_client),
+                    PipelineManager(token_manager, http_client),
+                    contact_manager,
+                    company_manager,
+                    account_id,
+                    reference_cache,
+                )
+                for ids in process_in_batches(result.changed_ids, PAGE_LIMIT):
+                    leads = export_leads(
+                        lead_manager,
+                        reference_cache=reference_cache,
+                        fk_resolver=fk_resolver,
+                        export_filter=ExportFilter(ids=tuple(ids)),
+                    )
+                    result.repaired += leads if isinstance(leads, int) else len(leads)
+            result.seconds += time.monotonic() - started_at
+    finally:
+        http_client.close()
+
+    logger.info(report.format())
+    return report
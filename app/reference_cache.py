@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import threading
+from dataclasses import asdict, dataclass, field
+from typing import Callable
+
+from app.entities import LossReason, Pipeline, Status, User
+
+
+def compute_fingerprint(entities: list) -> str:
+    payload = sorted((asdict(entity) for entity in entities), key=lambda item: item["id"])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+@dataclass
+class ReferenceCache:
+    path: str
+    users: dict[int, User] = field(default_factory=dict)
+    pipelines: dict[int, Pipeline] = field(default_factory=dict)
+    statuses: dict[int, Status] = field(default_factory=dict)
+    loss_reasons: dict[int, LossReason] = field(default_factory=dict)
+    _fingerprints: dict[str, str] | None = field(default=None, init=False, repr=False)
+    _known_ids: dict[str, set[int]] = field(default_factory=dict, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def _load(self) -> dict[str, str]:
+        if self._fingerprints is None:
+            try:
+                with open(self.path, "r") as fingerprints_file:
+                    self._fingerprints = json.load(fingerprints_file)
+            except FileNotFoundError:
+                self._fingerprints = {}
+        return self._fingerprints
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w") as fingerprints_file:
+            json.dump(self._fingerprints, fingerprints_file)
+
+    def is_changed(self, key: str, fingerprint: str) -> bool:
+        with self._lock:
+            return self._load().get(key) != fingerprint
+
+    def remember(self, key: str, fingerprint: str) -> None:
+        # Отпечаток сохраняется только после успешной записи в БД
+        with self._lock:
+            self._load()[key] = fingerprint
+            self._save()
+
+    def known_ids(self, table: str, load_ids: Callable[[], set[int]]) -> set[int]:
+        # id справочника читаются из БД один раз за процесс, дальше множество пополняют стадии
+        # после записи: перезагрузка резолвера FK в каждом цикле демона обходится без запросов
+        with self._lock:
+            if table not in self._known_ids:
+                self._known_ids[table] = set(load_ids())
+            return set(self._known_ids[table])
+
+    def add_known_ids(self, table: str, entities: list) -> None:
+        # Ещё не загруженное множество прочитает записанные строки из БД само
+        with self._lock:
+            if table in self._known_ids:
+                self._known_ids[table].update(entity.id for entity in entities)
+
+    # Ответ с If-Modified-Since содержит только изменившиеся записи: они дополняют кэш, а не заменяют его
+    def update_users(self, users: list[User]) -> None:
+        self.users.update((user.id, user) for user in users)
+
+    def update_pipelines(self, pipelines: list[Pipeline]) -> None:
+        self.pipelines.update((pipeline.id, pipeline) for pipeline in pipelines)
+        self.statuses.update((status.id, status) for pipeline in pipelines for status in pipeline.statuses)
+
+    def get_changed_loss_reasons(self, loss_reasons: list[LossReason]) -> list[LossReason]:
+        changed = []
+        with self._lock:
+            fingerprints = self._load()
+            for loss_reason in loss_reasons:
+                if self.loss_reasons.get(loss_reason.id) == loss_reason:
+                    continue
+                if fingerprints.get(f"loss_reason:{loss_reason.id}") == compute_fingerprint([loss_reason]):
+                    self.loss_reasons[loss_reason.id] = loss_reason
+                    continue
+                changed.append(loss_reason)
+        return changed
+
+    def remember_loss_reasons(self, loss_reasons: list[LossReason]) -> None:
+        with self._lock:
+            fingerprints = self._load()
+            for loss_reason in loss_reasons:
+                self.loss_reasons[loss_reason.id] = loss_reason
+                fingerprints[f"loss_reason:{loss_reason.id}"] = compute_fingerprint([loss_reason])
+            self._save()
@@ -0,0 +1,418 @@
+import gzip
+import json
+import logging
+import mmap
+import os
+import time
+from dataclasses import asdict, is_dataclass
+from typing import Any, Iterable, Iterator
+
+from app.config import KommoAccount, settings
+from app.entities import Company, Contact, CustomFieldValue, Event, Pipeline, Status, Task, User
+from app.export_filter import EXPORT_STAGES, ExportFilter
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".ndjson.gz"
+OPEN_SUFFIX = ".open"
+# Сколько строк уходит в один gzip-член сегмента
+APPEND_BATCH_SIZE = 1000
+
+
+def get_spool_dir(account: KommoAccount) -> str:
+    return os.path.join(settings.SPOOL_DIR, account.name)
+
+
+def _from_dict(entity_class):
+    return lambda data: entity_class(**data)
+
+
+def _with_custom_fields_from_dict(entity_class):
+    def decode(data: dict):
+        values = [CustomFieldValue(**value) for value in data.pop("custom_field_values", [])]
+        return entity_class(**data, custom_field_values=values)
+
+    return decode
+
+
+def _pipeline_from_dict(data: dict) -> Pipeline:
+    return Pipeline(**{**data, "statuses": [Status(**status) for status in data["statuses"]]})
+
+
+# Как восстановить сущность из строки спула; сделки хранятся сырым JSON Kommo
+DECODERS = {
+    "users": _from_dict(User),
+    "pipelines": _pipeline_from_dict,
+    "companies": _with_custom_fields_from_dict(Company),
+    "contacts": _with_custom_fields_from_dict(Contact),
+    "leads": lambda data: data,
+    "tasks": _from_dict(Task),
+    "events": _from_dict(Event),
+}
+
+
+def _encode(item: Any) -> bytes:
+    data = asdict(item) if is_dataclass(item) else item
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def _segment_rows(name: str) -> int:
+    # Имя запечатанного сегмента: <номер>-<строк>.ndjson.gz
+    return int(name.removesuffix(SEGMENT_SUFFIX).split("-")[1])
+
+
+class Spool:
+    # Каталог спула аккаунта: <стадия>/<номер>-<строк>.ndjson.gz, offsets.json с числом
+    # загруженных в БД строк каждого сегмента и loaded_at.json со временем, когда сегмент
+    # загружен целиком. Пишется только открытый сегмент (*.open), читаются только запечатанные
+    def __init__(self, path: str, segment_rows: int | None = None):
+        self.path = path
+        self.segment_rows = segment_rows or settings.SPOOL_SEGMENT_ROWS
+        self._open_segments: dict[str, tuple[str, int]] = {}
+        self._read_offsets: dict[str, int] = {}
+        self.offsets = self._load_json("offsets.json", {})
+        self.loaded_at = self._load_json("loaded_at.json", {})
+
+    def _load_json(self, name: str, default):
+        try:
+            with open(os.path.join(self.path, name)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+
+    def _save_json(self, name: str, data) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, name)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @property
+    def account_id(self) -> int | None:
+        return self._load_json("meta.json", {}).get("account_id")
+
+    def set_account_id(self, account_id: int) -> None:
+        self._save_json("meta.json", {"account_id": account_id})
+
+    def _stage_dir(self, stage: str) -> str:
+        return os.path.join(self.path, stage)
+
+    def _next_number(self, stage: str) -> int:
+        names = os.listdir(self._stage_dir(stage))
+        return max((int(name.split("-")[0].split(".")[0]) for name in names), default=0) + 1
+
+    def open(self) -> None:
+        # Открытый сегмент от прерванной выгрузки мог оборваться посреди gzip-члена, его не загружаем
+        for stage in EXPORT_STAGES:
+            stage_dir = self._stage_dir(stage)
+            os.makedirs(stage_dir, exist_ok=True)
+            for name in os.listdir(stage_dir):
+                if name.endswith(OPEN_SUFFIX):
+                    logger.warning(f"Discarding unfinished spool segment {stage}/{name}")
+                    os.remove(os.path.join(stage_dir, name))
+
+    def append(self, stage: str, items: list) -> None:
+        if stage not in self._open_segments:
+            path = os.path.join(self._stage_dir(stage), f"{self._next_number(stage):08d}{OPEN_SUFFIX}")
+            self._open_segments[stage] = (path, 0)
+        path, rows = self._open_segments[stage]
+
+        # Каждая пачка - отдельный gzip-член: дописывание не требует перепаковки файла
+        with open(path, "ab") as segment:
+            segment.write(gzip.compress(b"".join(_encode(item) for item in items), compresslevel=6))
+        rows += len(items)
+        self._open_segments[stage] = (path, rows)
+
+        if rows >= self.segment_rows:
+            self.seal(stage)
+
+    def append_all(self, stage: str, items: Iterable) -> int:
+        count = 0
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= APPEND_BATCH_SIZE:
+                self.append(stage, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            self.append(stage, batch)
+            count += len(batch)
+        self.seal(stage)
+        return count
+
+    def seal(self, stage: str) -> None:
+        if stage not in self._open_segments:
+            return
+        path, rows = self._open_segments.pop(stage)
+        number = os.path.basename(path).removesuffix(OPEN_SUFFIX)
+        os.replace(path, os.path.join(self._stage_dir(stage), f"{number}-{rows}{SEGMENT_SUFFIX}"))
+
+    def close(self) -> None:
+        for stage in list(self._open_segments):
+            self.seal(stage)
+
+    def segments(self, stage: str) -> list[str]:
+        stage_dir = self._stage_dir(stage)
+        if not os.path.isdir(stage_dir):
+            return []
+        return sorted(name for name in os.listdir(stage_dir) if name.endswith(SEGMENT_SUFFIX))
+
+    def pending_segments(self, stage: str) -> list[str]:
+        return [
+            name
+            for name in self.segments(stage)
+            if self.offsets.get(f"{stage}/{name}", 0) < _segment_rows(name)
+        ]
+
+    def read(self, stage: str) -> Iterator[Any]:
+        # Сегменты читаются через mmap: страницы файла подгружает ОС, копия в куче не нужна.
+        # Уже загруженные строки пропускаются, прочитанные фиксирует commit() после записи в БД
+        decode = DECODERS[stage]
+        for name in self.pending_segments(stage):
+            key = f"{stage}/{name}"
+            committed = self.offsets.get(key, 0)
+            with open(os.path.join(self._stage_dir(stage), name), "rb") as segment_file:
+                with mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    with gzip.GzipFile(fileobj=mapped) as lines:
+                        for number, line in enumerate(lines, 1):
+                            if number > committed:
+                                self._read_offsets[key] = number
+                                yield decode(json.loads(line))
+
+    def commit(self, stage: str) -> None:
+        prefix = f"{stage}/"
+        now = time.time()
+        for key in [key for key in self._read_offsets if key.startswith(prefix)]:
+            self.offsets[key] = self._read_offsets.pop(key)
+            if self.offsets[key] >= _segment_rows(key.removeprefix(prefix)):
+                self.loaded_at.setdefault(key, now)
+        self._save_json("offsets.json", self.offsets)
+        self._save_json("loaded_at.json", self.loaded_at)
+
+    def reset(self) -> None:
+        # Повторная загрузка всего спула: upsert идемпотентен, строки просто перезапишутся
+        self.offsets = {}
+        self.loaded_at = {}
+        self._read_offsets = {}
+        self._save_json("offsets.json", self.offsets)
+        self._save_json("loaded_at.json", self.loaded_at)
+
+    def remove_loaded(self, retention_days: int) -> int:
+        # Загруженные сегменты хранятся retention_days дней с момента загрузки, а не запечатывания:
+        # сегмент, пролежавший в спуле дольше срока, всё равно доступен для повторной загрузки
+        now = time.time()
+        expire_before = now - retention_days * 86400
+        removed = 0
+        for stage in EXPORT_STAGES:
+            pending = set(self.pending_segments(stage))
+            for name in self.segments(stage):
+                key = f"{stage}/{name}"
+                if name in pending:
+                    continue
+                # Спул без loaded_at.json (загружен до его появления) отсчитывает срок с этой проверки
+                if self.loaded_at.setdefault(key, now) < expire_before:
+                    os.remove(os.path.join(self._stage_dir(stage), name))
+                    self.offsets.pop(key, None)
+                    self.loaded_at.pop(key, None)
+                    removed += 1
+        self._save_json("offsets.json", self.offsets)
+        self._save_json("loaded_at.json", self.loaded_at)
+        return removed
+
+
+class SpoolReader:
+    # Подменяет менеджеры Kommo при загрузке: export_* читают сущности из спула,
+    # фильтры выгрузки уже применены при записи в спул
+    def __init__(self, spool: Spool):
+        self.spool = spool
+
+    def get_all_users(self, **_) -> Iterator[User]:
+        return self.spool.read("users")
+
+    def get_all_pipelines(self, **_) -> Iterator[Pipeline]:
+        return self.spool.read("pipelines")
+
+    def get_all_companies(self, **_) -> Iterator[Company]:
+        return self.spool.read("companies")
+
+    def get_all_contacts(self, **_) -> Iterator[Contact]:
+        return self.spool.read("contacts")
+
+    def get_all_leads(self, **_) -> Iterator[dict]:
+        return self.spool.read("leads")
+
+    get_all_leads_sharded = get_all_leads
+
+    def get_all_lead_pages(self, **_) -> Iterator[bytes]:
+        # Пул конвертации сделок принимает сырые страницы: собираем их из строк спула
+        from app.stages.common import iter_in_batches
+        from app.kommo.base import PAGE_LIMIT
+
+        for leads in iter_in_batches(self.spool.read("leads"), PAGE_LIMIT):
+            yield json.dumps({"_embedded": {"leads": leads}}).encode("utf-8")
+
+    def get_all_tasks(self, **_) -> Iterator[Task]:
+        return self.spool.read("tasks")
+
+    def get_all_lead_events(self, *_, **__) -> Iterator[Event]:
+        return self.spool.read("events")
+
+    get_all_lead_events_sharded = get_all_lead_events
+
+    def get_companies_by_ids(self, ids) -> list[Company]:
+        # Всё, что есть в спуле, загружается своими стадиями; догружать резолверу FK нечего
+        return []
+
+    def get_contacts_by_ids(self, ids) -> list[Contact]:
+        return []
+
+
+def fetch_to_spool(account: KommoAccount, export_filter: ExportFilter | None = None):
+    from app.stages.common import get_modified_since_state, mark_synced, process_in_batches
+    from app.stages.events import build_event_manager
+    from app.stages.leads import load_deferred_lead_ids
+    from app.kommo.account import AccountManager
+    from app.kommo.auth import TokenManager
+    from app.kommo.base import PAGE_LIMIT
+    from app.kommo.companies import CompanyManager
+    from app.kommo.contacts import ContactManager
+    from app.kommo.leads import LeadManager
+    from app.kommo.pipelines import PipelineManager
+    from app.kommo.tasks import TaskManager
+    from app.kommo.transport import create_http_client
+    from app.kommo.users import UserManager
+
+    # Выгрузка без БД: страницы Kommo дописываются в сегменты спула, в базу их переносит load_spool
+    export_filter = export_filter or ExportFilter()
+    since, until, ids = export_filter.since, export_filter.until, list(export_filter.ids)
+    pipeline_ids = list(export_filter.pipeline_ids)
+
+    http_client = create_http_client(account.base_url)
+    token_manager = TokenManager(http_client, account)
+    modified_since_state = get_modified_since_state(account)
+    spool = Spool(get_spool_dir(account))
+    spool.open()
+
+    def fetch_leads():
+        lead_manager = LeadManager(token_manager, http_client)
+        # Те же условия окон по created_at, что и в export_leads
+        if "leads" in settings.SHARDED_FETCH and not since and not until and not ids:
+            yield from lead_manager.get_all_leads_sharded(pipeline_ids=pipeline_ids)
+        else:
+            yield from lead_manager.get_all_leads(
+                updated_from=since, updated_to=until, ids=ids, pipeline_ids=pipeline_ids
+            )
+        # Сделки, отложенные прошлой загрузкой спула, выгружаются заново вместе с остальными
+        for deferred_ids in process_in_batches(load_deferred_lead_ids(account.deferred_leads_path), PAGE_LIMIT):
+            yield from lead_manager.get_all_leads(ids=deferred_ids)
+
+    def fetch_events():
+        event_manager = build_event_manager(token_manager, http_client)
+        if "events" in settings.SHARDED_FETCH and not ids:
+            return event_manager.get_all_lead_events_sharded(since, until)
+        return event_manager.get_all_lead_events(created_from=since, created_to=until, lead_ids=ids)
+
+    # Для спула запись - это запечатанный сегмент: отметки If-Modified-Since ставятся после append_all
+    sync_marks = []
+    sources = {
+        "users": lambda: UserManager(token_manager, http_client, modified_since_state).get_all_users(sync_marks),
+        "pipelines": lambda: PipelineManager(token_manager, http_client, modified_since_state).get_all_pipelines(
+            sync_marks
+        ),
+        "companies": lambda: CompanyManager(token_manager, http_client, modified_since_state).get_all_companies(
+            updated_from=since, updated_to=until, ids=ids, sync_marks=sync_marks
+        ),
+        "contacts": lambda: ContactManager(token_manager, http_client).get_all_contacts(
+            updated_from=since, updated_to=until, ids=ids
+        ),
+        "leads": fetch_leads,
+        "tasks": lambda: TaskManager(token_manager, http_client).get_all_tasks(
+            updated_from=since, updated_to=until, lead_ids=ids
+        ),
+        "events": fetch_events,
+    }
+
+    try:
+        spool.set_account_id(AccountManager(token_manager, http_client).get_account_id())
+        for stage in EXPORT_STAGES:
+            if export_filter.includes(stage):
+                count = spool.append_all(stage, sources[stage]())
+                mark_synced(sync_marks)
+                sync_marks.clear()
+                logger.info(f"Spooled {count} {stage} of {account.name}")
+    finally:
+        spool.close()
+        http_client.close()
+
+
+def load_spool(account: KommoAccount, replay: bool = False):
+    from app.db.base import session_maker
+    from app.db.parquet_sink import open_parquet_sink
+    from app.db.repositories import ContactRepository, LeadRepository
+    from app.reference_cache import ReferenceCache
+    from app.stages.common import load_known_ids
+    from app.stages.companies import export_companies
+    from app.stages.contacts import export_contacts
+    from app.stages.events import export_events
+    from app.stages.leads import build_lead_fk_resolver, export_leads, remember_deferred_leads
+    from app.stages.pipelines import export_pipelines
+    from app.stages.tasks import export_tasks
+    from app.stages.users import export_users
+
+    spool = Spool(get_spool_dir(account))
+    if replay:
+        spool.reset()
+    account_id = spool.account_id
+    if account_id is None:
+        logger.info(f"Spool of {account.name} is empty, nothing to load")
+        return
+
+    # Те же стадии, что и при прямой выгрузке, только менеджеры читают из спула.
+    # Смещения фиксируются после каждой стадии: упавшая загрузка продолжится с незагруженных строк
+    reader = SpoolReader(spool)
+    reference_cache = ReferenceCache(account.reference_fingerprints_path)
+    parquet_sink = open_parquet_sink(session_maker)
+    fk_resolver = build_lead_fk_resolver(reader, reader, reader, reader, account_id, reference_cache)
+    stages = {
+        "users": lambda: export_users(reader, account_id, reference_cache),
+        "pipelines": lambda: export_pipelines(reader, reference_cache),
+        "companies": lambda: export_companies(reader),
+        "contacts": lambda: export_contacts(reader),
+        "leads": lambda: export_leads(
+            reader,
+            reference_cache=reference_cache,
+            fk_resolver=fk_resolver,
+        ),
+        "tasks": lambda: export_tasks(
+            reader,
+            load_known_ids(LeadRepository, account_id),
+            load_known_ids(ContactRepository, account_id),
+        ),
+        "events": lambda: export_events(
+            reader,
+            load_known_ids(LeadRepository, account_id),
+            load_known_ids(ContactRepository, account_id),
+        ),
+    }
+
+    try:
+        for stage in EXPORT_STAGES:
+            segments = spool.pending_segments(stage)
+            if not segments:
+                continue
+            logger.info(f"Loading {len(segments)} spool segments of {stage} for {account.name}")
+            stages[stage]()
+            if stage == "leads":
+                # Отложенные сделки в БД не попали: их id сохраняются, и следующий fetch_to_spool
+                # выгрузит их заново, а сегменты сделок закрываются как обычно
+                remember_deferred_leads(account.deferred_leads_path, fk_resolver, account_id)
+            spool.commit(stage)
+
+        removed = spool.remove_loaded(settings.SPOOL_RETENTION_DAYS)
+        if removed:
+            logger.info(f"Removed {removed} loaded spool segments of {account.name}")
+    finally:
+        if parquet_sink:
+            parquet_sink.close()
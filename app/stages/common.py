@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable
+
+from app.config import KommoAccount, settings
+from app.db.base import get_engine, get_session
+from app.db.repositories import CustomFieldValueRepository
+from app.sync_state import SyncState
+
+if TYPE_CHECKING:
+    from app.fk_resolver import ForeignKeyResolver
+
+
+def process_in_batches(items, batch_size=100):
+    for i in range(0, len(items), batch_size):
+        yield items[i : i + batch_size]
+
+
+def iter_in_batches(items, batch_size=100):
+    # Как process_in_batches, но для генераторов: не держит весь поток в памяти
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_partitioned(
+    items: list,
+    write_batch: Callable[[list], None],
+    batch_size: int = 100,
+    get_id: Callable = lambda item: item.id,
+):
+    # DB_WRITERS потоков, у каждого своя сессия и соединение. Строка попадает в поток по id % N,
+    # так что одну строку никогда не пишут параллельно, а внутри потока сохраняется исходный порядок
+    writers = settings.DB_WRITERS
+    if writers <= 1 or len(items) <= batch_size:
+        for batch in process_in_batches(items, batch_size):
+            write_batch(batch)
+        return
+
+    # Engine создаётся до запуска потоков, чтобы они не создали по своему
+    get_engine()
+    partitions = [[] for _ in range(writers)]
+    for item in items:
+        partitions[hash(get_id(item)) % writers].append(item)
+
+    def write_partition(partition: list):
+        for batch in process_in_batches(partition, batch_size):
+            write_batch(batch)
+
+    with ThreadPoolExecutor(max_workers=writers) as executor:
+        for future in [executor.submit(write_partition, partition) for partition in partitions if partition]:
+            future.result()
+
+
+def save_custom_field_values(session, entity_type: str, entity_ids, values: list):
+    if not settings.STORE_CUSTOM_FIELD_VALUES:
+        return
+    CustomFieldValueRepository(session).replace_for_entities(entity_type, entity_ids, values)
+
+
+def save_all(repository_class, entities: list, batch_size: int = 100, custom_fields_type: str | None = None):
+    # custom_fields_type - тип сущности в custom_field_values, если у сущностей есть доп. поля
+    def save_batch(batch):
+        with get_session() as session:
+            repository_class(session).save_or_update_all(batch)
+            if custom_fields_type:
+                save_custom_field_values(
+                    session,
+                    custom_fields_type,
+                    [entity.id for entity in batch],
+                    [value for entity in batch for value in entity.custom_field_values],
+                )
+
+    write_partitioned(entities, save_batch, batch_size)
+
+
+def load_known_ids(repository_class, account_id: int | None = None) -> set[int]:
+    with get_session() as session:
+        return repository_class(session).get_all_ids(account_id)
+
+
+def get_modified_since_state(account: KommoAccount) -> SyncState | None:
+    if not settings.CONDITIONAL_REQUESTS:
+        return None
+    return SyncState(account.modified_since_path)
+
+
+def mark_synced(sync_marks: list) -> None:
+    # Отметки If-Modified-Since от менеджеров Kommo вызываются только после записи в БД
+    for mark in sync_marks:
+        mark()
+
+
+def register_known(fk_resolver: ForeignKeyResolver | None, table: str, entities: list) -> None:
+    # Резолвер живёт дольше одной стадии: записанных родителей он должен увидеть без перечитывания БД
+    if fk_resolver and entities:
+        fk_resolver.add_known(table, {entity.id for entity in entities})
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+
+from app.db.repositories import CompanyRepository
+from app.export_filter import ExportFilter
+from app.stages.common import mark_synced, register_known, save_all
+
+if TYPE_CHECKING:
+    from app.fk_resolver import ForeignKeyResolver
+    from app.kommo.companies import CompanyManager
+
+logger = logging.getLogger(__name__)
+
+
+def export_companies(
+    company_manager: CompanyManager,
+    updated_from: int | None = None,
+    export_filter: ExportFilter | None = None,
+    fk_resolver: ForeignKeyResolver | None = None,
+):
+    export_filter = export_filter or ExportFilter()
+    sync_marks = []
+    companies = list(
+        company_manager.get_all_companies(
+            updated_from=updated_from,
+            updated_to=export_filter.until,
+            ids=list(export_filter.ids),
+            sync_marks=sync_marks,
+        )
+    )
+    if not companies:
+        logger.info("Companies not modified since last sync, skipping")
+        mark_synced(sync_marks)
+        return companies
+
+    logger.info(f"Got {len(companies)} companies from CRM")
+
+    save_all(CompanyRepository, companies, custom_fields_type="companies")
+    register_known(fk_resolver, "companies", companies)
+    mark_synced(sync_marks)
+
+    logger.info(f"Exported {len(companies)} companies")
+    return companies
+
+
+def export_companies_by_ids(company_manager: CompanyManager, ids: set[int]):
+    companies = list(company_manager.get_companies_by_ids(ids))
+    save_all(CompanyRepository, companies, custom_fields_type="companies")
+    return companies
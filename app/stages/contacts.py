@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+
+from app.db.repositories import ContactRepository
+from app.export_filter import ExportFilter
+from app.stages.common import register_known, save_all
+
+if TYPE_CHECKING:
+    from app.fk_resolver import ForeignKeyResolver
+    from app.kommo.contacts import ContactManager
+
+logger = logging.getLogger(__name__)
+
+
+def export_contacts(
+    contact_manager: ContactManager,
+    updated_from: int | None = None,
+    export_filter: ExportFilter | None = None,
+    fk_resolver: ForeignKeyResolver | None = None,
+):
+    export_filter = export_filter or ExportFilter()
+    contacts = list(
+        contact_manager.get_all_contacts(
+            updated_from=updated_from,
+            updated_to=export_filter.until,
+            ids=list(export_filter.ids),
+        )
+    )
+    logger.info(f"Got {len(contacts)} contacts from CRM")
+
+    save_all(ContactRepository, contacts, custom_fields_type="contacts")
+    register_known(fk_resolver, "contacts", contacts)
+
+    logger.info(f"Exported {len(contacts)} contacts")
+    return contacts
+
+
+def export_contacts_by_ids(contact_manager: ContactManager, ids: set[int]):
+    contacts = list(contact_manager.get_contacts_by_ids(ids))
+    save_all(ContactRepository, contacts, custom_fields_type="contacts")
+    return contacts
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+
+from app.config import settings
+from app.db.base import get_session
+from app.db.partitions import ensure_month_partitions
+from app.db.repositories import EventRepository
+from app.db.types import is_valid_event_id
+from app.export_filter import ExportFilter
+from app.stages.common import save_all
+
+if TYPE_CHECKING:
+    from httpx import Client
+
+    from app.kommo.auth import TokenManager
+    from app.kommo.events import EventManager
+
+logger = logging.getLogger(__name__)
+
+
+def build_event_manager(token_manager: TokenManager, http_client: Client) -> EventManager:
+    from app.kommo.events import EventManager
+
+    return EventManager(
+        token_manager,
+        http_client,
+        types=settings.EVENT_TYPES,
+        entities=settings.EVENT_ENTITIES,
+        type_streams=settings.EVENT_TYPE_STREAMS,
+    )
+
+
+def clear_missing_event_refs(event, lead_ids: set[int], contact_ids: set[int]):
+    if event.entity_type == 'leads' and event.entity_id not in lead_ids:
+        event.entity_id = None
+    elif event.entity_type == 'contacts' and event.entity_id not in contact_ids:
+        event.entity_id = None
+    return event
+
+
+def export_events(
+    event_manager: EventManager,
+    lead_ids: set[int],
+    contact_ids: set[int],
+    created_from: int | None = None,
+    export_filter: ExportFilter | None = None,
+):
+    # Получаем события для лидов
+    export_filter = export_filter or ExportFilter()
+    if "events" in settings.SHARDED_FETCH and not export_filter.ids:
+        events = list(event_manager.get_all_lead_events_sharded(created_from, export_filter.until))
+    else:
+        events = list(
+            event_manager.get_all_lead_events(
+                created_from=created_from,
+                created_to=export_filter.until,
+                lead_ids=list(export_filter.ids),
+            )
+        )
+
+    # id событий хранятся в BINARY(16) и должны быть ULID: прочие без потерь не записать
+    invalid_ids = [event.id for event in events if not is_valid_event_id(event.id)]
+    if invalid_ids:
+        logger.warning(f"Skipping {len(invalid_ids)} events with non-ULID ids, e.g. {invalid_ids[0]!r}")
+        events = [event for event in events if is_valid_event_id(event.id)]
+
+    # Фильтруем и корректируем события
+    filtered_events = [clear_missing_event_refs(event, lead_ids, contact_ids) for event in events]
+
+    # Партиции на ближайшие месяцы должны существовать до вставки
+    with get_session() as session:
+        ensure_month_partitions(session.connection(), "events", settings.EVENT_PARTITIONS_AHEAD)
+
+    # Сохраняем события батчами
+    save_all(EventRepository, filtered_events, batch_size=50)
+
+    logger.info(f"Exported total {len(filtered_events)} events")
+    return filtered_events
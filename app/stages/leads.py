@@ -0,0 +1,464 @@
+from __future__ import annotations
+
+import json
+import logging
+import multiprocessing
+import os
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import replace
+from typing import TYPE_CHECKING, Callable
+
+from app.config import settings
+from app.db.base import get_session
+from app.db.repositories import (
+    CUSTOM_FIELD_VALUE_COLUMNS,
+    LEAD_COLUMNS,
+    CompanyRepository,
+    ContactRepository,
+    LeadRepository,
+    LossReasonRepository,
+    PipelineRepository,
+    StatusRepository,
+    UserRepository,
+)
+from app.entities import EmbeddedRefs, LossReason as LossReasonEntity
+from app.export_filter import ExportFilter
+from app.fk_resolver import LEAD_FOREIGN_KEYS, LEAD_NULLABLE_FOREIGN_KEYS, ForeignKeyResolver
+from app.kommo.base import PAGE_LIMIT
+from app.kommo.converters import (
+    collect_embedded_refs,
+    convert_lead_json_to_entity,
+    convert_loss_reason_json_to_entity,
+)
+from app.lead_pages import convert_lead_page
+from app.reference_cache import ReferenceCache
+from app.stages.common import (
+    load_known_ids,
+    process_in_batches,
+    register_known,
+    save_custom_field_values,
+    write_partitioned,
+)
+from app.stages.companies import export_companies_by_ids
+from app.stages.contacts import export_contacts_by_ids
+from app.stages.pipelines import export_pipelines
+from app.stages.users import export_users
+
+if TYPE_CHECKING:
+    from app.kommo.companies import CompanyManager
+    from app.kommo.contacts import ContactManager
+    from app.kommo.leads import LeadManager
+    from app.kommo.pipelines import PipelineManager
+    from app.kommo.users import UserManager
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_TABLES = ("users", "pipelines", "statuses", "loss_reasons")
+
+
+def export_lead_neighbours(
+    contact_manager: ContactManager,
+    company_manager: CompanyManager,
+    refs: EmbeddedRefs,
+    fk_resolver: ForeignKeyResolver | None = None,
+):
+    # Инкрементальный режим: вместо полного обхода тянем только связанные со сделками id
+    companies = export_companies_by_ids(company_manager, refs.company_ids)
+    contacts = export_contacts_by_ids(contact_manager, refs.contact_ids)
+
+    register_known(fk_resolver, "companies", companies)
+    register_known(fk_resolver, "contacts", contacts)
+
+    logger.info(
+        f"Exported {len(companies)} companies and {len(contacts)} contacts "
+        f"referenced by leads ({len(refs.tags)} tags seen)"
+    )
+
+
+def build_lead_fk_resolver(
+    user_manager: UserManager,
+    pipeline_manager: PipelineManager,
+    contact_manager: ContactManager,
+    company_manager: CompanyManager,
+    account_id: int | None = None,
+    reference_cache: ReferenceCache | None = None,
+) -> ForeignKeyResolver:
+    repositories = {
+        "users": UserRepository,
+        "statuses": StatusRepository,
+        "pipelines": PipelineRepository,
+        "loss_reasons": LossReasonRepository,
+        "companies": CompanyRepository,
+        "contacts": ContactRepository,
+    }
+
+    def fetch_users(ids):
+        users = export_users(user_manager, account_id, reference_cache)
+        return {"users": {user.id for user in users}}
+
+    def fetch_pipelines(ids):
+        pipelines = export_pipelines(pipeline_manager, reference_cache)
+        return {
+            "pipelines": {pipeline.id for pipeline in pipelines},
+            "statuses": {status.id for pipeline in pipelines for status in pipeline.statuses},
+        }
+
+    def fetch_companies(ids):
+        return {"companies": {company.id for company in export_companies_by_ids(company_manager, ids)}}
+
+    def fetch_contacts(ids):
+        return {"contacts": {contact.id for contact in export_contacts_by_ids(contact_manager, ids)}}
+
+    def load_ids(table):
+        # Справочники резолвер берёт из кэша в памяти, компании и контакты - из БД
+        if reference_cache and table in REFERENCE_TABLES:
+            return reference_cache.known_ids(table, lambda: load_known_ids(repositories[table]))
+        return load_known_ids(repositories[table])
+
+    return ForeignKeyResolver(
+        foreign_keys=LEAD_FOREIGN_KEYS,
+        nullable=LEAD_NULLABLE_FOREIGN_KEYS,
+        policies=settings.LEAD_FK_POLICIES,
+        load_ids=load_ids,
+        fetchers={
+            "users": fetch_users,
+            "statuses": fetch_pipelines,
+            "pipelines": fetch_pipelines,
+            "companies": fetch_companies,
+            "contacts": fetch_contacts,
+        },
+        # Пул процессов отдаёт сделки кортежами в порядке LEAD_COLUMNS, остальные пути - сущностями
+        columns=LEAD_COLUMNS,
+    )
+
+
+def export_loss_reasons(
+    loss_reasons: list[LossReasonEntity],
+    reference_cache: ReferenceCache | None = None,
+    fk_resolver: ForeignKeyResolver | None = None,
+):
+    # Причины отказа повторяются в каждой сделке, пишем только новые или изменившиеся
+    changed = reference_cache.get_changed_loss_reasons(loss_reasons) if reference_cache else loss_reasons
+
+    if changed:
+        with get_session() as session:
+            loss_reason_repo = LossReasonRepository(session)
+            loss_reason_repo.save_or_update_all(changed)
+
+        if reference_cache:
+            reference_cache.remember_loss_reasons(changed)
+
+        logger.info(f"Exported {len(changed)} loss reasons")
+
+    # Неизменившиеся причины кэш пропускает, потому что они уже записаны ранее
+    register_known(fk_resolver, "loss_reasons", loss_reasons)
+    if reference_cache:
+        reference_cache.add_known_ids("loss_reasons", loss_reasons)
+
+
+def save_flushed_leads(fk_resolver: ForeignKeyResolver) -> None:
+    # В очереди резолвера могут лежать и кортежи из пула процессов, и сущности из прошлых запусков
+    ready = fk_resolver.flush_deferred()
+    rows = [item for item in ready if isinstance(item, tuple)]
+    leads = [item for item in ready if not isinstance(item, tuple)]
+    for batch in process_in_batches(rows):
+        with get_session() as session:
+            LeadRepository(session).save_or_update_rows(batch)
+    for batch in process_in_batches(leads):
+        with get_session() as session:
+            LeadRepository(session).save_or_update_all(batch)
+
+
+def export_leads(
+    lead_manager: LeadManager,
+    updated_from: int | None = None,
+    on_refs: Callable[[EmbeddedRefs], None] | None = None,
+    reference_cache: ReferenceCache | None = None,
+    fk_resolver: ForeignKeyResolver | None = None,
+    export_filter: ExportFilter | None = None,
+):
+    export_filter = export_filter or ExportFilter()
+    # Окна по created_at имеют смысл только для полной выгрузки: инкремент и так короткий
+    is_sharded = (
+        "leads" in settings.SHARDED_FETCH
+        and not updated_from
+        and not export_filter.until
+        and not export_filter.ids
+    )
+
+    # Шарды отдают сделки вперемешку из разных окон, поэтому пул конвертации сырых страниц с ними не используется
+    if settings.CONVERT_WORKERS > 0 and not is_sharded:
+        return export_leads_with_process_pool(
+            lead_manager,
+            updated_from,
+            on_refs,
+            reference_cache,
+            fk_resolver,
+            export_filter,
+        )
+
+    if is_sharded:
+        leads_json = list(lead_manager.get_all_leads_sharded(pipeline_ids=list(export_filter.pipeline_ids)))
+    else:
+        leads_json = list(
+            lead_manager.get_all_leads(
+                updated_from=updated_from,
+                updated_to=export_filter.until,
+                ids=list(export_filter.ids),
+                pipeline_ids=list(export_filter.pipeline_ids),
+            )
+        )
+    logger.info(f"Got {len(leads_json)} leads from CRM")
+
+    refs = EmbeddedRefs()
+    for lead_json in leads_json:
+        collect_embedded_refs(lead_json, refs)
+
+    # Связанные контакты и компании должны попасть в БД раньше сделок (FK)
+    if on_refs:
+        on_refs(refs)
+
+    # Собираем все loss_reasons из leads
+    loss_reasons = {}
+    for lead_json in leads_json:
+        if lead_json.get("_embedded", {}).get("loss_reason"):
+            loss_reason_data = lead_json["_embedded"]["loss_reason"][0]
+            # Добавляем account_id из родительской сделки
+            loss_reason_data["account_id"] = lead_json["account_id"]
+            loss_reason = convert_loss_reason_json_to_entity(loss_reason_data)
+            loss_reasons[loss_reason.id] = loss_reason
+
+    logger.info(f"Found {len(loss_reasons)} unique loss reasons in leads")
+
+    # Сначала сохраняем loss_reasons
+    export_loss_reasons(list(loss_reasons.values()), reference_cache, fk_resolver)
+
+    # Конвертируем и сохраняем leads
+    leads = [convert_lead_json_to_entity(lead_json) for lead_json in leads_json]
+
+    def save_leads(batch):
+        # Доп. поля пишутся по всему батчу: у custom_field_values нет FK, отложенные сделки не ждут
+        lead_ids = [lead.id for lead in batch]
+        values = [value for lead in batch for value in lead.custom_field_values]
+        if fk_resolver:
+            batch = fk_resolver.resolve(batch)
+        with get_session() as session:
+            LeadRepository(session).save_or_update_all(batch)
+            save_custom_field_values(session, "leads", lead_ids, values)
+
+    write_partitioned(leads, save_leads)
+
+    # Отложенные сделки пробуем ещё раз, когда родительские стадии уже отработали
+    if fk_resolver:
+        save_flushed_leads(fk_resolver)
+
+    logger.info(f"Exported {len(leads)} leads")
+    return leads
+
+
+def _save_converted_lead_page(
+    lead_rows: list[tuple],
+    loss_reason_rows: list[tuple],
+    refs: EmbeddedRefs,
+    custom_field_values: list[tuple],
+    on_refs: Callable[[EmbeddedRefs], None] | None = None,
+    reference_cache: ReferenceCache | None = None,
+    fk_resolver: ForeignKeyResolver | None = None,
+) -> int:
+    if on_refs:
+        on_refs(refs)
+
+    export_loss_reasons([LossReasonEntity(*row) for row in loss_reason_rows], reference_cache, fk_resolver)
+
+    entity_id_position = CUSTOM_FIELD_VALUE_COLUMNS.index("entity_id")
+    values_by_lead = defaultdict(list)
+    for value in custom_field_values:
+        values_by_lead[value[entity_id_position]].append(value)
+
+    def save_lead_rows(batch):
+        lead_ids = [row[0] for row in batch]
+        values = [value for lead_id in lead_ids for value in values_by_lead[lead_id]]
+        if fk_resolver:
+            batch = fk_resolver.resolve(batch)
+        with get_session() as session:
+            LeadRepository(session).save_or_update_rows(batch)
+            save_custom_field_values(session, "leads", lead_ids, values)
+
+    # Строки сделок - кортежи в порядке LEAD_COLUMNS, id первым
+    write_partitioned(lead_rows, save_lead_rows, get_id=lambda row: row[0])
+
+    return len(lead_rows)
+
+
+def export_leads_with_process_pool(
+    lead_manager: LeadManager,
+    updated_from: int | None = None,
+    on_refs: Callable[[EmbeddedRefs], None] | None = None,
+    reference_cache: ReferenceCache | None = None,
+    fk_resolver: ForeignKeyResolver | None = None,
+    export_filter: ExportFilter | None = None,
+):
+    # Конвертация страниц идёт в пуле процессов, запись - в исходном порядке страниц
+    export_filter = export_filter or ExportFilter()
+    max_in_flight = settings.CONVERT_WORKERS * 2
+    pending = deque()
+    exported = 0
+
+    pages = lead_manager.get_all_lead_pages(
+        updated_from=updated_from,
+        updated_to=export_filter.until,
+        ids=list(export_filter.ids),
+        pipeline_ids=list(export_filter.pipeline_ids),
+    )
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=settings.CONVERT_WORKERS, mp_context=context) as executor:
+        for content in pages:
+            pending.append(executor.submit(convert_lead_page, content))
+
+            if len(pending) >= max_in_flight:
+                exported += _save_converted_lead_page(
+                    *pending.popleft().result(), on_refs, reference_cache, fk_resolver
+                )
+
+        while pending:
+            exported += _save_converted_lead_page(
+                *pending.popleft().result(), on_refs, reference_cache, fk_resolver
+            )
+
+    if fk_resolver:
+        save_flushed_leads(fk_resolver)
+
+    logger.info(f"Exported {exported} leads using {settings.CONVERT_WORKERS} conversion workers")
+    return exported
+
+
+def load_deferred_lead_ids(path: str) -> list[int]:
+    try:
+        with open(path, "r") as deferred_file:
+            return json.load(deferred_file)
+    except FileNotFoundError:
+        return []
+
+
+def save_deferred_lead_ids(path: str, deferred_ids: list[int]) -> None:
+    if deferred_ids:
+        logger.error(
+            f"{len(deferred_ids)} leads reference parents missing in Kommo and the DB and were not written, "
+            f"their ids are saved to {path} for the next run"
+        )
+    elif not os.path.exists(path):
+        return
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as deferred_file:
+        json.dump(deferred_ids, deferred_file)
+
+
+def remember_deferred_leads(path: str, fk_resolver: ForeignKeyResolver, account_id: int | None = None) -> None:
+    # Загрузка спула не ходит в Kommo: id отложенных сделок дописываются к сохранённым ранее,
+    # а те, что уже есть в БД, из списка убираются. Заново их выгрузит следующий запуск
+    saved_ids = load_deferred_lead_ids(path)
+    written_ids = set()
+    for ids in process_in_batches(saved_ids):
+        with get_session() as session:
+            written_ids |= LeadRepository(session).get_existing_ids(ids, account_id)
+    save_deferred_lead_ids(path, sorted((set(saved_ids) - written_ids) | set(fk_resolver.deferred_ids())))
+
+
+def export_deferred_leads(
+    lead_manager: LeadManager,
+    path: str,
+    reference_cache: ReferenceCache | None = None,
+    fk_resolver: ForeignKeyResolver | None = None,
+) -> int:
+    # Сделки, родители которых так и не нашлись, не пропадают молча: их id сохраняются в path,
+    # и следующий запуск выгружает их из Kommo заново, когда родители уже могли появиться
+    exported = 0
+    for ids in process_in_batches(load_deferred_lead_ids(path), PAGE_LIMIT):
+        leads = export_leads(
+            lead_manager,
+            reference_cache=reference_cache,
+            fk_resolver=fk_resolver,
+            export_filter=ExportFilter(ids=tuple(ids)),
+        )
+        exported += leads if isinstance(leads, int) else len(leads)
+
+    save_deferred_lead_ids(path, fk_resolver.deferred_ids() if fk_resolver else [])
+    return exported
+
+
+def get_lead_pipeline_ids(
+    account_id: int | None,
+    pipeline_manager: PipelineManager | None = None,
+    reference_cache: ReferenceCache | None = None,
+) -> list[int]:
+    # Кэш справочников для этого не годится: после 304 или частичного прохода в нём не все воронки.
+    # Полный список - в таблице воронок, а если она пуста - в свежей выгрузке без If-Modified-Since
+    pipeline_ids = load_known_ids(PipelineRepository, account_id)
+    if not pipeline_ids and pipeline_manager:
+        pipelines = export_pipelines(replace(pipeline_manager, modified_since_state=None), reference_cache)
+        pipeline_ids = {pipeline.id for pipeline in pipelines}
+    return sorted(pipeline_ids)
+
+
+def export_all_loss_reasons(
+    lead_manager: LeadManager,
+    account_id: int | None,
+    reference_cache: ReferenceCache | None = None,
+    fk_resolver: ForeignKeyResolver | None = None,
+):
+    # Kommo не отдаёт account_id в списке причин отказа
+    loss_reasons = list(lead_manager.get_all_loss_reasons())
+    for loss_reason in loss_reasons:
+        loss_reason.account_id = account_id
+    export_loss_reasons(loss_reasons, reference_cache, fk_resolver)
+    return loss_reasons
+
+
+def order_pipeline_ids(pipeline_ids) -> list[int]:
+    # Приоритетные воронки уходят в работу первыми, остальные - в порядке id
+    priority = [pipeline_id for pipeline_id in settings.LEAD_PIPELINE_PRIORITY if pipeline_id in pipeline_ids]
+    return priority + sorted(set(pipeline_ids) - set(priority))
+
+
+def export_leads_by_pipeline(
+    lead_manager: LeadManager,
+    pipeline_ids,
+    updated_from: int | None = None,
+    on_refs: Callable[[EmbeddedRefs], None] | None = None,
+    reference_cache: ReferenceCache | None = None,
+    fk_resolver: ForeignKeyResolver | None = None,
+    export_filter: ExportFilter | None = None,
+    account_id: int | None = None,
+):
+    # Каждая воронка - отдельная выгрузка с filter[pipeline_id]; запросы всех воронок
+    # идут через один HTTP-клиент и делят его лимит запросов
+    export_filter = export_filter or ExportFilter()
+    pipeline_ids = order_pipeline_ids(pipeline_ids)
+    if not pipeline_ids:
+        # Воронки ещё не выгружались: делить не по чему, идём одним обходом
+        return export_leads(lead_manager, updated_from, on_refs, reference_cache, fk_resolver, export_filter)
+
+    # Причины отказа пишутся и регистрируются в резолвере до раздачи воронок потокам: иначе
+    # ссылка на причину, которую в этот момент пишет соседний поток, обнуляется политикой null
+    export_all_loss_reasons(lead_manager, account_id, reference_cache, fk_resolver)
+
+    def export_pipeline_leads(pipeline_id: int):
+        leads = export_leads(
+            lead_manager,
+            updated_from,
+            on_refs,
+            reference_cache,
+            fk_resolver,
+            replace(export_filter, pipeline_ids=(pipeline_id,)),
+        )
+        exported = leads if isinstance(leads, int) else len(leads)
+        logger.info(f"Exported {exported} leads of pipeline {pipeline_id}")
+        return exported
+
+    with ThreadPoolExecutor(max_workers=settings.LEAD_PIPELINE_WORKERS) as executor:
+        exported = sum(executor.map(export_pipeline_leads, pipeline_ids))
+
+    logger.info(f"Exported {exported} leads of {len(pipeline_ids)} pipelines")
+    return exported
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+
+from app.db.repositories import PipelineRepository, StatusRepository
+from app.reference_cache import ReferenceCache, compute_fingerprint
+from app.stages.common import mark_synced, register_known, save_all
+
+if TYPE_CHECKING:
+    from app.fk_resolver import ForeignKeyResolver
+    from app.kommo.pipelines import PipelineManager
+
+logger = logging.getLogger(__name__)
+
+
+def export_pipelines(
+    pipeline_manager: PipelineManager,
+    reference_cache: ReferenceCache | None = None,
+    fk_resolver: ForeignKeyResolver | None = None,
+):
+    sync_marks = []
+    pipelines = list(pipeline_manager.get_all_pipelines(sync_marks=sync_marks))
+    if not pipelines:
+        logger.info("Pipelines not modified since last sync, skipping")
+        mark_synced(sync_marks)
+        return pipelines
+
+    logger.info(f"Got {len(pipelines)} pipelines from CRM")
+
+    all_statuses = []
+    for pipeline in pipelines:
+        all_statuses.extend(pipeline.statuses)
+
+    # Отпечаток пайплайнов включает и вложенные статусы; снимается со всех известных воронок
+    if reference_cache:
+        reference_cache.update_pipelines(pipelines)
+        fingerprint = compute_fingerprint(list(reference_cache.pipelines.values()))
+        if not reference_cache.is_changed("pipelines", fingerprint):
+            logger.info("Pipelines and statuses unchanged since last sync, skipping write")
+            register_known(fk_resolver, "pipelines", pipelines)
+            register_known(fk_resolver, "statuses", all_statuses)
+            reference_cache.add_known_ids("pipelines", pipelines)
+            reference_cache.add_known_ids("statuses", all_statuses)
+            mark_synced(sync_marks)
+            return pipelines
+
+    save_all(PipelineRepository, pipelines)
+    save_all(StatusRepository, all_statuses)
+    register_known(fk_resolver, "pipelines", pipelines)
+    register_known(fk_resolver, "statuses", all_statuses)
+    mark_synced(sync_marks)
+
+    if reference_cache:
+        reference_cache.add_known_ids("pipelines", pipelines)
+        reference_cache.add_known_ids("statuses", all_statuses)
+        reference_cache.remember("pipelines", fingerprint)
+
+    logger.info(f"Exported {len(pipelines)} pipelines and {len(all_statuses)} statuses")
+    return pipelines
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+
+from app.db.repositories import TaskRepository
+from app.export_filter import ExportFilter
+from app.stages.common import save_all
+
+if TYPE_CHECKING:
+    from app.kommo.tasks import TaskManager
+
+logger = logging.getLogger(__name__)
+
+
+def clear_missing_task_refs(task, lead_ids: set[int], contact_ids: set[int]):
+    # Clear entity_id if the referenced entity doesn't exist
+    if task.entity_type == 'leads' and (not task.entity_id or task.entity_id not in lead_ids):
+        task.entity_id = None
+        task.entity_type = None
+    elif task.entity_type == 'contacts' and (not task.entity_id or task.entity_id not in contact_ids):
+        task.entity_id = None
+        task.entity_type = None
+    return task
+
+
+def export_tasks(
+    task_manager: TaskManager,
+    lead_ids: set[int],
+    contact_ids: set[int],
+    updated_from: int | None = None,
+    export_filter: ExportFilter | None = None,
+):
+    export_filter = export_filter or ExportFilter()
+    tasks = list(
+        task_manager.get_all_tasks(
+            updated_from=updated_from,
+            updated_to=export_filter.until,
+            lead_ids=list(export_filter.ids),
+        )
+    )
+    logger.info(f"Got {len(tasks)} tasks from CRM")
+
+    # Filter and adjust tasks
+    filtered_tasks = [clear_missing_task_refs(task, lead_ids, contact_ids) for task in tasks]
+
+    save_all(TaskRepository, filtered_tasks)
+
+    logger.info(f"Exported {len(filtered_tasks)} tasks")
+    return filtered_tasks
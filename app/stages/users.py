@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+
+from app.db.repositories import UserRepository
+from app.reference_cache import ReferenceCache, compute_fingerprint
+from app.stages.common import mark_synced, register_known, save_all
+
+if TYPE_CHECKING:
+    from app.fk_resolver import ForeignKeyResolver
+    from app.kommo.users import UserManager
+
+logger = logging.getLogger(__name__)
+
+
+def export_users(
+    user_manager: UserManager,
+    account_id: int | None = None,
+    reference_cache: ReferenceCache | None = None,
+    fk_resolver: ForeignKeyResolver | None = None,
+):
+    sync_marks = []
+    users = list(user_manager.get_all_users(sync_marks=sync_marks))
+    if not users:
+        logger.info("Users not modified since last sync, skipping")
+        mark_synced(sync_marks)
+        return users
+
+    logger.info(f"Got {len(users)} users from CRM")
+
+    # Kommo не отдаёт account_id в списке пользователей
+    for user in users:
+        user.account_id = account_id
+
+    if reference_cache:
+        # Отпечаток снимается со всех известных пользователей, а не только с пришедших в ответе
+        reference_cache.update_users(users)
+        fingerprint = compute_fingerprint(list(reference_cache.users.values()))
+        if not reference_cache.is_changed("users", fingerprint):
+            logger.info("Users unchanged since last sync, skipping write")
+            register_known(fk_resolver, "users", users)
+            reference_cache.add_known_ids("users", users)
+            mark_synced(sync_marks)
+            return users
+
+    save_all(UserRepository, users)
+    register_known(fk_resolver, "users", users)
+    mark_synced(sync_marks)
+
+    if reference_cache:
+        reference_cache.add_known_ids("users", users)
+        reference_cache.remember("users", fingerprint)
+
+    logger.info(f"Exported {len(users)} users")
+    return users
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import argparse
+import logging
+from dataclasses import dataclass
+from functools import partial
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from app.config import KommoAccount
+
+logger = logging.getLogger(__name__)
+
+
+# Точка входа для запусков по одной сущности (cron, вебхуки): импортирует только
+# менеджер и стадию выбранной сущности, настройки и engine создаются при первом обращении.
+@dataclass
+class SyncContext:
+    account: KommoAccount
+    http_client: object
+    token_manager: object
+    account_id: int
+
+
+def _sync_users(context: SyncContext, updated_from: int | None):
+    from app.kommo.users import UserManager
+    from app.reference_cache import ReferenceCache
+    from app.stages.common import get_modified_since_state
+    from app.stages.users import export_users
+
+    user_manager = UserManager(
+        context.token_manager,
+        context.http_client,
+        get_modified_since_state(context.account),
+    )
+    reference_cache = ReferenceCache(context.account.reference_fingerprints_path)
+    return export_users(user_manager, context.account_id, reference_cache)
+
+
+def _sync_pipelines(context: SyncContext, updated_from: int | None):
+    from app.kommo.pipelines import PipelineManager
+    from app.reference_cache import ReferenceCache
+    from app.stages.common import get_modified_since_state
+    from app.stages.pipelines import export_pipelines
+
+    pipeline_manager = PipelineManager(
+        context.token_manager,
+        context.http_client,
+        get_modified_since_state(context.account),
+    )
+    return export_pipelines(pipeline_manager, ReferenceCache(context.account.reference_fingerprints_path))
+
+
+def _sync_companies(context: SyncContext, updated_from: int | None):
+    from app.kommo.companies import CompanyManager
+    from app.stages.common import get_modified_since_state
+    from app.stages.companies import export_companies
+
+    company_manager = CompanyManager(
+        context.token_manager,
+        context.http_client,
+        get_modified_since_state(context.account),
+    )
+    return export_companies(company_manager, updated_from)
+
+
+def _sync_contacts(context: SyncContext, updated_from: int | None):
+    from app.kommo.contacts import ContactManager
+    from app.stages.contacts import export_contacts
+
+    return export_contacts(ContactManager(context.token_manager, context.http_client), updated_from)
+
+
+def _sync_leads(context: SyncContext, updated_from: int | None):
+    from app.config import settings
+    from app.kommo.companies import CompanyManager
+    from app.kommo.contacts import ContactManager
+    from app.kommo.leads import LeadManager
+    from app.kommo.pipelines import PipelineManager
+    from app.kommo.users import UserManager
+    from app.reference_cache import ReferenceCache
+    from app.stages.leads import build_lead_fk_resolver, export_deferred_leads, export_lead_neighbours, export_leads
+
+    # Для сделок нужны менеджеры родителей: резолвер FK догружает недостающих по id
+    contact_manager = ContactManager(context.token_manager, context.http_client)
+    company_manager = CompanyManager(context.token_manager, context.http_client)
+    reference_cache = ReferenceCache(context.account.reference_fingerprints_path)
+    fk_resolver = build_lead_fk_resolver(
+        UserManager(context.token_manager, context.http_client),
+        PipelineManager(context.token_manager, context.http_client),
+        contact_manager,
+        company_manager,
+        context.account_id,
+        reference_cache,
+    )
+
+    def harvest_refs(refs):
+        export_lead_neighbours(contact_manager, company_manager, refs, fk_resolver)
+
+    lead_manager = LeadManager(context.token_manager, context.http_client)
+    leads = export_leads(
+        lead_manager,
+        updated_from,
+        on_refs=harvest_refs if updated_from and settings.HARVEST_EMBEDDED else None,
+        reference_cache=reference_cache,
+        fk_resolver=fk_resolver,
+    )
+    export_deferred_leads(lead_manager, context.account.deferred_leads_path, reference_cache, fk_resolver)
+    return leads
+
+
+def _sync_tasks(context: SyncContext, updated_from: int | None):
+    from app.db.repositories import ContactRepository, LeadRepository
+    from app.kommo.tasks import TaskManager
+    from app.stages.common import load_known_ids
+    from app.stages.tasks import export_tasks
+
+    return export_tasks(
+        TaskManager(context.token_manager, context.http_client),
+        load_known_ids(LeadRepository, context.account_id),
+        load_known_ids(ContactRepository, context.account_id),
+        updated_from,
+    )
+
+
+def _sync_events(context: SyncContext, updated_from: int | None):
+    from app.db.repositories import ContactRepository, LeadRepository
+    from app.stages.common import load_known_ids
+    from app.stages.events import build_event_manager, export_events
+
+    return export_events(
+        build_event_manager(context.token_manager, context.http_client),
+        load_known_ids(LeadRepository, context.account_id),
+        load_known_ids(ContactRepository, context.account_id),
+        created_from=updated_from,
+    )
+
+
+ENTITY_SYNCS = {
+    "users": _sync_users,
+    "pipelines": _sync_pipelines,
+    "companies": _sync_companies,
+    "contacts": _sync_contacts,
+    "leads": _sync_leads,
+    "tasks": _sync_tasks,
+    "events": _sync_events,
+}
+
+
+def sync_entity(account: KommoAccount, entity: str, updated_from: int | None = None):
+    from app.db.base import session_maker
+    from app.db.parquet_sink import open_parquet_sink
+    from app.kommo.account import AccountManager
+    from app.kommo.auth import TokenManager
+    from app.kommo.transport import create_http_client
+
+    http_client = create_http_client(account.base_url)
+    token_manager = TokenManager(http_client, account)
+    parquet_sink = open_parquet_sink(session_maker)
+
+    try:
+        account_id = AccountManager(token_manager, http_client).get_account_id()
+        context = SyncContext(account, http_client, token_manager, account_id)
+        logger.info(f"Syncing {entity} of {account.name} (updated_from={updated_from})")
+        return ENTITY_SYNCS[entity](context, updated_from)
+    finally:
+        http_client.close()
+        if parquet_sink:
+            parquet_sink.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m app.sync", description="Sync a single Kommo entity")
+    parser.add_argument("entity", choices=list(ENTITY_SYNCS))
+    parser.add_argument(
+        "--account",
+        action="append",
+        help="sync only the given account name (can be repeated)",
+    )
+    parser.add_argument(
+        "--updated-from",
+        type=int,
+        help="unix time: fetch only entities updated (events: created) since then",
+    )
+    args = parser.parse_args()
+
+    from app.accounts import run_for_accounts
+    from app.config import settings
+
+    if args.account:
+        accounts = [settings.get_account(name) for name in args.account]
+    else:
+        accounts = settings.accounts
+
+    run_for_accounts(partial(sync_entity, entity=args.entity, updated_from=args.updated_from), accounts)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
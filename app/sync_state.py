@@ -0,0 +1,32 @@
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+
+
+@dataclass
+class SyncState:
+    path: str
+    _state: dict[str, int] | None = field(default=None, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def _load(self) -> dict[str, int]:
+        if self._state is None:
+            try:
+                with open(self.path, "r") as state_file:
+                    self._state = json.load(state_file)
+            except FileNotFoundError:
+                self._state = {}
+        return self._state
+
+    def get_last_sync(self, entity: str) -> int | None:
+        with self._lock:
+            return self._load().get(entity)
+
+    def set_last_sync(self, entity: str, timestamp: int) -> None:
+        with self._lock:
+            state = self._load()
+            state[entity] = timestamp
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "w") as state_file:
+                json.dump(state, state_file)
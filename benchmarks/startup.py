@@ -0,0 +1,67 @@
+"""Cold start of the CLI: import time of the entry points and of real entity runs in a fresh interpreter.
+
+    PYTHONPATH=. python benchmarks/startup.py --repeat 5 --max-ms 400
+
+"sync <entity>" rows load everything `python -m app.sync <entity>` imports before its first
+request to Kommo: sync_entity's own modules, then the entity stage function, which imports its
+manager and stage lazily and stops at the first use of the (missing) context.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ENTITIES = ("users", "pipelines", "companies", "contacts", "leads", "tasks", "events")
+
+ENTITY_RUN = """
+import app.sync
+import app.db.base, app.db.parquet_sink, app.kommo.account, app.kommo.auth, app.kommo.transport
+try:
+    app.sync.ENTITY_SYNCS[{entity!r}](None, None)
+except AttributeError:
+    pass
+"""
+
+TARGETS = {
+    "app.config": [sys.executable, "-c", "import app.config"],
+    "app.sync": [sys.executable, "-c", "import app.sync"],
+    "app.export": [sys.executable, "-c", "import app.export"],
+    "app.daemon": [sys.executable, "-c", "import app.daemon"],
+    "python -m app --help": [sys.executable, "-m", "app", "--help"],
+    "python -m app.sync --help": [sys.executable, "-m", "app.sync", "--help"],
+    **{f"sync {entity}": [sys.executable, "-c", ENTITY_RUN.format(entity=entity)] for entity in ENTITIES},
+}
+
+
+def measure(command: list[str], repeat: int) -> float:
+    # Минимум по повторам: меньше всего зависит от кэша ФС и соседних процессов
+    env = {**os.environ, "PYTHONPATH": os.environ.get("PYTHONPATH", ".")}
+    best = None
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+        elapsed = (time.perf_counter() - started_at) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, help="fail if `python -m app --help` is slower")
+    args = parser.parse_args()
+
+    baseline = measure([sys.executable, "-c", "pass"], args.repeat)
+    print(f"{'interpreter':<28}{baseline:>8.0f} ms")
+    results = {}
+    for name, command in TARGETS.items():
+        results[name] = measure(command, args.repeat)
+        print(f"{name:<28}{results[name]:>8.0f} ms  (+{results[name] - baseline:.0f})")
+
+    if args.max_ms is not None and results["python -m app --help"] > args.max_ms:
+        sys.exit(f"CLI startup {results['python -m app --help']:.0f} ms exceeds budget {args.max_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""compact events
+
+Revision ID: 8f3c2a61d0b7
+Revises: 5b1e0c7a9d42
+Create Date: 2026-10-19 11:00:47.902114
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.db.partitions import add_months, build_month_partitions, is_partitioning_supported
+from app.db.types import EventId, decode_event_id, encode_event_id, is_valid_event_id
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f3c2a61d0b7'
+down_revision: Union[str, None] = '5b1e0c7a9d42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COPY_BATCH_SIZE = 10000
+
+EVENT_COLUMNS = (
+    'id',
+    'type',
+    'entity_id',
+    'entity_type',
+    'created_by',
+    'created_at',
+    'account_id',
+    'value_after_field_id',
+    'value_after_field_type',
+    'value_after_enum_id',
+    'value_after_text',
+    'value_before_field_id',
+    'value_before_field_type',
+    'value_before_enum_id',
+    'value_before_text',
+)
+
+
+def _check_event_ids() -> None:
+    # DDL в MariaDB не транзакционный: проверяем все id до создания events_compact,
+    # иначе ошибка посреди копирования оставит недоделанную таблицу
+    connection = op.get_bind()
+    invalid = []
+    last_id = None
+    while True:
+        query = 'SELECT id FROM events'
+        params = {'limit': COPY_BATCH_SIZE}
+        if last_id is not None:
+            query += ' WHERE id > :last_id'
+            params['last_id'] = last_id
+        query += ' ORDER BY id LIMIT :limit'
+
+        ids = connection.execute(sa.text(query), params).scalars().all()
+        if not ids:
+            break
+        last_id = ids[-1]
+        invalid.extend(event_id for event_id in ids if not is_valid_event_id(event_id))
+
+    if invalid:
+        sample = ', '.join(repr(event_id) for event_id in invalid[:10])
+        raise ValueError(f'{len(invalid)} events have non-ULID ids and cannot be compacted: {sample}')
+
+
+def _copy_events(source: str, target: str, convert_id) -> None:
+    # id нельзя перекодировать средствами SQL, поэтому копируем пачками через Python
+    connection = op.get_bind()
+    columns = ', '.join(EVENT_COLUMNS)
+    placeholders = ', '.join(f':{column}' for column in EVENT_COLUMNS)
+    insert = sa.text(f'INSERT INTO {target} ({columns}) VALUES ({placeholders})')
+
+    last_id = None
+    while True:
+        query = f'SELECT {columns} FROM {source}'
+        params = {'limit': COPY_BATCH_SIZE}
+        if last_id is not None:
+            query += ' WHERE id > :last_id'
+            params['last_id'] = last_id
+        query += ' ORDER BY id LIMIT :limit'
+
+        rows = [dict(row._mapping) for row in connection.execute(sa.text(query), params)]
+        if not rows:
+            break
+
+        last_id = rows[-1]['id']
+        for row in rows:
+            row['id'] = convert_id(row['id'])
+        connection.execute(insert, rows)
+
+
+def _create_compact_table() -> None:
+    # PostgreSQL и SQLite: та же схема без партиций (EventId хранится в BYTEA/BLOB).
+    # Индексы создаются после удаления старой таблицы: там имена индексов общие на всю схему
+    op.create_table('events_compact',
+    sa.Column('id', EventId(), nullable=False),
+    sa.Column('type', sa.String(length=255), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=True),
+    sa.Column('entity_type', sa.String(length=50), nullable=False),
+    sa.Column('created_by', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('account_id', sa.Integer(), nullable=False),
+    sa.Column('value_after_field_id', sa.Integer(), nullable=True),
+    sa.Column('value_after_field_type', sa.Integer(), nullable=True),
+    sa.Column('value_after_enum_id', sa.Integer(), nullable=True),
+    sa.Column('value_after_text', sa.Text(), nullable=True),
+    sa.Column('value_before_field_id', sa.Integer(), nullable=True),
+    sa.Column('value_before_field_type', sa.Integer(), nullable=True),
+    sa.Column('value_before_enum_id', sa.Integer(), nullable=True),
+    sa.Column('value_before_text', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id', 'created_at')
+    )
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    _check_event_ids()
+    # Остаток прерванного прошлого запуска
+    op.execute('DROP TABLE IF EXISTS events_compact')
+    if not is_partitioning_supported(connection):
+        _create_compact_table()
+        _copy_events('events', 'events_compact', encode_event_id)
+        op.drop_table('events')
+        op.rename_table('events_compact', 'events')
+        op.create_index(
+            'ix_events_entity_type_entity_id_created_at', 'events', ['entity_type', 'entity_id', 'created_at']
+        )
+        op.create_index(op.f('ix_events_account_id'), 'events', ['account_id'], unique=False)
+        return
+
+    first_created_at = connection.execute(sa.text('SELECT MIN(created_at) FROM events')).scalar()
+    first_month = (first_created_at.date() if first_created_at else date.today()).replace(day=1)
+    last_month = add_months(date.today().replace(day=1), 2)
+    partitions = ',\n        '.join(build_month_partitions(first_month, last_month))
+
+    op.execute(f"""
+    CREATE TABLE events_compact (
+        id BINARY(16) NOT NULL,
+        type VARCHAR(255) NOT NULL,
+        entity_id INTEGER NULL,
+        entity_type VARCHAR(50) NOT NULL,
+        created_by INTEGER NOT NULL,
+        created_at DATETIME NOT NULL,
+        account_id INTEGER NOT NULL,
+        value_after_field_id INTEGER NULL,
+        value_after_field_type INTEGER NULL,
+        value_after_enum_id INTEGER NULL,
+        value_after_text TEXT NULL,
+        value_before_field_id INTEGER NULL,
+        value_before_field_type INTEGER NULL,
+        value_before_enum_id INTEGER NULL,
+        value_before_text TEXT NULL,
+        PRIMARY KEY (id, created_at),
+        INDEX ix_events_entity_type_entity_id_created_at (entity_type, entity_id, created_at),
+        INDEX ix_events_account_id (account_id)
+    )
+    PARTITION BY RANGE (TO_DAYS(created_at)) (
+        {partitions}
+    )
+    """)
+
+    _copy_events('events', 'events_compact', encode_event_id)
+
+    op.drop_table('events')
+    op.rename_table('events_compact', 'events')
+
+
+def downgrade() -> None:
+    op.create_table('events_wide',
+    sa.Column('id', sa.String(length=255), nullable=False),
+    sa.Column('type', sa.String(length=255), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=True),
+    sa.Column('entity_type', sa.String(length=50), nullable=False),
+    sa.Column('created_by', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('account_id', sa.Integer(), nullable=False),
+    sa.Column('value_after_field_id', sa.Integer(), nullable=True),
+    sa.Column('value_after_field_type', sa.Integer(), nullable=True),
+    sa.Column('value_after_enum_id', sa.Integer(), nullable=True),
+    sa.Column('value_after_text', sa.Text(), nullable=True),
+    sa.Column('value_before_field_id', sa.Integer(), nullable=True),
+    sa.Column('value_before_field_type', sa.Integer(), nullable=True),
+    sa.Column('value_before_enum_id', sa.Integer(), nullable=True),
+    sa.Column('value_before_text', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    _copy_events('events', 'events_wide', decode_event_id)
+
+    op.drop_table('events')
+    op.rename_table('events_wide', 'events')
+    op.create_index(op.f('ix_events_account_id'), 'events', ['account_id'], unique=False)
@@ -5,8 +5,9 @@ from app.kommo.auth import TokenManager
 from app.config import settings
 from app.kommo.leads import LeadManager
 
-http_client = Client(base_url=f"https://{settings.KOMMO_URL_BASE}.kommo.com/")
-token_manager = TokenManager(http_client)
+account = settings.accounts[0]
+http_client = Client(base_url=account.base_url)
+token_manager = TokenManager(http_client, account)
 
 lead_manager = LeadManager(http_client=http_client, token_manager=token_manager)
 
@@ -0,0 +1,42 @@
+import json
+import os
+import tempfile
+
+import pytest
+
+# Настройки читаются при первом обращении, поэтому окружение задаётся до импорта app
+_DB_DIR = tempfile.mkdtemp(prefix="kommo-sync-tests-")
+os.environ.setdefault("DB_DRIVER", "sqlite")
+os.environ.setdefault("DB_NAME", os.path.join(_DB_DIR, "test.sqlite"))
+os.environ.setdefault(
+    "KOMMO_ACCOUNTS",
+    json.dumps(
+        [
+            {
+                "name": "test",
+                "url_base": "test",
+                "integration_id": "integration",
+                "secret_key": "secret",
+                "redirect_url": "https://example.com",
+            }
+        ]
+    ),
+)
+
+from app.config import get_settings  # noqa: E402
+from app.db.base import get_engine  # noqa: E402
+from app.db.models import Base  # noqa: E402
+
+
+@pytest.fixture
+def app_settings():
+    # Значения меняются на время теста через monkeypatch.setattr(app_settings, ...)
+    return get_settings()
+
+
+@pytest.fixture
+def db():
+    engine = get_engine()
+    Base.metadata.create_all(engine)
+    yield engine
+    Base.metadata.drop_all(engine)
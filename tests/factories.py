@@ -0,0 +1,79 @@
+from app.entities import Event, Pipeline, Status, User
+
+
+def make_event(event_id: str) -> Event:
+    return Event(
+        id=event_id,
+        type="lead_added",
+        entity_id=1,
+        entity_type="leads",
+        created_by=0,
+        created_at=1760000000,
+        account_id=1,
+        value_after_field_id=None,
+        value_after_field_type=None,
+        value_after_enum_id=None,
+        value_after_text=None,
+        value_before_field_id=None,
+        value_before_field_type=None,
+        value_before_enum_id=None,
+        value_before_text=None,
+    )
+
+
+def make_user(user_id: int, account_id: int | None) -> User:
+    return User(id=user_id, name=f"User {user_id}", email=f"{user_id}@example.com", lang="en", account_id=account_id)
+
+
+def make_lead_json(lead_id: int, **overrides) -> dict:
+    # Сделка в том виде, в каком её отдаёт /api/v4/leads
+    lead_json = {
+        "id": lead_id,
+        "name": f"Lead {lead_id}",
+        "price": 1000,
+        "responsible_user_id": 10,
+        "group_id": 0,
+        "status_id": 30,
+        "pipeline_id": 20,
+        "loss_reason_id": None,
+        "created_by": 10,
+        "updated_by": 10,
+        "created_at": 1760000000,
+        "updated_at": 1760000000,
+        "closed_at": None,
+        "closest_task_at": None,
+        "is_deleted": False,
+        "score": None,
+        "account_id": 1,
+        "labor_cost": None,
+        "custom_fields_values": None,
+        "_embedded": {"tags": [], "companies": []},
+    }
+    lead_json.update(overrides)
+    return lead_json
+
+
+def make_pipeline(pipeline_id: int, status_ids: list[int]) -> Pipeline:
+    statuses = [
+        Status(
+            id=status_id,
+            name=f"Status {status_id}",
+            sort=index,
+            is_editable=True,
+            pipeline_id=pipeline_id,
+            color="#fffeb2",
+            type=0,
+            account_id=1,
+        )
+        for index, status_id in enumerate(status_ids)
+    ]
+    return Pipeline(
+        id=pipeline_id,
+        name=f"Pipeline {pipeline_id}",
+        sort=pipeline_id,
+        is_main=False,
+        is_unsorted_on=False,
+        is_archive=False,
+        account_id=1,
+        statuses=statuses,
+    )
@@ -0,0 +1,69 @@
+import httpx
+import pytest
+
+import app.stages.users as users_stage
+from app.kommo.users import UserManager
+from app.reference_cache import ReferenceCache
+from app.stages.users import export_users
+from app.sync_state import SyncState
+from tests.factories import make_user
+
+
+class FakeTokenManager:
+    def get_token(self):
+        return "token"
+
+
+def make_user_manager(tmp_path, requests: list, users: list[dict]) -> UserManager:
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        # Kommo отвечает 204, если с If-Modified-Since ничего не менялось
+        if "If-Modified-Since" in request.headers:
+            return httpx.Response(204)
+        return httpx.Response(200, json={"_embedded": {"users": users}})
+
+    http_client = httpx.Client(base_url="https://test.kommo.com/", transport=httpx.MockTransport(handler))
+    return UserManager(FakeTokenManager(), http_client, SyncState(str(tmp_path / "modified_since.json")))
+
+
+def user_json(user_id: int, name: str = "User") -> dict:
+    return {"id": user_id, "name": name, "email": f"user{user_id}@example.com", "lang": "en"}
+
+
+def test_failed_write_keeps_modified_since_unset(db, tmp_path, monkeypatch):
+    requests = []
+    user_manager = make_user_manager(tmp_path, requests, [user_json(1)])
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(users_stage, "save_all", fail)
+    with pytest.raises(RuntimeError):
+        export_users(user_manager, 1)
+    monkeypatch.undo()
+
+    # Повторный запуск снова забирает полный список, а не получает 204
+    assert [user.id for user in export_users(user_manager, 1)] == [1]
+    assert "If-Modified-Since" not in requests[1].headers
+
+
+def test_modified_since_is_sent_after_successful_write(db, tmp_path):
+    requests = []
+    user_manager = make_user_manager(tmp_path, requests, [user_json(1)])
+
+    export_users(user_manager, 1)
+
+    assert export_users(user_manager, 1) == []
+    assert "If-Modified-Since" in requests[1].headers
+
+
+def test_conditional_response_extends_reference_cache(db, tmp_path):
+    reference_cache = ReferenceCache(str(tmp_path / "fingerprints.json"))
+    reference_cache.update_users([make_user(1, 1), make_user(2, 1)])
+    requests = []
+    user_manager = make_user_manager(tmp_path, requests, [user_json(2, "Renamed")])
+
+    export_users(user_manager, 1, reference_cache)
+
+    assert sorted(reference_cache.users) == [1, 2]
+    assert reference_cache.users[2].name == "Renamed"
@@ -0,0 +1,37 @@
+import pytest
+
+from app import daemon
+from app.fk_resolver import LEAD_FOREIGN_KEYS, LEAD_NULLABLE_FOREIGN_KEYS, ForeignKeyResolver
+from app.sync_state import SyncState
+
+
+def build_jobs(tmp_path, **kwargs):
+    return daemon.build_jobs(None, None, SyncState(str(tmp_path / "sync_state.json")), 1, **kwargs)
+
+
+def test_build_jobs_without_intervals_is_a_config_error(tmp_path, monkeypatch, app_settings):
+    monkeypatch.setattr(app_settings, "SYNC_INTERVALS", {})
+    monkeypatch.setattr(app_settings, "LEAD_PIPELINE_INTERVALS", {})
+
+    with pytest.raises(ValueError, match="no sync jobs"):
+        build_jobs(tmp_path)
+
+
+def test_leads_job_reloads_resolver_indexes_every_run(tmp_path, monkeypatch, app_settings):
+    monkeypatch.setattr(app_settings, "SYNC_INTERVALS", {"leads": 60})
+    loads = []
+    resolver = ForeignKeyResolver(
+        foreign_keys=LEAD_FOREIGN_KEYS,
+        nullable=LEAD_NULLABLE_FOREIGN_KEYS,
+        policies={},
+        load_ids=lambda table: loads.append(table) or set(),
+    )
+    monkeypatch.setattr(daemon, "build_lead_fk_resolver", lambda *args: resolver)
+    # Вместо выгрузки сделок - обращение к индексу, как это делает resolve
+    monkeypatch.setattr(daemon, "export_leads", lambda *args, fk_resolver, **kwargs: fk_resolver.add_known("users", ()))
+
+    [job] = build_jobs(tmp_path)
+    job.sync(None)
+    job.sync(None)
+
+    assert loads == ["users", "users"]
@@ -0,0 +1,37 @@
+from app.db.base import get_session
+from app.db.models import Event
+from app.db.repositories import EventRepository, UserRepository
+from app.dry_run import DryRunReport, diff_entities
+from tests.factories import make_event, make_user
+
+ULIDS = ["01j9x3k7qz8w5m2n4p6r8t0v2a", "01j9x3k7qz8w5m2n4p6r8t0v2b", "01j9x3k7qz8w5m2n4p6r8t0v2c"]
+
+
+def test_stale_users_are_counted_within_the_account(db):
+    with get_session() as session:
+        UserRepository(session).save_or_update_all(
+            [make_user(1, 1), make_user(2, 1), make_user(3, None), make_user(4, 2)]
+        )
+
+    # Пользователь 3 без аккаунта совпал по id, но к аккаунту 1 в БД не относится
+    diff = diff_entities(DryRunReport("test"), "users", UserRepository, [make_user(1, 1), make_user(3, 1)], 1)
+
+    assert diff.stale == 1
+
+
+def test_stale_events_are_counted_within_fetched_types(db):
+    events = [make_event(event_id) for event_id in ULIDS]
+    events[2].type = "lead_deleted"
+    with get_session() as session:
+        EventRepository(session).save_or_update_all(events)
+
+    diff = diff_entities(
+        DryRunReport("test"),
+        "events",
+        EventRepository,
+        events[:1],
+        1,
+        scope=(Event.type.in_(["lead_added"]),),
+    )
+
+    assert diff.stale == 1
@@ -0,0 +1,54 @@
+import pytest
+from sqlalchemy import select
+
+from app.db.base import get_session
+from app.db.models import Event
+from app.db.repositories import EventRepository
+from app.db.types import decode_event_id, encode_event_id
+from tests.factories import make_event
+
+ULID = "01j9x3k7qz8w5m2n4p6r8t0v2y"
+UUID = "0f8fad5b-d9cb-469f-a165-70867728950e"
+
+
+def test_ulid_round_trips_exactly():
+    encoded = encode_event_id(ULID)
+
+    assert len(encoded) == 16
+    assert decode_event_id(encoded) == ULID
+
+
+@pytest.mark.parametrize(
+    "event_id",
+    [
+        UUID,
+        UUID.replace("-", ""),
+        ULID.upper(),
+        # Больше 128 бит: первый символ ULID не старше 7
+        "8" + ULID[1:],
+        ULID[:-1],
+    ],
+)
+def test_ids_that_cannot_round_trip_are_rejected(event_id):
+    with pytest.raises(ValueError, match="Invalid event id"):
+        encode_event_id(event_id)
+
+
+def test_event_id_round_trips_through_the_database(db):
+    with get_session() as session:
+        EventRepository(session).save_or_update_all([make_event(ULID)])
+
+    with get_session() as session:
+        assert session.scalars(select(Event.id)).all() == [ULID]
+
+
+def test_export_events_skips_non_ulid_ids(db):
+    from app.stages.events import export_events
+
+    class FakeEventManager:
+        def get_all_lead_events(self, **kwargs):
+            return [make_event(ULID), make_event(UUID)]
+
+    exported = export_events(FakeEventManager(), {1}, set())
+
+    assert [event.id for event in exported] == [ULID]
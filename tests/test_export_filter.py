@@ -0,0 +1,21 @@
+import pytest
+
+from app.export_filter import EXPORT_STAGES, check_ids_stages
+
+
+@pytest.mark.parametrize(
+    "stages",
+    [("leads",), ("leads", "tasks", "events"), ("tasks",), ("contacts",), ("companies",)],
+)
+def test_ids_of_one_entity_are_accepted(stages):
+    check_ids_stages(stages)
+
+
+@pytest.mark.parametrize(
+    "stages",
+    [EXPORT_STAGES, ("companies", "contacts"), ("contacts", "leads"), ("users",), ("pipelines", "leads")],
+)
+def test_ids_spanning_several_entities_are_rejected(stages):
+    # id 123 сделки и id 123 контакта - разные записи
+    with pytest.raises(ValueError):
+        check_ids_stages(stages)
@@ -0,0 +1,126 @@
+import json
+import threading
+
+from app.db.repositories import LossReasonRepository, UserRepository
+from app.entities import LossReason, User
+from app.stages.common import load_known_ids
+from app.stages.leads import export_deferred_leads, export_loss_reasons
+from app.stages.users import export_users
+from app.fk_resolver import ForeignKeyResolver
+
+
+def make_resolver(**kwargs) -> ForeignKeyResolver:
+    # Строки-кортежи (id, responsible_user_id, loss_reason_id)
+    repositories = {"users": UserRepository, "loss_reasons": LossReasonRepository}
+    return ForeignKeyResolver(
+        foreign_keys={"responsible_user_id": "users", "loss_reason_id": "loss_reasons"},
+        nullable={"loss_reason_id"},
+        policies={"responsible_user_id": "defer", "loss_reason_id": "null"},
+        load_ids=lambda table: load_known_ids(repositories[table]),
+        columns=("id", "responsible_user_id", "loss_reason_id"),
+        **kwargs,
+    )
+
+
+def make_fetching_resolver(fetch_users) -> ForeignKeyResolver:
+    return ForeignKeyResolver(
+        foreign_keys={"responsible_user_id": "users"},
+        nullable=set(),
+        policies={"responsible_user_id": "fetch"},
+        load_ids=lambda table: {1},
+        fetchers={"users": fetch_users},
+        columns=("id", "responsible_user_id"),
+    )
+
+
+class FakeUserManager:
+    def __init__(self, users):
+        self.users = users
+
+    def get_all_users(self, sync_marks=None):
+        return self.users
+
+
+def test_loss_reasons_written_after_index_load_are_known(db):
+    resolver = make_resolver()
+    # Индекс загружен до того, как причина отказа попала в БД
+    assert resolver.resolve([(1, None, None)]) == [(1, None, None)]
+
+    loss_reason = LossReason(id=7, name="Too expensive", sort=1, created_at=0, updated_at=0, account_id=1)
+    export_loss_reasons([loss_reason], fk_resolver=resolver)
+
+    assert resolver.resolve([(2, None, 7)]) == [(2, None, 7)]
+
+
+def test_users_written_after_index_load_are_known(db):
+    resolver = make_resolver()
+    assert resolver.resolve([(1, 5, None)]) == []
+
+    export_users(FakeUserManager([User(id=5, name="Manager", email="m@example.com", lang="en")]), 1, None, resolver)
+
+    assert resolver.flush_deferred() == [(1, 5, None)]
+    assert resolver.deferred == []
+
+
+def test_unresolved_rows_stay_deferred_after_flush(db):
+    resolver = make_resolver()
+    resolver.resolve([(1, 5, None), (2, 6, None)])
+
+    assert resolver.flush_deferred() == []
+    assert resolver.deferred_ids() == [1, 2]
+
+
+def test_deferred_lead_ids_are_saved_and_refetched_next_run(db, tmp_path, app_settings, monkeypatch):
+    monkeypatch.setattr(app_settings, "CONVERT_WORKERS", 0)
+    path = str(tmp_path / "deferred_leads.json")
+    resolver = make_resolver()
+    resolver.resolve([(3, 5, None)])
+
+    class FakeLeadManager:
+        requested_ids = []
+
+        def get_all_leads(self, ids, **kwargs):
+            self.requested_ids.append(ids)
+            return []
+
+    lead_manager = FakeLeadManager()
+    export_deferred_leads(lead_manager, path, fk_resolver=resolver)
+    with open(path) as deferred_file:
+        assert json.load(deferred_file) == [3]
+
+    # Следующий запуск перевыгружает сохранённые сделки по id
+    export_deferred_leads(lead_manager, path, fk_resolver=make_resolver())
+    assert lead_manager.requested_ids == [[3]]
+    with open(path) as deferred_file:
+        assert json.load(deferred_file) == []
+
+
+def test_fetch_runs_outside_the_lock():
+    fetch_started = threading.Event()
+    release_fetch = threading.Event()
+    calls = []
+
+    def fetch_users(ids):
+        calls.append(set(ids))
+        fetch_started.set()
+        assert release_fetch.wait(5)
+        return {"users": set(ids)}
+
+    resolver = make_fetching_resolver(fetch_users)
+    results = {}
+    fetching = threading.Thread(target=lambda: results.setdefault("first", resolver.resolve([(10, 5)])))
+    waiting = threading.Thread(target=lambda: results.setdefault("second", resolver.resolve([(11, 5)])))
+    fetching.start()
+    assert fetch_started.wait(5)
+    waiting.start()
+
+    # Пока идёт догрузка, сделки с известными родителями резолвятся без ожидания
+    assert resolver.resolve([(12, 1)]) == [(12, 1)]
+
+    release_fetch.set()
+    fetching.join(5)
+    waiting.join(5)
+    # Второй поток дождался чужой догрузки, а не запросил пользователя повторно
+    assert calls == [{5}]
+    assert results == {"first": [(10, 5)], "second": [(11, 5)]}
+    assert resolver.deferred == []
@@ -0,0 +1,215 @@
+import json
+from dataclasses import dataclass
+
+from sqlalchemy import select
+
+import app.stages.leads as leads_stage
+from app.db.base import get_session
+from app.db.models import CustomFieldValue, Lead
+from app.db.repositories import (
+    CUSTOM_FIELD_VALUE_COLUMNS,
+    LEAD_COLUMNS,
+    PipelineRepository,
+    StatusRepository,
+    UserRepository,
+    convert_lead_entity_to_row,
+)
+from app.entities import LossReason
+from app.fk_resolver import LEAD_FOREIGN_KEYS, LEAD_NULLABLE_FOREIGN_KEYS, ForeignKeyResolver
+from app.kommo.converters import convert_lead_json_to_entity
+from app.lead_pages import convert_lead_page
+from app.reference_cache import ReferenceCache
+from app.stages.leads import build_lead_fk_resolver, export_leads, export_leads_by_pipeline, get_lead_pipeline_ids
+from app.stages.users import export_users
+from tests.factories import make_lead_json, make_pipeline, make_user
+
+
+def seed_parents(*pipelines):
+    pipelines = pipelines or (make_pipeline(20, [30]),)
+    with get_session() as session:
+        UserRepository(session).save_or_update_all([make_user(10, 1)])
+        PipelineRepository(session).save_or_update_all(list(pipelines))
+        StatusRepository(session).save_or_update_all([status for pipeline in pipelines for status in pipeline.statuses])
+
+
+@dataclass
+class FakePipelineManager:
+    pipelines: list
+    modified_since_state: object = None
+
+    def get_all_pipelines(self, sync_marks=None):
+        # С If-Modified-Since Kommo ответил бы 304 и пустым списком
+        return [] if self.modified_since_state else self.pipelines
+
+
+def test_resolver_handles_entities_and_rows_alike():
+    resolver = ForeignKeyResolver(
+        foreign_keys=LEAD_FOREIGN_KEYS,
+        nullable=LEAD_NULLABLE_FOREIGN_KEYS,
+        policies={"loss_reason_id": "null"},
+        load_ids=lambda table: {10} if table == "users" else {20, 30},
+        columns=LEAD_COLUMNS,
+    )
+    lead = convert_lead_json_to_entity(make_lead_json(1, loss_reason_id=99))
+    row = convert_lead_entity_to_row(convert_lead_json_to_entity(make_lead_json(2, loss_reason_id=99)))
+
+    [resolved_lead, resolved_row] = resolver.resolve([lead, row])
+
+    assert resolved_lead.loss_reason_id is None
+    assert resolved_row[LEAD_COLUMNS.index("loss_reason_id")] is None
+
+
+def test_sharded_fetch_with_conversion_pool_writes_leads(db, app_settings, monkeypatch):
+    # Окна по created_at идут мимо пула конвертации и отдают сущности, а не кортежи
+    monkeypatch.setattr(app_settings, "CONVERT_WORKERS", 2)
+    monkeypatch.setattr(app_settings, "SHARDED_FETCH", ["leads"])
+    seed_parents()
+
+    class FakeLeadManager:
+        def get_all_leads_sharded(self, pipeline_ids):
+            return [make_lead_json(1), make_lead_json(2)]
+
+    resolver = build_lead_fk_resolver(None, None, None, None, 1)
+    export_leads(FakeLeadManager(), fk_resolver=resolver)
+
+    with get_session() as session:
+        assert session.scalars(select(Lead.id).order_by(Lead.id)).all() == [1, 2]
+
+
+def test_lead_pipeline_ids_ignore_partial_reference_cache(db, tmp_path):
+    seed_parents(make_pipeline(20, [30]), make_pipeline(21, [31]))
+    reference_cache = ReferenceCache(str(tmp_path / "fingerprints.json"))
+    reference_cache.update_pipelines([make_pipeline(20, [30])])
+
+    assert get_lead_pipeline_ids(1, reference_cache=reference_cache) == [20, 21]
+
+
+def test_lead_pipeline_ids_fetched_without_if_modified_since_when_table_is_empty(db):
+    pipeline_manager = FakePipelineManager([make_pipeline(20, [30]), make_pipeline(21, [31])], object())
+
+    assert get_lead_pipeline_ids(1, pipeline_manager) == [20, 21]
+
+
+def test_loss_reasons_registered_before_pipeline_fan_out(db, app_settings, monkeypatch):
+    monkeypatch.setattr(app_settings, "LEAD_PIPELINE_WORKERS", 3)
+    seed_parents(make_pipeline(20, [30]), make_pipeline(21, [31]), make_pipeline(22, [32]))
+
+    class FakeLeadManager:
+        def get_all_loss_reasons(self):
+            return [LossReason(id=5, name="Too expensive", sort=1, created_at=1760000000, updated_at=1760000000)]
+
+        def get_all_leads(self, updated_from, updated_to, ids, pipeline_ids):
+            # Сделки ссылаются на причину без _embedded: её знает только список причин отказа
+            [pipeline_id] = pipeline_ids
+            lead_json = make_lead_json(pipeline_id, pipeline_id=pipeline_id, status_id=pipeline_id + 10, loss_reason_id=5)
+            return [lead_json]
+
+    resolver = build_lead_fk_resolver(None, None, None, None, 1)
+    export_leads_by_pipeline(FakeLeadManager(), [20, 21, 22], fk_resolver=resolver, account_id=1)
+
+    with get_session() as session:
+        assert session.execute(select(Lead.id, Lead.loss_reason_id).order_by(Lead.id)).all() == [
+            (20, 5),
+            (21, 5),
+            (22, 5),
+        ]
+
+
+CUSTOM_FIELDS_VALUES = [
+    {"field_id": 501, "field_name": "Source", "field_type": "text", "values": [{"value": "site"}]},
+    {"field_id": 502, "field_name": "Budget", "field_type": "numeric", "values": [{"value": 1500}]},
+]
+
+
+def make_lead_page(*leads_json) -> bytes:
+    return json.dumps({"_embedded": {"leads": list(leads_json)}}).encode()
+
+
+def test_lead_page_custom_field_values_are_rows_in_column_order():
+    page = make_lead_page(make_lead_json(1, custom_fields_values=CUSTOM_FIELDS_VALUES))
+
+    *_, custom_field_values = convert_lead_page(page)
+
+    assert [dict(zip(CUSTOM_FIELD_VALUE_COLUMNS, value)) for value in custom_field_values] == [
+        {
+            "entity_type": "leads",
+            "entity_id": 1,
+            "field_id": 501,
+            "position": 0,
+            "field_type": "text",
+            "enum_id": None,
+            "value_text": "site",
+            "value_number": None,
+            "value_bool": None,
+            "account_id": 1,
+        },
+        {
+            "entity_type": "leads",
+            "entity_id": 1,
+            "field_id": 502,
+            "position": 0,
+            "field_type": "numeric",
+            "enum_id": None,
+            "value_text": None,
+            "value_number": 1500,
+            "value_bool": None,
+            "account_id": 1,
+        },
+    ]
+
+
+def test_conversion_pool_writes_lead_custom_field_values(db, app_settings, monkeypatch):
+    monkeypatch.setattr(app_settings, "CONVERT_WORKERS", 1)
+    seed_parents()
+
+    class FakeLeadManager:
+        def get_all_lead_pages(self, updated_from, updated_to, ids, pipeline_ids):
+            return [
+                make_lead_page(
+                    make_lead_json(1, custom_fields_values=CUSTOM_FIELDS_VALUES),
+                    make_lead_json(2, custom_fields_values=CUSTOM_FIELDS_VALUES[:1]),
+                )
+            ]
+
+    export_leads(FakeLeadManager(), fk_resolver=build_lead_fk_resolver(None, None, None, None, 1))
+
+    with get_session() as session:
+        rows = session.execute(
+            select(CustomFieldValue.entity_id, CustomFieldValue.field_id, CustomFieldValue.value_text)
+            .order_by(CustomFieldValue.entity_id, CustomFieldValue.field_id)
+        ).all()
+    assert rows == [(1, 501, "site"), (1, 502, None), (2, 501, "site")]
+
+
+def test_reference_ids_are_read_from_the_database_once(db, tmp_path, monkeypatch):
+    seed_parents()
+    loaded_tables = []
+
+    def load_known_ids(repository_class, account_id=None):
+        loaded_tables.append(repository_class.__name__)
+        return original_load_known_ids(repository_class, account_id)
+
+    original_load_known_ids = leads_stage.load_known_ids
+    monkeypatch.setattr(leads_stage, "load_known_ids", load_known_ids)
+
+    class FakeUserManager:
+        def get_all_users(self, sync_marks=None):
+            return [make_user(11, 1)]
+
+    reference_cache = ReferenceCache(str(tmp_path / "fingerprints.json"))
+    resolver = build_lead_fk_resolver(FakeUserManager(), None, None, None, 1, reference_cache)
+    resolver.resolve([convert_lead_json_to_entity(make_lead_json(1))])
+
+    # Следующий цикл демона: резолвер сброшен, новый пользователь записан стадией users
+    resolver.reload()
+    export_users(FakeUserManager(), 1, reference_cache)
+    lead = convert_lead_json_to_entity(make_lead_json(2, responsible_user_id=11))
+
+    assert resolver.resolve([lead]) == [lead]
+    reference_loads = [name for name in loaded_tables if name not in ("CompanyRepository", "ContactRepository")]
+    assert sorted(reference_loads) == [
+        "LossReasonRepository",
+        "PipelineRepository",
+        "StatusRepository",
+        "UserRepository",
+    ]
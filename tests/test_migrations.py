@@ -0,0 +1,79 @@
+import os
+
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from sqlalchemy import inspect, select, text
+
+from app.db.base import get_engine, get_session
+from app.db.models import Base, Event
+
+ULID = "01j9x3k7qz8w5m2n4p6r8t0v2y"
+
+
+@pytest.fixture
+def alembic_config():
+    # Без файла конфигурации env.py не перенастраивает логирование
+    config = Config()
+    config.set_main_option("script_location", os.path.join(os.path.dirname(__file__), "..", "migrations"))
+    yield config
+    command.downgrade(config, "base")
+    with get_engine().begin() as connection:
+        connection.execute(text("DROP TABLE alembic_version"))
+
+
+def insert_wide_event(event_id: str) -> None:
+    with get_engine().begin() as connection:
+        connection.execute(
+            text(
+                "INSERT INTO events (id, type, entity_id, entity_type, created_by, created_at, account_id) "
+                "VALUES (:id, 'lead_added', 1, 'leads', 0, '2026-10-01 00:00:00', 1)"
+            ),
+            {"id": event_id},
+        )
+
+
+def test_migrations_build_the_model_schema_on_sqlite(alembic_config):
+    command.upgrade(alembic_config, "5b1e0c7a9d42")
+    insert_wide_event(ULID)
+
+    command.upgrade(alembic_config, "head")
+
+    with get_session() as session:
+        assert session.scalars(select(Event.id)).all() == [ULID]
+    with get_engine().connect() as connection:
+        differences = compare_metadata(MigrationContext.configure(connection), Base.metadata)
+    # SQLite отражает BINARY(16) как NUMERIC, это не расхождение схемы
+    assert [
+        difference
+        for difference in differences
+        if not (isinstance(difference, list) and difference[0][0] == "modify_type" and difference[0][3] == "id")
+    ] == []
+
+
+def test_compaction_checks_ids_before_creating_the_table(alembic_config):
+    command.upgrade(alembic_config, "5b1e0c7a9d42")
+    insert_wide_event(ULID)
+    insert_wide_event("legacy-42")
+
+    with pytest.raises(ValueError, match="legacy-42"):
+        command.upgrade(alembic_config, "head")
+
+    with get_engine().connect() as connection:
+        assert "events_compact" not in inspect(connection).get_table_names()
+        assert connection.execute(text("SELECT COUNT(*) FROM events")).scalar() == 2
+
+
+def test_compaction_drops_a_leftover_table(alembic_config):
+    command.upgrade(alembic_config, "5b1e0c7a9d42")
+    insert_wide_event(ULID)
+    # Таблица от прерванного запуска на СУБД без транзакционного DDL
+    with get_engine().begin() as connection:
+        connection.execute(text("CREATE TABLE events_compact (id BLOB)"))
+
+    command.upgrade(alembic_config, "head")
+
+    with get_session() as session:
+        assert session.scalars(select(Event.id)).all() == [ULID]
@@ -0,0 +1,43 @@
+import pytest
+
+from app.db.base import get_session, session_maker
+from app.db.parquet_sink import DELETED_COLUMN, ParquetSink
+from app.db.repositories import CustomFieldValueRepository
+from app.entities import CustomFieldValue
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def make_value(field_id: int, value_text: str) -> CustomFieldValue:
+    return CustomFieldValue(
+        entity_type="leads",
+        entity_id=1,
+        field_id=field_id,
+        position=0,
+        field_type="text",
+        enum_id=None,
+        value_text=value_text,
+        value_number=None,
+        value_bool=None,
+        account_id=1,
+    )
+
+
+def test_removed_custom_field_values_become_tombstones(db, tmp_path):
+    with ParquetSink(str(tmp_path / "parquet")) as sink:
+        sink.attach(session_maker)
+        with get_session() as session:
+            CustomFieldValueRepository(session).replace_for_entities(
+                "leads", [1], [make_value(501, "site"), make_value(502, "ads")]
+            )
+        # Поле 502 очистили в Kommo: строка удаляется из БД, в Parquet остаётся надгробие
+        with get_session() as session:
+            CustomFieldValueRepository(session).replace_for_entities("leads", [1], [make_value(501, "site")])
+
+    files = sorted((tmp_path / "parquet" / "custom_field_values").rglob("*.parquet"))
+    rows = [row for path in files for row in pq.read_table(path).to_pylist()]
+    assert sorted((row["field_id"], row["value_text"], row[DELETED_COLUMN]) for row in rows) == [
+        (501, "site", False),
+        (502, "ads", False),
+        (502, "ads", True),
+    ]
@@ -0,0 +1,19 @@
+from sqlalchemy import select
+
+from app.db.base import get_session
+from app.db.models import User
+from app.db.repositories import UserRepository
+from tests.factories import make_user
+
+
+def test_a_bad_row_is_skipped_and_the_rest_of_the_batch_is_written(db, caplog):
+    users = [make_user(user_id, 1) for user_id in range(1, 9)]
+    # NOT NULL в БД: весь батч падает с IntegrityError и делится пополам до этой строки
+    users[5].name = None
+
+    with get_session() as session:
+        UserRepository(session).save_or_update_all(users)
+
+    with get_session() as session:
+        assert session.scalars(select(User.id).order_by(User.id)).all() == [1, 2, 3, 4, 5, 7, 8]
+    assert "Skipping users row id=6" in caplog.text
@@ -0,0 +1,100 @@
+import json
+import os
+import time
+
+from sqlalchemy import select
+
+from app.config import KommoAccount
+from app.db.base import get_session
+from app.db.models import Lead
+from app.spool import Spool, get_spool_dir, load_spool
+from app.stages.leads import load_deferred_lead_ids
+from tests.factories import make_lead_json, make_pipeline, make_user
+
+DAY = 86400
+
+
+def make_account(tmp_path) -> KommoAccount:
+    return KommoAccount(
+        name="test",
+        url_base="test",
+        integration_id="integration",
+        secret_key="secret",
+        redirect_url="https://example.com",
+        data_dir=str(tmp_path / "data"),
+    )
+
+
+def load_segment(spool: Spool, stage: str) -> None:
+    list(spool.read(stage))
+    spool.commit(stage)
+
+
+def test_retention_counts_from_load_not_from_seal(tmp_path):
+    spool = Spool(str(tmp_path / "spool"))
+    spool.open()
+    spool.append_all("users", [make_user(1, 1)])
+    [name] = spool.segments("users")
+    # Сегмент запечатан давно, а загружен только что: удалять его ещё рано
+    sealed_at = time.time() - 30 * DAY
+    os.utime(os.path.join(spool.path, "users", name), (sealed_at, sealed_at))
+    load_segment(spool, "users")
+
+    assert spool.remove_loaded(7) == 0
+    assert spool.segments("users") == [name]
+
+    spool.loaded_at[f"users/{name}"] = time.time() - 8 * DAY
+    assert spool.remove_loaded(7) == 1
+    assert spool.segments("users") == []
+    assert json.loads((tmp_path / "spool" / "loaded_at.json").read_text()) == {}
+
+
+def test_pending_segments_are_kept_past_retention(tmp_path):
+    spool = Spool(str(tmp_path / "spool"))
+    spool.open()
+    spool.append_all("users", [make_user(1, 1)])
+    spool.loaded_at[f"users/{spool.segments('users')[0]}"] = time.time() - 30 * DAY
+
+    assert spool.remove_loaded(7) == 0
+
+
+def test_deferred_leads_are_saved_and_their_segments_committed(db, app_settings, monkeypatch, tmp_path):
+    monkeypatch.setattr(app_settings, "SPOOL_DIR", str(tmp_path / "spool"))
+    account = make_account(tmp_path)
+    spool = Spool(get_spool_dir(account))
+    spool.open()
+    spool.set_account_id(1)
+    spool.append_all("pipelines", [make_pipeline(20, [30])])
+    # Ответственного пользователя нет ни в БД, ни в спуле, и он так и не появится
+    spool.append_all("leads", [make_lead_json(1, responsible_user_id=999), make_lead_json(2)])
+    spool.append_all("users", [make_user(10, 1)])
+
+    load_spool(account)
+
+    with get_session() as session:
+        assert session.scalars(select(Lead.id)).all() == [2]
+    assert load_deferred_lead_ids(account.deferred_leads_path) == [1]
+    # Сегменты сделок закрыты и истекают по сроку хранения, а не перечитываются каждый запуск
+    spool = Spool(get_spool_dir(account))
+    assert spool.pending_segments("leads") == []
+    spool.loaded_at = {key: time.time() - 30 * DAY for key in spool.loaded_at}
+    assert spool.remove_loaded(7) == 3
+
+
+def test_refetched_deferred_leads_leave_the_saved_ids(db, app_settings, monkeypatch, tmp_path):
+    monkeypatch.setattr(app_settings, "SPOOL_DIR", str(tmp_path / "spool"))
+    account = make_account(tmp_path)
+    os.makedirs(account.data_dir)
+    with open(account.deferred_leads_path, "w") as deferred_file:
+        json.dump([1, 3], deferred_file)
+    spool = Spool(get_spool_dir(account))
+    spool.open()
+    spool.set_account_id(1)
+    spool.append_all("users", [make_user(10, 1), make_user(999, 1)])
+    spool.append_all("pipelines", [make_pipeline(20, [30])])
+    # fetch_to_spool выгрузил сделку 1 заново, её пользователь уже есть; сделка 3 в этот раз не пришла
+    spool.append_all("leads", [make_lead_json(1, responsible_user_id=999)])
+
+    load_spool(account)
+
+    assert load_deferred_lead_ids(account.deferred_leads_path) == [3]
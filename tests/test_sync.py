@@ -0,0 +1,33 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+# Запуск одной сущности доходит до первого обращения к контексту и печатает загруженные модули app
+ENTITY_RUN = """
+import sys
+import app.sync
+try:
+    app.sync.ENTITY_SYNCS[{entity!r}](None, None)
+except AttributeError:
+    pass
+print(" ".join(name for name in sys.modules if name.startswith(("app.", "multiprocessing"))))
+"""
+
+
+@pytest.mark.parametrize("entity", ["users", "pipelines", "companies", "contacts", "tasks", "events"])
+def test_entity_run_does_not_import_the_lead_stage(entity):
+    result = subprocess.run(
+        [sys.executable, "-c", ENTITY_RUN.format(entity=entity)],
+        env={**os.environ, "PYTHONPATH": ROOT},
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    modules = set(result.stdout.split())
+
+    assert f"app.stages.{entity}" in modules
+    assert not modules & {"app.export", "app.stages.leads", "app.lead_pages", "app.fk_resolver", "multiprocessing"}
@@ -0,0 +1,12 @@
+from app.kommo.transport import create_http_client
+
+
+def test_default_client_uses_http2_and_brotli(app_settings):
+    # h2 и brotli - обязательные зависимости, поэтому настройки по умолчанию работают без оговорок
+    client = create_http_client("https://test.kommo.com/")
+    try:
+        assert app_settings.KOMMO_HTTP2
+        assert client._transport._pool._http2
+        assert client.headers["Accept-Encoding"].startswith("br")
+    finally:
+        client.close()